@@ -0,0 +1,163 @@
+import argparse
+import json
+import random
+import time
+
+import chainer
+import numpy as np
+
+from benchmarks.synthetic import generate_document, get_vocab_words
+from model.secnn import SECNN, SECNNLossWrapper
+from preprocess import Preprocessor
+from preprocess.tokens import Tokenizer
+from preprocess.vocab import VOCAB_ENTITIES, VOCAB_POSTAGS
+
+ENCODERS = ['window', 'sentence', 'document']
+
+
+def ranking_accuracy(scores, targets):
+    """Compute the fraction of (salient, non-salient) entity pairs within a document which are ranked correctly.
+
+    Parameters
+    ----------
+    scores : list
+        List of mappings from entities to scores, one for each document.
+    targets : list
+        List of mappings from entities to targets (1 for salient and 0 for non-salient entities).
+
+    Returns
+    -------
+    float
+        The pairwise ranking accuracy (ties count as half), or NaN when there are no pairs.
+    """
+    correct, pairs = 0., 0
+    for document_scores, document_targets in zip(scores, targets):
+        salient = [document_scores[entity] for entity in document_scores if document_targets[entity] == 1.]
+        nonsalient = [document_scores[entity] for entity in document_scores if document_targets[entity] == 0.]
+        for salient_score in salient:
+            for nonsalient_score in nonsalient:
+                correct += 1. if salient_score > nonsalient_score else .5 if salient_score == nonsalient_score else 0.
+                pairs += 1
+    return correct / pairs if pairs > 0 else float('nan')
+
+
+def evaluate(model, examples, batch_size):
+    """Score the test examples and measure the inference time.
+
+    Returns
+    -------
+    dict
+        The inference time, the mean squared error and the ranking accuracy.
+    """
+    scores = []
+    start_time = time.perf_counter()
+    for start in range(0, len(examples), batch_size):
+        batch = examples[start:start + batch_size]
+        scores += model.predict([example[model.input_key] for example in batch])
+    seconds = time.perf_counter() - start_time
+
+    targets = [example['targets'] for example in examples]
+    errors = [(document_scores[entity] - document_targets[entity]) ** 2
+              for document_scores, document_targets in zip(scores, targets) for entity in document_scores]
+    return {
+        'inference_seconds': seconds,
+        'mse': float(np.mean(errors)),
+        'ranking_accuracy': ranking_accuracy(scores, targets)
+    }
+
+
+def count_encoded_tokens(model, example):
+    """Count the number of tokens run through the LSTM for an example (including padding)."""
+    if model.encoder == 'window':
+        return sum(windows.shape[0] * windows.shape[1] for windows in example['document'].values())
+    rows, row_len, _ = model.pack_sequences([example['sequence']])['ids'].shape
+    return rows * row_len
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare the training cost, inference cost and accuracy of the window, sentence and document '
+                    'encoders of the model on synthetic documents.')
+    parser.add_argument('--encoders', default=ENCODERS, nargs='+', choices=ENCODERS,
+                        help='Encoders to compare.')
+    parser.add_argument('--train_documents', default=200, type=int,
+                        help='Number of training documents.')
+    parser.add_argument('--test_documents', default=50, type=int,
+                        help='Number of test documents.')
+    parser.add_argument('--tokens', default=500, type=int,
+                        help='Approximate number of tokens per document.')
+    parser.add_argument('--entities', default=20, type=int,
+                        help='Number of distinct entities per document.')
+    parser.add_argument('--mentions_per_entity', default=3, type=int,
+                        help='Number of mentions of each non-salient entity.')
+    parser.add_argument('--salient', default=3, type=int,
+                        help='Number of salient entities per document.')
+    parser.add_argument('--cue_probability', default=.5, type=float,
+                        help='Probability that a mention of a salient entity is preceded by a cue word (which makes '
+                             'salience learnable from the context).')
+    parser.add_argument('--epochs', default=3, type=int,
+                        help='Number of training epochs.')
+    parser.add_argument('--batch_size', default=8, type=int,
+                        help='Number of documents per minibatch.')
+    parser.add_argument('--output', default='',
+                        help='Path to the JSON file in which the results are stored.')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='Seed of the random number generators.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    # Create and preprocess the documents (the preprocessor output contains the inputs of all encoders)
+    vocab_words = get_vocab_words()
+    tokenizer = Tokenizer(vocab_words={word: index for index, word in enumerate(vocab_words)},
+                          vocab_postags={postag: index for index, postag in enumerate(VOCAB_POSTAGS)},
+                          vocab_entities={entity: index for index, entity in enumerate(VOCAB_ENTITIES)})
+    preprocessor = Preprocessor(tokenizer)
+    examples = [preprocessor(generate_document(rng, tokens=args.tokens, entities=args.entities,
+                                               mentions_per_entity=args.mentions_per_entity, salient=args.salient,
+                                               cue_probability=args.cue_probability))
+                for _ in range(args.train_documents + args.test_documents)]
+    train_examples, test_examples = examples[:args.train_documents], examples[args.train_documents:]
+
+    results = []
+    print('%-10s %14s %16s %14s %10s %10s' % ('encoder', 'train (s/epoch)', 'inference (doc/s)', 'tokens/doc',
+                                             'test mse', 'ranking'))
+    for encoder in args.encoders:
+        # Start every encoder from the same random initialization
+        np.random.seed(args.seed)
+        model = SECNN(
+            config_word={'in_size': len(vocab_words), 'out_size': 300},
+            config_postag={'in_size': len(VOCAB_POSTAGS), 'out_size': 32},
+            config_entity={'in_size': len(VOCAB_ENTITIES), 'out_size': 32},
+            config_rnn={'in_size': None, 'out_size': 64},
+            config_affine={'in_size': None, 'out_size': 1},
+            batched=True,
+            encoder=encoder,
+        )
+        loss_model = SECNNLossWrapper(model)
+        optimizer = chainer.optimizers.Adam()
+        optimizer.setup(model)
+        model.embed_word.disable_update()
+
+        train_seconds = 0.
+        order = np.random.RandomState(args.seed)
+        for epoch in range(args.epochs):
+            permutation = order.permutation(len(train_examples))
+            start_time = time.perf_counter()
+            for start in range(0, len(permutation), args.batch_size):
+                batch = [train_examples[index] for index in permutation[start:start + args.batch_size]]
+                optimizer.update(loss_model, batch)
+            train_seconds += time.perf_counter() - start_time
+
+        result = {'encoder': encoder, 'train_seconds_per_epoch': train_seconds / args.epochs,
+                  'encoded_tokens_per_document': float(np.mean([count_encoded_tokens(model, example)
+                                                                for example in test_examples]))}
+        result.update(evaluate(model, test_examples, args.batch_size))
+        results.append(result)
+        print('%-10s %14.3f %16.1f %14.0f %10.4f %10.3f' % (
+            encoder, result['train_seconds_per_epoch'], len(test_examples) / result['inference_seconds'],
+            result['encoded_tokens_per_document'], result['mse'], result['ranking_accuracy']))
+
+    if args.output:
+        with open(args.output, 'w') as output_handle:
+            json.dump({'config': vars(args), 'results': results}, output_handle, indent=2)
@@ -0,0 +1,109 @@
+import argparse
+import copy
+import random
+import time
+
+from preprocess import align_entities, cluster_entities, normalize_entity, tokens_to_text
+
+NAMES = ['Angela Merkel', 'Barack Obama', 'Société Générale', 'São Paulo', 'New York', 'European Union',
+         'Mark Rutte', 'Apple', 'Google', 'Amsterdam', 'Zoë Kravitz', 'Ünited Nations']
+
+
+def align_entities_pairwise(entity_labels, entities):
+    """Reference implementation of align_entities comparing every entity with every label."""
+    for index, nlp_entity in enumerate(entities):
+        text = tokens_to_text(nlp_entity)
+        for entity_label in entity_labels:
+            if normalize_entity.__wrapped__(text) == normalize_entity.__wrapped__(entity_label):
+                for subindex, token in enumerate(nlp_entity):
+                    entities[index][subindex]['aligned_with'] = entity_label
+    return entities
+
+
+def cluster_entities_pairwise(entities):
+    """Reference implementation of cluster_entities comparing every pair of entities."""
+    current_index = 1
+    for index, entity in enumerate(entities):
+        entity[0]['label'] = '@entity%d' % current_index
+        current_index += 1
+    for index1, entity1 in enumerate(entities):
+        for index2, entity2 in enumerate(entities[index1 + 1:]):
+            if normalize_entity.__wrapped__(tokens_to_text(entity2)) == normalize_entity.__wrapped__(
+                    tokens_to_text(entity1)):
+                entity2[0]['label'] = entity1[0]['label']
+    return entities
+
+
+def generate_entities(mentions_count, distinct_count, rng):
+    """Generate entity mentions (lists of tokens) drawn from a pool of distinct names with varying spelling.
+
+    Parameters
+    ----------
+    mentions_count : int
+        Number of entity mentions.
+    distinct_count : int
+        Number of distinct entities.
+    rng : random.Random
+        The random number generator.
+
+    Returns
+    -------
+    list
+        A list of entities (see the get_entities method).
+    list
+        A list of entity labels containing half of the distinct entities.
+    """
+    names = ['%s %d' % (NAMES[index % len(NAMES)], index) for index in range(distinct_count)]
+    entities = []
+    for _ in range(mentions_count):
+        name = rng.choice(names)
+        name = name.upper() if rng.random() < .2 else name
+        entities.append([{'word': word, 'ner': 'PERSON', 'pos': 'NNP'} for word in name.split(' ')])
+    return entities, names[::2]
+
+
+def measure(function, inputs, repeats):
+    """Measure the fastest run time of a function over fresh copies of the inputs."""
+    timings = []
+    for _ in range(repeats):
+        arguments = copy.deepcopy(inputs)
+        normalize_entity.cache_clear()
+        start_time = time.perf_counter()
+        output = function(*arguments)
+        timings.append(time.perf_counter() - start_time)
+    return min(timings), output
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare the run time of the hash-indexed entity alignment and clustering with the pairwise '
+                    'reference implementations on documents with many entity mentions.')
+    parser.add_argument('--mentions', default=[10, 100, 300, 1000], type=int, nargs='+',
+                        help='Numbers of entity mentions per document.')
+    parser.add_argument('--distinct_ratio', default=.3, type=float,
+                        help='Number of distinct entities relative to the number of mentions.')
+    parser.add_argument('--repeats', default=3, type=int,
+                        help='Number of runs of which the fastest is reported.')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='Seed of the random number generator.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print('%10s %12s %12s %10s %12s %12s %10s' % ('mentions', 'align (ref)', 'align', 'speedup',
+                                                   'cluster (ref)', 'cluster', 'speedup'))
+    for mentions_count in args.mentions:
+        entities, entity_labels = generate_entities(mentions_count, max(1, int(mentions_count * args.distinct_ratio)),
+                                                    rng)
+
+        align_reference, aligned_reference = measure(align_entities_pairwise, (entity_labels, entities), args.repeats)
+        align_time, aligned = measure(align_entities, (entity_labels, entities), args.repeats)
+        cluster_reference, clustered_reference = measure(cluster_entities_pairwise, (entities,), args.repeats)
+        cluster_time, clustered = measure(cluster_entities, (entities,), args.repeats)
+
+        if aligned != aligned_reference or clustered != clustered_reference:
+            raise AssertionError('The output differs from the reference implementation for %d mentions'
+                                 % mentions_count)
+
+        print('%10d %11.4fs %11.4fs %9.1fx %11.4fs %11.4fs %9.1fx' % (
+            mentions_count, align_reference, align_time, align_reference / align_time,
+            cluster_reference, cluster_time, cluster_reference / cluster_time))
@@ -0,0 +1,52 @@
+import argparse
+import json
+import threading
+import time
+
+import numpy as np
+import requests
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Load test the scoring service (serve.py) by posting a document from concurrent clients.')
+    parser.add_argument('document',
+                        help='Path to a preprocessed JSON document (containing the nlp_data field).')
+    parser.add_argument('--url', default='http://127.0.0.1:8080',
+                        help='URL of the scoring service.')
+    parser.add_argument('--concurrency', default=8, type=int,
+                        help='Number of concurrent clients.')
+    parser.add_argument('--requests', default=100, type=int,
+                        help='Number of requests per client.')
+    args = parser.parse_args()
+
+    with open(args.document, 'r') as document_handle:
+        body = json.dumps(json.load(document_handle)).encode('utf-8')
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def run_client():
+        session = requests.Session()
+        for _ in range(args.requests):
+            start_time = time.perf_counter()
+            response = session.post(args.url + '/score', data=body)
+            latency = time.perf_counter() - start_time
+            with lock:
+                latencies.append(latency)
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+
+    clients = [threading.Thread(target=run_client) for _ in range(args.concurrency)]
+    start_time = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start_time
+
+    p50, p90, p99 = np.percentile(np.array(latencies) * 1000., [50, 90, 99])
+    print('%d requests in %.2f seconds (%.1f requests/sec, %d errors)' % (len(latencies), elapsed,
+                                                                         len(latencies) / elapsed, len(errors)))
+    print('Client latency: p50 %.1f ms, p90 %.1f ms, p99 %.1f ms' % (p50, p90, p99))
+    print('Server stats: %s' % json.dumps(requests.get(args.url + '/stats').json()))
@@ -0,0 +1,134 @@
+import argparse
+import json
+import random
+import time
+
+import chainer
+import numpy as np
+from chainer import training
+from chainer.iterators import SerialIterator
+
+from benchmarks.synthetic import generate_document, get_vocab_words
+from model.parallel import CPUParallelUpdater
+from model.secnn import SECNN, SECNNLossWrapper
+from preprocess import Preprocessor
+from preprocess.tokens import Tokenizer
+from preprocess.vocab import VOCAB_ENTITIES, VOCAB_POSTAGS
+
+
+def measure_throughput(examples, vocab_size, workers, hogwild, batch_size, iterations, seed):
+    """Train the model for a number of iterations and measure the throughput.
+
+    Parameters
+    ----------
+    examples : list
+        The preprocessed training documents.
+    vocab_size : int
+        Number of words in the vocabulary.
+    workers : int
+        Number of worker processes (0 for the standard updater in the main process).
+    hogwild : bool
+        Whether the workers update the parameters asynchronously.
+    batch_size : int
+        Number of documents per minibatch.
+    iterations : int
+        Number of timed iterations (after one warm-up iteration, which also forks the workers).
+    seed : int
+        Seed of the random number generator.
+
+    Returns
+    -------
+    dict
+        The throughput in documents per second and the mean training loss of the timed iterations.
+    """
+    np.random.seed(seed)
+    model = SECNN(
+        config_word={'in_size': vocab_size, 'out_size': 300},
+        config_postag={'in_size': len(VOCAB_POSTAGS), 'out_size': 32},
+        config_entity={'in_size': len(VOCAB_ENTITIES), 'out_size': 32},
+        config_rnn={'in_size': None, 'out_size': 64},
+        config_affine={'in_size': None, 'out_size': 1},
+        batched=True,
+    )
+    loss_model = SECNNLossWrapper(model)
+    optimizer = chainer.optimizers.SGD()
+    optimizer.setup(model)
+    model.embed_word.disable_update()
+
+    iterator = SerialIterator(examples, batch_size=batch_size, repeat=True, shuffle=True)
+    if workers > 0:
+        updater = CPUParallelUpdater(iterator, optimizer, converter=lambda *arguments: arguments[0],
+                                     loss_func=loss_model.__call__, n_workers=workers, hogwild=hogwild)
+    else:
+        updater = training.StandardUpdater(iterator, optimizer, converter=lambda *arguments: arguments[0],
+                                           loss_func=loss_model.__call__, device=-1)
+
+    reporter = chainer.Reporter()
+    reporter.add_observer('main', loss_model)
+    reporter.add_observer('main', model)
+    summary = chainer.reporter.DictSummary()
+    try:
+        with reporter.scope({}):
+            updater.update()
+        start_time = time.perf_counter()
+        for _ in range(iterations):
+            observation = {}
+            with reporter.scope(observation):
+                updater.update()
+            summary.add(observation)
+        seconds = time.perf_counter() - start_time
+    finally:
+        updater.finalize()
+    return {'docs_per_second': iterations * batch_size / seconds,
+            'loss': float(summary.compute_mean().get('main/loss', float('nan')))}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Measure the training throughput and scaling efficiency of the CPU data-parallel updater for an '
+                    'increasing number of worker processes on synthetic documents.')
+    parser.add_argument('--workers', default=[1, 2, 4], type=int, nargs='+',
+                        help='Numbers of worker processes.')
+    parser.add_argument('--hogwild', action='store_true',
+                        help='Let the workers update the parameters asynchronously.')
+    parser.add_argument('--documents', default=200, type=int,
+                        help='Number of training documents.')
+    parser.add_argument('--tokens', default=1000, type=int,
+                        help='Approximate number of tokens per document.')
+    parser.add_argument('--entities', default=20, type=int,
+                        help='Number of distinct entities per document.')
+    parser.add_argument('--batch_size', default=16, type=int,
+                        help='Number of documents per minibatch.')
+    parser.add_argument('--iterations', default=20, type=int,
+                        help='Number of timed iterations.')
+    parser.add_argument('--output', default='',
+                        help='Path to the JSON file in which the results are stored.')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='Seed of the random number generators.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocab_words = get_vocab_words()
+    tokenizer = Tokenizer(vocab_words={word: index for index, word in enumerate(vocab_words)},
+                          vocab_postags={postag: index for index, postag in enumerate(VOCAB_POSTAGS)},
+                          vocab_entities={entity: index for index, entity in enumerate(VOCAB_ENTITIES)})
+    preprocessor = Preprocessor(tokenizer)
+    examples = [preprocessor(generate_document(rng, tokens=args.tokens, entities=args.entities))
+                for _ in range(args.documents)]
+
+    # The efficiency is the speedup over the main process divided by the number of workers
+    results = []
+    print('%8s %12s %10s %12s %10s' % ('workers', 'docs/sec', 'speedup', 'efficiency', 'loss'))
+    for workers in [0] + [workers for workers in args.workers if workers > 0]:
+        result = measure_throughput(examples, len(vocab_words), workers, args.hogwild, args.batch_size,
+                                    args.iterations, args.seed)
+        result['workers'] = workers
+        result['speedup'] = result['docs_per_second'] / results[0]['docs_per_second'] if workers > 0 else 1.
+        result['efficiency'] = result['speedup'] / workers if workers > 0 else 1.
+        results.append(result)
+        print('%8s %12.1f %9.2fx %11.0f%% %10.4f' % (workers if workers > 0 else 'main', result['docs_per_second'],
+                                                   result['speedup'], 100 * result['efficiency'], result['loss']))
+
+    if args.output:
+        with open(args.output, 'w') as output_handle:
+            json.dump({'config': vars(args), 'results': results}, output_handle, indent=2)
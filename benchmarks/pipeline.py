@@ -0,0 +1,185 @@
+import argparse
+import copy
+import json
+import random
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.synthetic import generate_document, get_vocab_words
+from model.secnn import SECNN, SECNNLossWrapper
+from preprocess import Preprocessor, align_entities, cluster_entities
+from preprocess.table import TokenTable
+from preprocess.tokens import Tokenizer
+from preprocess.vocab import VOCAB_ENTITIES, VOCAB_POSTAGS
+
+
+def measure(function, prepare, repeats):
+    """Measure the fastest run time and the peak memory of a function.
+
+    Parameters
+    ----------
+    function : callable
+        The function to measure, called with the arguments returned by prepare.
+    prepare : callable
+        Function returning a fresh tuple of arguments for every run (not included in the measurements).
+    repeats : int
+        Number of timed runs.
+
+    Returns
+    -------
+    float
+        The fastest run time in seconds.
+    int
+        The peak memory allocated during a separate (traced) run in bytes.
+    """
+    timings = []
+    for _ in range(repeats):
+        arguments = prepare()
+        start_time = time.perf_counter()
+        function(*arguments)
+        timings.append(time.perf_counter() - start_time)
+
+    arguments = prepare()
+    tracemalloc.start()
+    function(*arguments)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak
+
+
+def get_stages(document, tokenizer, preprocessor, models):
+    """Get the stages of the pipeline for a document.
+
+    The preprocessing stages call the same functions and methods as the Preprocessor (with the names of its
+    instrumented stages), so the benchmark shows the effect of changes to the preprocessing and the tokenizer.
+
+    Parameters
+    ----------
+    document : dict
+        A (synthetic) document containing the nlp_data field.
+    tokenizer : Tokenizer
+        The tokenizer.
+    preprocessor : Preprocessor
+        The preprocessor.
+    models : dict
+        A mapping from model names to SECNN models.
+
+    Returns
+    -------
+    list
+        A list of (name, function, prepare) tuples (see the measure method).
+    """
+    labels = document['salient_entities'] + document['nonsalient_entities']
+
+    # Compute the input of each stage once using the preceding stages (the stages are the ones the preprocessor runs)
+    table = TokenTable.from_corenlp(document['nlp_data'])
+    spans = table.get_entity_spans()
+    entities = align_entities(labels, [table.get_tokens(start, end) for start, end in spans])
+    aligned = [index for index, entity in enumerate(entities) if 'aligned_with' in entity[0]]
+    clustered = cluster_entities(copy.deepcopy([entities[index] for index in aligned]))
+    aligned_spans = [spans[index] for index in aligned]
+    replaced_table = TokenTable.from_corenlp(document['nlp_data'])
+    positions = replaced_table.replace_entities(aligned_spans, copy.deepcopy(clustered))
+    token_ids = tokenizer.tokenize_columns(replaced_table.words, replaced_table.postags)
+    example = preprocessor(copy.deepcopy(document))
+
+    def run_get_entities(table):
+        return [table.get_tokens(start, end) for start, end in table.get_entity_spans()]
+
+    def run_replace_entities(table, entities):
+        return table.replace_entities(aligned_spans, entities)
+
+    def run_forward(model, example):
+        return SECNNLossWrapper(model)([example])
+
+    def run_forward_backward(model, example):
+        model.cleargrads()
+        SECNNLossWrapper(model)([example]).backward()
+
+    stages = [
+        ('corenlp_to_tokens', TokenTable.from_corenlp, lambda: (document['nlp_data'],)),
+        ('get_entities', run_get_entities, lambda: (table,)),
+        ('align_entities', align_entities, lambda: (labels, copy.deepcopy(entities))),
+        ('cluster_entities', cluster_entities, lambda: (copy.deepcopy([entities[index] for index in aligned]),)),
+        ('replace_entities', run_replace_entities,
+         lambda: (TokenTable.from_corenlp(document['nlp_data']), copy.deepcopy(clustered))),
+        ('tokenize_document', tokenizer.tokenize_columns, lambda: (replaced_table.words, replaced_table.postags)),
+        ('get_entity_windows', preprocessor.get_entity_windows, lambda: (replaced_table, token_ids, dict(positions))),
+        ('Preprocessor', preprocessor, lambda: (copy.deepcopy(document),)),
+    ]
+    for name, model in models.items():
+        stages += [
+            ('forward (%s)' % name, run_forward, lambda model=model: (model, example)),
+            ('forward+backward (%s)' % name, run_forward_backward, lambda model=model: (model, example)),
+        ]
+    return stages
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Measure the run time and peak memory of every stage of the pipeline (preprocessing, tokenization '
+                    'and the forward and backward passes of the model) on synthetic documents of increasing size.')
+    parser.add_argument('--tokens', default=[250, 1000, 4000], type=int, nargs='+',
+                        help='Numbers of tokens per document.')
+    parser.add_argument('--entities_per_1000_tokens', default=20, type=int,
+                        help='Number of distinct entities per 1000 tokens.')
+    parser.add_argument('--mentions_per_entity', default=3, type=int,
+                        help='Number of mentions of each non-salient entity.')
+    parser.add_argument('--salient', default=3, type=int,
+                        help='Number of salient entities per document.')
+    parser.add_argument('--repeats', default=3, type=int,
+                        help='Number of runs of which the fastest is reported.')
+    parser.add_argument('--output', default='',
+                        help='Path to the JSON file in which the results are stored.')
+    parser.add_argument('--compare', default='',
+                        help='Path to the JSON results of an earlier run to compare with.')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='Seed of the random number generators.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    np.random.seed(args.seed)
+
+    # Create the tokenizer, the preprocessor and the models (using random word embeddings)
+    vocab_words = get_vocab_words()
+    tokenizer = Tokenizer(vocab_words={word: index for index, word in enumerate(vocab_words)},
+                          vocab_postags={postag: index for index, postag in enumerate(VOCAB_POSTAGS)},
+                          vocab_entities={entity: index for index, entity in enumerate(VOCAB_ENTITIES)})
+    preprocessor = Preprocessor(tokenizer)
+    models = {}
+    for name, batched in [('windowed', False), ('batched', True)]:
+        models[name] = SECNN(
+            config_word={'in_size': len(vocab_words), 'out_size': 300},
+            config_postag={'in_size': len(VOCAB_POSTAGS), 'out_size': 32},
+            config_entity={'in_size': len(VOCAB_ENTITIES), 'out_size': 32},
+            config_rnn={'in_size': None, 'out_size': 64},
+            config_affine={'in_size': None, 'out_size': 1},
+            batched=batched,
+        )
+        models[name].embed_word.disable_update()
+
+    reference = {}
+    if args.compare:
+        with open(args.compare, 'r') as compare_handle:
+            reference = {(result['tokens'], result['stage']): result for result in json.load(compare_handle)['results']}
+
+    results = []
+    print('%8s %-28s %12s %14s %10s' % ('tokens', 'stage', 'time', 'peak memory', 'speedup'))
+    for tokens_count in args.tokens:
+        entities_count = max(args.salient + 1, tokens_count * args.entities_per_1000_tokens // 1000)
+        document = generate_document(rng, tokens=tokens_count, entities=entities_count,
+                                     mentions_per_entity=args.mentions_per_entity, salient=args.salient)
+        for stage, function, prepare in get_stages(document, tokenizer, preprocessor, models):
+            seconds, peak = measure(function, prepare, args.repeats)
+            results.append({'tokens': tokens_count, 'entities': entities_count, 'stage': stage, 'seconds': seconds,
+                            'peak_bytes': peak})
+            speedup = ''
+            if (tokens_count, stage) in reference:
+                speedup = '%.2fx' % (reference[(tokens_count, stage)]['seconds'] / seconds)
+            print('%8d %-28s %11.4fs %11.1f MB %10s' % (tokens_count, stage, seconds, peak / 2 ** 20, speedup))
+
+    if args.output:
+        with open(args.output, 'w') as output_handle:
+            json.dump({'config': vars(args), 'results': results}, output_handle, indent=2)
@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+
+import chainer
+import numpy as np
+
+from benchmarks.encoders import ranking_accuracy
+from benchmarks.synthetic import generate_document, get_vocab_words
+from model.runtime import WEIGHT_MATRICES, NumpySECNN, export_model, load_arrays, quantize_arrays
+from model.secnn import SECNN, SECNNLossWrapper
+from preprocess import Preprocessor
+from preprocess.corpus import iter_documents
+from preprocess.tokens import Tokenizer
+from preprocess.vocab import VOCAB_ENTITIES, VOCAB_POSTAGS
+
+CONFIGURATIONS = ['float32/float32', 'float16/float32', 'int8/float32', 'float16/float16', 'int8/int8']
+
+
+def ranking_agreement(reference, scores):
+    """Compute the fraction of entity pairs within a document which are ordered the same as by the reference scores.
+
+    Parameters
+    ----------
+    reference : list
+        List of mappings from entities to the reference scores, one for each document.
+    scores : list
+        List of mappings from entities to scores, one for each document.
+
+    Returns
+    -------
+    float
+        The fraction of pairs (pairs tied in one of both scores count as half), or NaN when there are no pairs.
+    """
+    agreeing, pairs = 0., 0
+    for document_reference, document_scores in zip(reference, scores):
+        entities = list(document_reference)
+        for index, first in enumerate(entities):
+            for second in entities[index + 1:]:
+                sign = np.sign(document_reference[first] - document_reference[second]) * np.sign(
+                    document_scores[first] - document_scores[second])
+                agreeing += 1. if sign > 0 else .5 if sign == 0 else 0.
+                pairs += 1
+    return agreeing / pairs if pairs > 0 else float('nan')
+
+
+def get_parameter_bytes(arrays):
+    """Get the number of bytes of the word embeddings and of the other parameters (including the scales).
+
+    Returns
+    -------
+    int
+        Bytes of the word embeddings.
+    int
+        Bytes of the other weight matrices and biases.
+    """
+    embedding_bytes = sum(arrays[name].nbytes for name in ['embed_word', 'embed_word_scale'] if name in arrays)
+    weight_names = WEIGHT_MATRICES + [name + '_scale' for name in WEIGHT_MATRICES] + ['lstm_upward_b', 'affine_b']
+    return embedding_bytes, sum(arrays[name].nbytes for name in weight_names if name in arrays)
+
+
+def train_synthetic_model(args):
+    """Train a model on synthetic documents and export it.
+
+    Returns
+    -------
+    dict
+        The arrays of the exported full-precision model.
+    list
+        The preprocessed held-out documents.
+    """
+    rng = random.Random(args.seed)
+    np.random.seed(args.seed)
+    vocab_words = get_vocab_words()
+    tokenizer = Tokenizer(vocab_words={word: index for index, word in enumerate(vocab_words)},
+                          vocab_postags={postag: index for index, postag in enumerate(VOCAB_POSTAGS)},
+                          vocab_entities={entity: index for index, entity in enumerate(VOCAB_ENTITIES)})
+    preprocessor = Preprocessor(tokenizer)
+    examples = [preprocessor(generate_document(rng, tokens=args.tokens, entities=args.entities, cue_probability=.5))
+                for _ in range(args.train_documents + args.test_documents)]
+
+    model = SECNN(
+        config_word={'in_size': len(vocab_words), 'out_size': 300},
+        config_postag={'in_size': len(VOCAB_POSTAGS), 'out_size': 32},
+        config_entity={'in_size': len(VOCAB_ENTITIES), 'out_size': 32},
+        config_rnn={'in_size': None, 'out_size': 64},
+        config_affine={'in_size': None, 'out_size': 1},
+        batched=True,
+    )
+    loss_model = SECNNLossWrapper(model)
+    optimizer = chainer.optimizers.Adam()
+    optimizer.setup(model)
+    model.embed_word.disable_update()
+    for _ in range(args.epochs):
+        for start in range(0, args.train_documents, 8):
+            optimizer.update(loss_model, examples[start:min(start + 8, args.train_documents)])
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'model.npz')
+        export_model(model, path)
+        arrays = load_arrays(path, mmap_mode=None)
+    return arrays, examples[args.train_documents:]
+
+
+def load_held_out_documents(path, arrays, count):
+    """Preprocess the first documents of a corpus using the vocabulary of an exported model.
+
+    Returns
+    -------
+    list
+        The preprocessed documents.
+    """
+    vocab_words = NumpySECNN(arrays).get_vocab_words()
+    if vocab_words is None:
+        raise ValueError('The exported model does not contain the word vocabulary')
+    tokenizer = Tokenizer(vocab_words={word: index for index, word in enumerate(vocab_words)},
+                          vocab_postags={postag: index for index, postag in enumerate(VOCAB_POSTAGS)},
+                          vocab_entities={entity: index for index, entity in enumerate(VOCAB_ENTITIES)})
+    preprocessor = Preprocessor(tokenizer)
+    examples = []
+    for _, data in iter_documents(path):
+        if len(examples) == count:
+            break
+        examples.append(preprocessor(data))
+    return examples
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare the memory footprint and the scores of quantized models (word embeddings/other weights) '
+                    'with the full-precision model on held-out documents. By default, a model is trained on synthetic '
+                    'documents; use the model and input arguments for a model exported by the export_model script.')
+    parser.add_argument('--model', default='',
+                        help='Path to a full-precision model exported by the export_model script.')
+    parser.add_argument('--input', default='',
+                        help='Path to the held-out annotated documents (required with the model argument).')
+    parser.add_argument('--configurations', default=CONFIGURATIONS, nargs='+',
+                        help='Precisions of the word embeddings and the other weights to compare.')
+    parser.add_argument('--train_documents', default=200, type=int,
+                        help='Number of synthetic training documents.')
+    parser.add_argument('--test_documents', default=100, type=int,
+                        help='Number of held-out documents.')
+    parser.add_argument('--tokens', default=500, type=int,
+                        help='Approximate number of tokens per synthetic document.')
+    parser.add_argument('--entities', default=20, type=int,
+                        help='Number of distinct entities per synthetic document.')
+    parser.add_argument('--epochs', default=3, type=int,
+                        help='Number of training epochs on the synthetic documents.')
+    parser.add_argument('--output', default='',
+                        help='Path to the JSON file in which the results are stored.')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='Seed of the random number generators.')
+    args = parser.parse_args()
+
+    if args.model:
+        if not args.input:
+            parser.error('the --input argument is required with the --model argument')
+        reference_arrays = load_arrays(args.model, mmap_mode=None)
+        quantized = any(name.endswith('_scale') for name in reference_arrays)
+        if quantized or reference_arrays['embed_word'].dtype != np.float32:
+            parser.error('the model must be exported with full precision')
+        examples = load_held_out_documents(args.input, reference_arrays, args.test_documents)
+    else:
+        reference_arrays, examples = train_synthetic_model(args)
+
+    reference_model = NumpySECNN(reference_arrays)
+    inputs = [example[reference_model.input_key] for example in examples]
+    reference = reference_model.predict(inputs)
+    targets = [example.get('targets') for example in examples]
+    has_targets = all(document_targets is not None for document_targets in targets)
+
+    results = []
+    print('%-16s %14s %14s %12s %12s %10s %10s' % ('words/weights', 'embeddings', 'weights', 'max error',
+                                                   'mean error', 'agreement', 'ranking'))
+    for configuration in args.configurations:
+        embeddings, weights = configuration.split('/')
+        arrays = quantize_arrays(reference_arrays, embeddings=embeddings, weights=weights)
+        scores = NumpySECNN(arrays).predict(inputs)
+        errors = [abs(document_scores[entity] - document_reference[entity])
+                  for document_scores, document_reference in zip(scores, reference) for entity in document_reference]
+        embedding_bytes, weight_bytes = get_parameter_bytes(arrays)
+        result = {
+            'embeddings': embeddings,
+            'weights': weights,
+            'embedding_bytes': embedding_bytes,
+            'weight_bytes': weight_bytes,
+            'max_abs_error': float(np.max(errors)) if len(errors) > 0 else 0.,
+            'mean_abs_error': float(np.mean(errors)) if len(errors) > 0 else 0.,
+            'ranking_agreement': ranking_agreement(reference, scores),
+            'ranking_accuracy': ranking_accuracy(scores, targets) if has_targets else float('nan')
+        }
+        results.append(result)
+        print('%-16s %11.2f MB %11.3f MB %12.2e %12.2e %10.4f %10.4f' % (
+            configuration, embedding_bytes / 2 ** 20, weight_bytes / 2 ** 20, result['max_abs_error'],
+            result['mean_abs_error'], result['ranking_agreement'], result['ranking_accuracy']))
+
+    if args.output:
+        with open(args.output, 'w') as output_handle:
+            json.dump({'config': vars(args), 'results': results}, output_handle, indent=2)
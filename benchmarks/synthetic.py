@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import random
+
+from preprocess.corpus import JSONLShardWriter
+
+FILLER_WORDS = [('the', 'DT'), ('a', 'DT'), ('report', 'NN'), ('company', 'NN'), ('said', 'VBD'), ('on', 'IN'),
+                ('in', 'IN'), ('and', 'CC'), ('market', 'NN'), ('shares', 'NNS'), ('new', 'JJ'), ('was', 'VBD'),
+                ('will', 'MD'), ('meet', 'VB'), ('talks', 'NNS'), ('of', 'IN'), ('government', 'NN'), ('its', 'PRP$'),
+                ('last', 'JJ'), ('year', 'NN'), ('officials', 'NNS'), ('expected', 'VBN'), ('to', 'TO'),
+                ('growth', 'NN'), ('with', 'IN'), ('after', 'IN'), ('rose', 'VBD'), ('percent', 'NN'),
+                (',', ','), ('.', '.')]
+
+NER_TAGS = ['PERSON', 'ORGANIZATION', 'LOCATION']
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'sen', 'tor', 'vel', 'zu', 'an', 'bre', 'cé', 'dö', 'fi', 'gar', 'hol']
+
+
+def generate_name(rng):
+    """Generate a random entity name of one to three capitalized pseudo-words."""
+    words = [''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))) for _ in range(rng.randint(1, 3))]
+    return ' '.join(word.capitalize() for word in words)
+
+
+def generate_document(rng, tokens=500, entities=20, mentions_per_entity=3, salient=3, salient_boost=2,
+                      sentence_length=20, cue_probability=0.):
+    """Generate a synthetic document containing the fields produced by the preprocess_nlp.py script.
+
+    Parameters
+    ----------
+    rng : random.Random
+        The random number generator.
+    tokens : int, optional
+        Approximate number of tokens in the document (default: 500).
+    entities : int, optional
+        Number of distinct entities (default: 20).
+    mentions_per_entity : int, optional
+        Number of mentions of each non-salient entity (default: 3).
+    salient : int, optional
+        Number of salient entities (default: 3).
+    salient_boost : int, optional
+        Factor by which salient entities are mentioned more often than non-salient entities (default: 2), such that
+        salience can be learned from the data.
+    sentence_length : int, optional
+        Approximate number of tokens per sentence (default: 20).
+    cue_probability : float, optional
+        Probability that a mention of a salient entity is preceded by the cue word 'said' (default: 0), such that
+        salience can be learned from the context of the mentions.
+
+    Returns
+    -------
+    dict
+        A document containing the 'text', 'nlp_data', 'salient_entities' and 'nonsalient_entities' fields.
+    """
+    names = []
+    while len(names) < entities:
+        name = generate_name(rng)
+        if name not in names:
+            names.append(name)
+    ners = [rng.choice(NER_TAGS) for _ in names]
+
+    # Interleave the mentions with filler tokens, keeping at least one filler token between two mentions
+    mentions = [index for index in range(entities)
+                for _ in range(mentions_per_entity * (salient_boost if index < salient else 1))]
+    rng.shuffle(mentions)
+    mention_tokens = sum(len(names[index].split(' ')) for index in mentions)
+    filler_count = max(len(mentions), tokens - mention_tokens)
+    slots = set(rng.sample(range(filler_count), len(mentions)))
+
+    sentences, sentence = [], []
+    mention_iterator = iter(mentions)
+    for filler_index in range(filler_count):
+        word, postag = rng.choice(FILLER_WORDS)
+        sentence.append({'originalText': word, 'pos': postag, 'ner': 'O'})
+        if filler_index in slots:
+            index = next(mention_iterator)
+            if cue_probability > 0 and index < salient and rng.random() < cue_probability:
+                sentence[-1] = {'originalText': 'said', 'pos': 'VBD', 'ner': 'O'}
+            sentence += [{'originalText': word, 'pos': 'NNP', 'ner': ners[index]}
+                         for word in names[index].split(' ')]
+        if len(sentence) >= sentence_length:
+            sentence.append({'originalText': '.', 'pos': '.', 'ner': 'O'})
+            sentences.append({'tokens': sentence})
+            sentence = []
+    if len(sentence) > 0:
+        sentences.append({'tokens': sentence})
+
+    return {
+        'text': ' '.join(token['originalText'] for sentence in sentences for token in sentence['tokens']),
+        'nlp_data': {'sentences': sentences},
+        'salient_entities': names[:salient],
+        'nonsalient_entities': names[salient:]
+    }
+
+
+def get_vocab_words():
+    """Get the word vocabulary covering the filler words of the synthetic documents.
+
+    Returns
+    -------
+    list
+        The word vocabulary (including the <PAD> and <UNK> markers).
+    """
+    return ['<PAD>', '<UNK>'] + [word for word, _ in FILLER_WORDS]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic corpus of annotated documents (containing the nlp_data field) for '
+                    'benchmarking and testing without a Stanford CoreNLP server.')
+    parser.add_argument('output',
+                        help='Folder in which the documents are written.')
+    parser.add_argument('--documents', default=100, type=int,
+                        help='Number of documents.')
+    parser.add_argument('--tokens', default=500, type=int,
+                        help='Approximate number of tokens per document.')
+    parser.add_argument('--entities', default=20, type=int,
+                        help='Number of distinct entities per document.')
+    parser.add_argument('--mentions_per_entity', default=3, type=int,
+                        help='Number of mentions of each non-salient entity.')
+    parser.add_argument('--salient', default=3, type=int,
+                        help='Number of salient entities per document.')
+    parser.add_argument('--cue_probability', default=0., type=float,
+                        help='Probability that a mention of a salient entity is preceded by a cue word.')
+    parser.add_argument('--sharded', action='store_true',
+                        help='Write a sharded JSONL corpus instead of one JSON file per document.')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='Seed of the random number generator.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    documents = (generate_document(rng, tokens=args.tokens, entities=args.entities,
+                                   mentions_per_entity=args.mentions_per_entity, salient=args.salient,
+                                   cue_probability=args.cue_probability)
+                 for _ in range(args.documents))
+    if args.sharded:
+        with JSONLShardWriter(args.output) as writer:
+            for document in documents:
+                writer.write(document)
+    else:
+        os.makedirs(args.output, exist_ok=True)
+        for index, document in enumerate(documents):
+            with open(os.path.join(args.output, 'document%06d.json' % index), 'w') as output_handle:
+                json.dump(document, output_handle)
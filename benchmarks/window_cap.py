@@ -0,0 +1,120 @@
+import argparse
+import json
+import random
+import time
+
+import chainer
+import numpy as np
+
+from benchmarks.encoders import evaluate
+from benchmarks.pipeline import measure
+from benchmarks.synthetic import generate_document, get_vocab_words
+from model.secnn import SECNN, SECNNLossWrapper
+from preprocess import Preprocessor
+from preprocess.sampling import WindowSampler, cap_windows
+from preprocess.tokens import Tokenizer
+from preprocess.vocab import VOCAB_ENTITIES, VOCAB_POSTAGS
+
+
+def count_windows(example):
+    """Count the windows of all entities of a preprocessed document."""
+    return sum(len(windows) for windows in example['document'].values())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare the training time, the step time and peak memory of the largest document, the inference '
+                    'latency and the accuracy of the model for different maximum numbers of windows per entity on '
+                    'synthetic documents with frequently mentioned salient entities.')
+    parser.add_argument('--caps', default=[0, 64, 16, 4], type=int, nargs='+',
+                        help='Maximum numbers of windows per entity (0 for using all windows).')
+    parser.add_argument('--train_documents', default=200, type=int,
+                        help='Number of training documents.')
+    parser.add_argument('--test_documents', default=50, type=int,
+                        help='Number of test documents.')
+    parser.add_argument('--tokens', default=2000, type=int,
+                        help='Approximate number of tokens per document.')
+    parser.add_argument('--entities', default=20, type=int,
+                        help='Number of distinct entities per document.')
+    parser.add_argument('--mentions_per_entity', default=3, type=int,
+                        help='Number of mentions of each non-salient entity.')
+    parser.add_argument('--salient_boost', default=30, type=int,
+                        help='Factor by which salient entities are mentioned more often than non-salient entities.')
+    parser.add_argument('--epochs', default=3, type=int,
+                        help='Number of training epochs.')
+    parser.add_argument('--batch_size', default=8, type=int,
+                        help='Number of documents per minibatch.')
+    parser.add_argument('--repeats', default=3, type=int,
+                        help='Number of runs of which the fastest step time is reported.')
+    parser.add_argument('--output', default='',
+                        help='Path to the JSON file in which the results are stored.')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='Seed of the random number generators.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocab_words = get_vocab_words()
+    tokenizer = Tokenizer(vocab_words={word: index for index, word in enumerate(vocab_words)},
+                          vocab_postags={postag: index for index, postag in enumerate(VOCAB_POSTAGS)},
+                          vocab_entities={entity: index for index, entity in enumerate(VOCAB_ENTITIES)})
+    preprocessor = Preprocessor(tokenizer)
+    examples = [preprocessor(generate_document(rng, tokens=args.tokens, entities=args.entities,
+                                               mentions_per_entity=args.mentions_per_entity,
+                                               salient_boost=args.salient_boost, cue_probability=.5))
+                for _ in range(args.train_documents + args.test_documents)]
+    train_examples, test_examples = examples[:args.train_documents], examples[args.train_documents:]
+    largest = max(train_examples, key=count_windows)
+
+    results = []
+    print('%6s %12s %12s %16s %14s %14s %10s %10s' % ('cap', 'windows/doc', 'train (s)', 'largest step (s)',
+                                                     'peak memory', 'latency (ms)', 'test mse', 'ranking'))
+    for cap in args.caps:
+        # Start every cap from the same random initialization
+        np.random.seed(args.seed)
+        model = SECNN(
+            config_word={'in_size': len(vocab_words), 'out_size': 300},
+            config_postag={'in_size': len(VOCAB_POSTAGS), 'out_size': 32},
+            config_entity={'in_size': len(VOCAB_ENTITIES), 'out_size': 32},
+            config_rnn={'in_size': None, 'out_size': 64},
+            config_affine={'in_size': None, 'out_size': 1},
+            batched=True,
+        )
+        loss_model = SECNNLossWrapper(model)
+        optimizer = chainer.optimizers.Adam()
+        optimizer.setup(model)
+        model.embed_word.disable_update()
+
+        # Train on a new sample of the windows every epoch
+        sampler = WindowSampler(cap, seed=args.seed) if cap > 0 else None
+        train_seconds = 0.
+        order = np.random.RandomState(args.seed)
+        for epoch in range(args.epochs):
+            permutation = order.permutation(len(train_examples))
+            start_time = time.perf_counter()
+            for start in range(0, len(permutation), args.batch_size):
+                batch = [train_examples[index] for index in permutation[start:start + args.batch_size]]
+                optimizer.update(loss_model, [sampler(example) for example in batch] if sampler else batch)
+            train_seconds += time.perf_counter() - start_time
+
+        # Measure a training step on the largest document
+        def run_step(example):
+            model.cleargrads()
+            loss_model([example]).backward()
+
+        step_seconds, peak = measure(run_step, lambda: (sampler(largest) if sampler else largest,), args.repeats)
+
+        # Evaluate on evenly spaced windows
+        capped_test = [cap_windows(example, cap) for example in test_examples] if cap > 0 else test_examples
+        result = {'cap': cap, 'train_seconds_per_epoch': train_seconds / args.epochs,
+                  'windows_per_document': float(np.mean([count_windows(example) for example in capped_test])),
+                  'largest_step_seconds': step_seconds, 'largest_step_peak_bytes': peak}
+        result.update(evaluate(model, capped_test, args.batch_size))
+        results.append(result)
+        print('%6s %12.1f %12.3f %16.4f %11.1f MB %14.2f %10.4f %10.3f' % (
+            cap if cap > 0 else 'all', result['windows_per_document'], result['train_seconds_per_epoch'],
+            step_seconds, peak / 2 ** 20, 1000 * result['inference_seconds'] / len(capped_test), result['mse'],
+            result['ranking_accuracy']))
+
+    if args.output:
+        with open(args.output, 'w') as output_handle:
+            json.dump({'config': vars(args), 'results': results}, output_handle, indent=2)
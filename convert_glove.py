@@ -0,0 +1,68 @@
+import argparse
+
+from tqdm import tqdm
+
+from preprocess.annotations import AnnotationStore
+from preprocess.corpus import iter_documents
+from preprocess.tokens import normalize_word
+from preprocess.vocab import convert_glove_file, prune_glove_file
+
+
+def get_corpus_words(path, annotations=None):
+    """Collect the normalized words of the tokens in a corpus.
+
+    Parameters
+    ----------
+    path : str
+        Path to the corpus (see the iter_documents method), used when no annotation store is given.
+    annotations : str, optional
+        Path to the compact annotation store of the corpus (default: None).
+
+    Returns
+    -------
+    set
+        The normalized words (see the normalize_word method).
+    """
+    words = set()
+    if annotations:
+        store = AnnotationStore(annotations)
+        for shard_index in range(len(store.shards)):
+            words.update(normalize_word(word) for word in store.load_shard(shard_index)['words'])
+            store.shards[shard_index] = None
+        return words
+
+    for _, data in tqdm(iter_documents(path), desc='Collecting words'):
+        for sentence in data.get('nlp_data', {}).get('sentences', []):
+            words.update(normalize_word(token['originalText']) for token in sentence['tokens'])
+    return words
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert a GloVe file to the binary cache (vocabulary file and float32 .npy matrix) which is '
+                    'memory-mapped by the train script instead of parsing the text file, or prune it to the words '
+                    'found in a corpus.')
+    parser.add_argument('glove_file',
+                        help='Path to the GloVe word embeddings file.')
+    parser.add_argument('--chunk_size', default=100000, type=int,
+                        help='Number of lines parsed at once.')
+    parser.add_argument('--corpus', default='',
+                        help='Path to the annotated corpus (folder containing JSON files or a sharded JSONL corpus) to '
+                             'whose words the vocabulary is pruned.')
+    parser.add_argument('--annotations', default='',
+                        help='Path to the compact annotation store of the corpus (used instead of the nlp_data field).')
+    parser.add_argument('--output', default='',
+                        help='Path of the pruned embeddings, which is passed as glove_file to the other scripts '
+                             '(required when pruning).')
+    args = parser.parse_args()
+
+    if not args.corpus and not args.annotations:
+        vocab_path, weights_path = convert_glove_file(args.glove_file, chunk_size=args.chunk_size)
+        print('Stored the vocabulary in %s and the weights in %s' % (vocab_path, weights_path))
+    else:
+        if not args.output:
+            parser.error('the --output argument is required for pruning')
+        words = get_corpus_words(args.corpus, args.annotations)
+        words_count = prune_glove_file(args.glove_file, words, args.output)
+        print('Pruned the vocabulary to %d of the %d words found in the corpus, stored as %s' % (
+            words_count - 2, len(words), args.output))
@@ -0,0 +1,40 @@
+import argparse
+import os
+
+from model.extensions import load_snapshot
+from model.runtime import PRECISIONS, export_model
+from model.secnn import create_model
+from preprocess.vocab import *
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Export the parameters of a trained SECNN model and the word vocabulary to a single file for the '
+                    'NumPy runtime (see the predict_numpy script).')
+    parser.add_argument('glove_file',
+                        help='Path to the GloVe word embeddings file used for training.')
+    parser.add_argument('snapshot',
+                        help='Path to the snapshot created by the train script.')
+    parser.add_argument('output',
+                        help='Path to the exported model (.npz).')
+    parser.add_argument('--snapshot_path', default='updater/model:main/',
+                        help='Path of the model in the snapshot (use an empty string for a snapshot of the model '
+                             'only).')
+    parser.add_argument('--frozen_mismatch', default='raise', choices=['raise', 'warn'],
+                        help='Raise an error or warn when the word embeddings differ from those used for training a '
+                             'slim snapshot.')
+    parser.add_argument('--encoder', default='window', choices=['window', 'sentence', 'document'],
+                        help='Encoder used for training.')
+    parser.add_argument('--batched', action='store_true',
+                        help='Whether the model was trained in batched mode.')
+    parser.add_argument('--embeddings', default='float32', choices=PRECISIONS,
+                        help='Precision of the stored word embeddings (int8 uses a scale per word).')
+    parser.add_argument('--weights', default='float32', choices=PRECISIONS,
+                        help='Precision of the other stored weight matrices (int8 uses a scale per row).')
+    args = parser.parse_args()
+
+    vocab_words, W_words = load_glove_file(args.glove_file)
+    model = create_model(W_words, len(VOCAB_POSTAGS), len(VOCAB_ENTITIES), batched=args.batched,
+                         encoder=args.encoder)
+    load_snapshot(args.snapshot, model, path=args.snapshot_path, on_mismatch=args.frozen_mismatch)
+    export_model(model, args.output, vocab_words=vocab_words, embeddings=args.embeddings, weights=args.weights)
+    print('Exported the model to %s (%.1f MB)' % (args.output, os.path.getsize(args.output) / 2 ** 20))
@@ -0,0 +1,518 @@
+import hashlib
+import multiprocessing
+import os
+import queue
+import threading
+import warnings
+from collections import deque
+
+import numpy as np
+from chainer import reporter, training
+from chainer.serializers import DictionarySerializer, NpzDeserializer
+from chainer.training import extension
+
+FROZEN_PREFIX = 'frozen/'
+
+FROZEN_ROWS_PREFIX = 'frozen_rows/'
+
+FROZEN_SOURCE_PREFIX = 'frozen_source/'
+
+
+def compute_checksum(array):
+    """Compute the checksum of a parameter array.
+
+    Parameters
+    ----------
+    array : np.ndarray
+        The parameter array.
+
+    Returns
+    -------
+    str
+        The hexadecimal SHA-1 digest of the shape, data type and contents of the array.
+    """
+    array = np.ascontiguousarray(array)
+    digest = hashlib.sha1(('%s;%s;' % (array.shape, array.dtype.str)).encode('utf-8'))
+    digest.update(array.data)
+    return digest.hexdigest()
+
+
+def get_frozen_checksum(array, stored_rows=0, source_index=None):
+    """Compute the checksum of a frozen parameter without the leading rows which are stored in the snapshot.
+
+    Parameters
+    ----------
+    array : np.ndarray
+        The parameter array.
+    stored_rows : int, optional
+        Number of leading rows which are left out (default: 0).
+    source_index : np.ndarray, optional
+        When the snapshot was trained on pruned word embeddings, the rows of the source embeddings of the pruned rows
+        (see prune_glove_file). A larger array is then taken to be the source embeddings and only the rows of the pruned
+        embeddings are checked (default: None).
+
+    Returns
+    -------
+    str
+        The checksum (see the compute_checksum method), or None when the array cannot contain the source rows.
+    """
+    if source_index is not None and len(array) != len(source_index):
+        if len(array) <= int(np.max(source_index)):
+            return None
+        return compute_checksum(array[source_index[stored_rows:]])
+    return compute_checksum(array[stored_rows:])
+
+
+def get_params(target):
+    """Find the parameters of the object that is serialized.
+
+    Parameters
+    ----------
+    target : chainer.training.Trainer or chainer.Link
+        The object that is serialized. For a trainer, the models of all optimizers are searched.
+
+    Returns
+    -------
+    dict
+        A mapping from the keys of the parameters in the serialized object to the parameters.
+    """
+    if isinstance(target, training.Trainer):
+        links = {'updater/model:%s' % name: optimizer.target
+                 for name, optimizer in target.updater.get_all_optimizers().items()}
+    else:
+        links = {'': target}
+    return {(prefix + name).lstrip('/'): param for prefix, link in links.items() for name, param in link.namedparams()}
+
+
+def get_frozen_params(target):
+    """Find the parameters which are not updated by the optimizers (for example the pre-trained word embeddings).
+
+    Parameters
+    ----------
+    target : chainer.training.Trainer or chainer.Link
+        The object that is serialized (see the get_params method).
+
+    Returns
+    -------
+    dict
+        A mapping from the keys of the parameters in the serialized object to the parameters.
+    """
+    return {key: param for key, param in get_params(target).items()
+            if param.update_rule is not None and not param.update_rule.enabled}
+
+
+class SlimSnapshot(extension.Extension):
+    """Snapshot extension which leaves out the frozen parameters.
+
+    The frozen parameters (such as the word embeddings after disable_update) take up most of the snapshot of the SECNN
+    model, but they never change during training. Instead of the parameters, their checksums are stored (computed once,
+    when the first snapshot is written). The snapshots are loaded by the load_snapshot function, which takes the frozen
+    parameters from the target (for example initialized from the GloVe file) after verifying their checksums.
+
+    The leading rows of the frozen parameters are stored as they are, because the <UNK> marker of the word embeddings
+    is initialized randomly whenever a GloVe text file (rather than its binary cache) is loaded.
+    """
+
+    trigger = 1, 'epoch'
+    priority = extension.PRIORITY_READER
+
+    def __init__(self, filename='snapshot_iter_{.updater.iteration}', target=None, compression=False, stored_rows=2,
+                 source_indices=None):
+        """Initialize the snapshot extension.
+
+        Parameters
+        ----------
+        filename : str, optional
+            Name of the snapshot file, formatted with the trainer (default: 'snapshot_iter_{.updater.iteration}').
+        target : object, optional
+            The object that is serialized (default: None, the trainer).
+        compression : bool, optional
+            Whether the snapshot is compressed (default: False).
+        stored_rows : int, optional
+            Number of leading rows of the frozen parameters which are stored in the snapshot (default: 2, the <PAD> and
+            <UNK> markers of the word embeddings).
+        source_indices : dict, optional
+            A mapping from names of frozen parameters (for example 'embed_word/W') to the rows of the source embeddings
+            when the parameters are pruned embeddings (see load_source_index). They are stored in the snapshot, such
+            that the snapshot can be loaded with the full embeddings (default: None).
+        """
+        self.filename = filename
+        self.target = target
+        self.compression = compression
+        self.stored_rows = stored_rows
+        self.source_indices = source_indices if source_indices is not None else {}
+        self.checksums = None
+        self.frozen_rows = None
+
+    def get_snapshot(self, trainer):
+        """Serialize the target without its frozen parameters.
+
+        Returns
+        -------
+        dict
+            A mapping from keys to arrays (as stored in the snapshot file).
+        """
+        target = trainer if self.target is None else self.target
+        frozen = get_frozen_params(target)
+        if self.checksums is None:
+            self.checksums = {key: get_frozen_checksum(param.array, self.stored_rows) for key, param in frozen.items()}
+            self.frozen_rows = {key: np.array(param.array[:self.stored_rows]) for key, param in frozen.items()}
+
+        serializer = DictionarySerializer()
+        serializer.save(target)
+        snapshot = {key: value for key, value in serializer.target.items() if key not in frozen}
+        for key, checksum in self.checksums.items():
+            snapshot[FROZEN_PREFIX + key] = np.array(checksum)
+            snapshot[FROZEN_ROWS_PREFIX + key] = self.frozen_rows[key]
+            for name, source_index in self.source_indices.items():
+                if key == name or key.endswith('/' + name):
+                    snapshot[FROZEN_SOURCE_PREFIX + key] = np.asarray(source_index)
+        return snapshot
+
+    def write(self, snapshot, path):
+        """Write a snapshot to a temporary file which replaces the given path once it is complete."""
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as snapshot_handle:
+            if self.compression:
+                np.savez_compressed(snapshot_handle, **snapshot)
+            else:
+                np.savez(snapshot_handle, **snapshot)
+        os.replace(temporary_path, path)
+
+    def __call__(self, trainer):
+        self.write(self.get_snapshot(trainer), os.path.join(trainer.out, self.filename.format(trainer)))
+
+
+class AsyncSnapshot(SlimSnapshot):
+    """Snapshot extension which writes the snapshots on a background thread.
+
+    The state of the target is copied into memory on the training thread, after which the training continues while the
+    copy is compressed and written to a temporary file by a writer thread. The temporary file replaces the snapshot
+    file once it is complete, so an interrupted write never leaves a partial snapshot behind. Only the last snapshots
+    written by the extension are kept.
+    """
+
+    def __init__(self, filename='snapshot_iter_{.updater.iteration}', target=None, compression=True, keep=3,
+                 slim=False, stored_rows=2, source_indices=None):
+        """Initialize the snapshot extension.
+
+        Parameters
+        ----------
+        filename : str, optional
+            Name of the snapshot file, formatted with the trainer (default: 'snapshot_iter_{.updater.iteration}').
+        target : object, optional
+            The object that is serialized (default: None, the trainer).
+        compression : bool, optional
+            Whether the snapshot is compressed (default: True).
+        keep : int, optional
+            Number of snapshots that are kept, older snapshots written by the extension are removed (default: 3, use
+            0 for keeping all snapshots).
+        slim : bool, optional
+            Whether the frozen parameters are left out of the snapshot (see the SlimSnapshot class, default: False).
+        stored_rows : int, optional
+            Number of leading rows of the frozen parameters stored in slim snapshots (default: 2, see SlimSnapshot).
+        source_indices : dict, optional
+            The source rows of pruned frozen parameters stored in slim snapshots (default: None, see SlimSnapshot).
+        """
+        super(AsyncSnapshot, self).__init__(filename=filename, target=target, compression=compression,
+                                            stored_rows=stored_rows, source_indices=source_indices)
+        self.keep = keep
+        self.slim = slim
+        self.written = deque()
+        self.error = None
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = None
+
+    def get_snapshot(self, trainer):
+        """Copy the state of the target into memory.
+
+        Returns
+        -------
+        dict
+            A mapping from keys to arrays (as stored in the snapshot file), which do not share memory with the target.
+        """
+        if self.slim:
+            snapshot = super(AsyncSnapshot, self).get_snapshot(trainer)
+        else:
+            serializer = DictionarySerializer()
+            serializer.save(trainer if self.target is None else self.target)
+            snapshot = serializer.target
+        return {key: value.copy() if isinstance(value, np.ndarray) else value for key, value in snapshot.items()}
+
+    def run_writer(self):
+        """Write the snapshots from the queue until None is received."""
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    snapshot, path = item
+                    self.write(snapshot, path)
+                    self.remove_old_snapshots(path)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def remove_old_snapshots(self, path):
+        """Remove the oldest snapshots written by the extension, keeping the given number of snapshots."""
+        if path in self.written:
+            self.written.remove(path)
+        self.written.append(path)
+        while 0 < self.keep < len(self.written):
+            old_path = self.written.popleft()
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+    def check_error(self):
+        """Raise the error that occurred in the writer thread (if any)."""
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('Writing the snapshot failed: %s' % error) from error
+
+    def __call__(self, trainer):
+        self.check_error()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run_writer, daemon=True)
+            self.thread.start()
+
+        # Blocks only while the previous snapshot is still waiting to be written
+        self.queue.put((self.get_snapshot(trainer), os.path.join(trainer.out, self.filename.format(trainer))))
+
+    def finalize(self):
+        """Wait for the pending snapshots to be written and stop the writer thread."""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.check_error()
+
+
+def get_trainable_params(target):
+    """Find the parameters of a link which are updated by the optimizer.
+
+    Parameters
+    ----------
+    target : chainer.Link
+        The link (for example the model).
+
+    Returns
+    -------
+    dict
+        A mapping from the names of the parameters to the parameters.
+    """
+    return {name: param for name, param in target.namedparams()
+            if param.update_rule is None or param.update_rule.enabled}
+
+
+def run_evaluator(evaluator, target, weights_queue, results_queue):
+    """Evaluate the target with every set of weights received from the weights queue until None is received.
+
+    Parameters
+    ----------
+    evaluator : chainer.training.extensions.Evaluator
+        The evaluator (including the resident validation set).
+    target : chainer.Link
+        The link whose parameters are replaced by the received weights.
+    weights_queue : multiprocessing.Queue
+        Queue of (iteration, weights) tuples in which weights maps parameter names to arrays.
+    results_queue : multiprocessing.Queue
+        Queue to which (iteration, result) tuples are sent.
+    """
+    params = dict(target.namedparams())
+    while True:
+        item = weights_queue.get()
+        if item is None:
+            return
+        iteration, weights = item
+        for name, array in weights.items():
+            # Parameters with unknown input size are initialized by the first forward pass of the training process
+            if params[name].array is None:
+                params[name].initialize(array.shape)
+            params[name].array[...] = array
+        results_queue.put((iteration, {key: float(value) for key, value in evaluator().items()}))
+
+
+class BackgroundEvaluator(extension.Extension):
+    """Extension which runs an evaluator in a separate process.
+
+    The evaluation process is forked from the training process when the training starts, so it has its own copy of the
+    model and the (resident) validation set. When the extension is triggered, the trainable parameters are sent to the
+    evaluation process if it is idle, and the training continues immediately. The result of the latest finished
+    evaluation is reported (prefixed by the name of the evaluator, together with the iteration of the evaluated
+    weights), so the log lines lag behind the training by at most one evaluation. When the extension is triggered in
+    the last iteration, it waits for the evaluation of the final weights, such that the final validation is logged.
+    """
+
+    trigger = 1, 'epoch'
+    priority = extension.PRIORITY_WRITER
+
+    def __init__(self, evaluator, target, name='validation'):
+        """Initialize the extension.
+
+        Parameters
+        ----------
+        evaluator : chainer.training.extensions.Evaluator
+            The evaluator which is run in the evaluation process.
+        target : chainer.Link
+            The model whose trainable parameters are evaluated.
+        name : str, optional
+            Prefix of the reported values (default: 'validation').
+        """
+        self.evaluator = evaluator
+        self.evaluator.name = name
+        self.target = target
+        self.name = name
+        self.process = None
+        self.weights_queue = None
+        self.results_queue = None
+        self.busy = False
+
+    def initialize(self, trainer):
+        # The evaluator and the model are not picklable (and the process has to share them), so the process is forked
+        context = multiprocessing.get_context('fork')
+        self.weights_queue = context.Queue()
+        self.results_queue = context.Queue()
+        self.process = context.Process(target=run_evaluator, args=(self.evaluator, self.target, self.weights_queue,
+                                                                   self.results_queue), daemon=True)
+        self.process.start()
+
+    def receive(self, block=False):
+        """Receive the result of the evaluation in progress.
+
+        Parameters
+        ----------
+        block : bool, optional
+            Whether to wait until the evaluation is finished (default: False).
+
+        Returns
+        -------
+        dict
+            The result (including the iteration of the evaluated weights), or None when no evaluation finished.
+        """
+        while self.busy:
+            try:
+                iteration, result = self.results_queue.get(timeout=1.) if block else self.results_queue.get_nowait()
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError('The evaluation process stopped unexpectedly')
+                if block:
+                    continue
+                return None
+            self.busy = False
+            result[self.name + '/iteration'] = iteration
+            return result
+        return None
+
+    def send(self, trainer):
+        """Send the trainable parameters to the evaluation process."""
+        weights = {name: param.array.copy() for name, param in get_trainable_params(self.target).items()
+                   if param.array is not None}
+        self.weights_queue.put((trainer.updater.iteration, weights))
+        self.busy = True
+
+    def __call__(self, trainer):
+        stop_trigger = trainer.stop_trigger
+        progress = trainer.updater.iteration if stop_trigger.unit == 'iteration' else trainer.updater.epoch_detail
+        if progress >= stop_trigger.period:
+            # Evaluate the final weights (the evaluation in progress, if any, is superseded)
+            self.receive(block=True)
+            self.send(trainer)
+            reporter.report(self.receive(block=True))
+            return
+
+        # Report the result of a finished evaluation and send the latest weights if the evaluation process is idle
+        result = self.receive()
+        if result is not None:
+            reporter.report(result)
+        if not self.process.is_alive():
+            raise RuntimeError('The evaluation process stopped unexpectedly')
+        if not self.busy:
+            self.send(trainer)
+
+    def finalize(self):
+        """Stop the evaluation process."""
+        if self.process is not None:
+            self.weights_queue.put(None)
+            self.process.join(timeout=60)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+
+
+class ReadOnlyAwareDeserializer(NpzDeserializer):
+    """Deserializer which leaves read-only arrays (such as memory-mapped frozen word embeddings) as they are."""
+
+    def __getitem__(self, key):
+        return ReadOnlyAwareDeserializer(self.npz, self.path + key.strip('/') + '/', strict=self.strict)
+
+    def __call__(self, key, value):
+        if isinstance(value, np.ndarray) and not value.flags.writeable:
+            return value
+        return super().__call__(key, value)
+
+
+def load_snapshot(file, target, path='', on_mismatch='raise'):
+    """Load a (regular or slim) snapshot.
+
+    The frozen parameters left out of a slim snapshot (see the SlimSnapshot class) are kept as they are in the target,
+    after checking that their checksums match the checksums recorded in the snapshot, and only their leading rows are
+    restored from the snapshot. When the snapshot was trained on pruned word embeddings, the target may contain the
+    full embeddings, of which only the rows kept by the pruning are checked. Read-only parameters of the target
+    (such as memory-mapped word embeddings) are not overwritten either, their values in a regular snapshot are compared
+    instead.
+
+    Parameters
+    ----------
+    file : str
+        Path to the snapshot.
+    target : object
+        The object that is deserialized (for example the trainer or the model).
+    path : str, optional
+        The path of the target in the snapshot, for example 'updater/model:main/' for loading the model from a snapshot
+        of the trainer (default: '').
+    on_mismatch : str, optional
+        Either 'raise' (raise a ValueError) or 'warn' (issue a warning) when a frozen parameter in the target differs
+        from the snapshot (default: 'raise').
+    """
+    if on_mismatch not in ('raise', 'warn'):
+        raise ValueError('Unknown value of on_mismatch: %s' % on_mismatch)
+
+    with np.load(file) as snapshot_data:
+        snapshot = {key: snapshot_data[key] for key in snapshot_data.files}
+
+    params = {path + key: param for key, param in get_params(target).items()}
+    checksums = {key[len(FROZEN_PREFIX):]: str(value) for key, value in snapshot.items()
+                 if key.startswith(FROZEN_PREFIX) and key[len(FROZEN_PREFIX):].startswith(path)}
+    mismatches = []
+    for key, checksum in checksums.items():
+        if key not in params:
+            raise KeyError('The frozen parameter %s is not found in the target' % key)
+        array = params[key].array
+        rows = snapshot.get(FROZEN_ROWS_PREFIX + key)
+        stored_rows = len(rows) if rows is not None else 0
+        if get_frozen_checksum(array, stored_rows, snapshot.get(FROZEN_SOURCE_PREFIX + key)) != checksum:
+            mismatches.append(key)
+        elif stored_rows > 0 and not np.array_equal(array[:stored_rows], rows):
+            # The stored leading rows (such as a randomly initialized <UNK> marker) replace the rows of the target
+            if array.flags.writeable:
+                array[:stored_rows] = rows
+            else:
+                mismatches.append(key)
+        snapshot[key] = array
+
+    # Read-only parameters (for example memory-mapped word embeddings) cannot be overwritten by a regular snapshot
+    for key, param in params.items():
+        if key not in snapshot or key in checksums or not isinstance(param.array, np.ndarray):
+            continue
+        if not param.array.flags.writeable and not np.array_equal(param.array, snapshot[key]):
+            mismatches.append(key)
+
+    for key in mismatches:
+        message = 'The frozen parameter %s does not match the snapshot (was the same word embeddings file used?)' % key
+        if on_mismatch == 'raise':
+            raise ValueError(message)
+        warnings.warn(message)
+
+    ReadOnlyAwareDeserializer(snapshot, path=path).load(target)
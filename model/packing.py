@@ -0,0 +1,155 @@
+import numpy as np
+
+
+def pack_documents(documents, targets=None):
+    """Stack the windows of all entities in a minibatch of tokenized documents into a single array.
+
+    Parameters
+    ----------
+    documents : list
+        List of tokenized documents (mappings from entities to a list of windows, see Tokenizer.tokenize_document).
+    targets : list, optional
+        List of mappings from entities to targets, one for each document (default: None).
+
+    Returns
+    -------
+    dict
+        A dictionary containing the following keys:
+        - windows : np.ndarray
+            A (num_windows, window_len, 3) int32 array containing the windows of all entities.
+        - offsets : np.ndarray
+            A (num_entities + 1,) int32 array in which the windows of entity i are windows[offsets[i]:offsets[i + 1]].
+        - keys : list
+            A list of (document_index, entity) tuples describing the entity of each segment.
+        - targets : np.ndarray, optional
+            A (num_entities, 1) float32 array containing the targets (only when targets are given).
+    """
+    windows = []
+    counts = []
+    keys = []
+    target_values = []
+    for document_index, document in enumerate(documents):
+        for entity in document:
+            entity_windows = np.asarray(document[entity], dtype=np.int32)
+            if len(entity_windows) == 0:
+                continue
+            windows.append(entity_windows)
+            counts.append(len(entity_windows))
+            keys.append((document_index, entity))
+            if targets is not None:
+                target_values.append(targets[document_index][entity])
+
+    offsets = np.zeros(len(counts) + 1, dtype=np.int32)
+    np.cumsum(counts, out=offsets[1:])
+    packed = {
+        'windows': np.concatenate(windows, axis=0) if len(windows) > 0 else np.zeros((0, 0, 3), dtype=np.int32),
+        'offsets': offsets,
+        'keys': keys
+    }
+    if targets is not None:
+        packed['targets'] = np.asarray(target_values, dtype=np.float32).reshape(-1, 1)
+    return packed
+
+
+def pack_sequences(sequences, targets=None, level='document', pre_window_size=15, post_window_size=15):
+    """Stack the token sequences of a minibatch of documents and index the mention contexts of all entities.
+
+    Each document (level 'document') or each sentence (level 'sentence') becomes a row of the stacked array. The
+    representation of an entity is the mean over its mentions of the mean hidden state over the context of the mention
+    (the pre_window_size tokens before and post_window_size tokens after the entity marker, clipped to the row), which
+    mirrors the windows of the windowed mode while every token is encoded only once. The contexts are described by the
+    flat indices of their tokens and two levels of offsets, such that the hidden states can be gathered and averaged
+    with segment means (the cost grows with the number of mentions instead of the number of entities times the number
+    of tokens).
+
+    Parameters
+    ----------
+    sequences : list
+        List of document sequences (see the 'sequence' output of the Preprocessor).
+    targets : list, optional
+        List of mappings from entities to targets, one for each document (default: None).
+    level : str, optional
+        Either 'document' or 'sentence' (default: 'document').
+    pre_window_size : int, optional
+        Number of tokens before an entity marker in its context (default: 15).
+    post_window_size : int, optional
+        Number of tokens after an entity marker in its context (default: 15).
+
+    Returns
+    -------
+    dict
+        A dictionary containing the following keys:
+        - ids : np.ndarray
+            A (num_rows, max_row_len, 3) int32 array of token identifiers (padded with zeros at the end).
+        - indices : np.ndarray
+            A (num_context_tokens,) int64 array of indices into the (num_rows * max_row_len) flattened hidden states,
+            containing the tokens of the context of every mention.
+        - spans : np.ndarray
+            A (num_mentions + 1,) int64 array in which the context of mention i is indices[spans[i]:spans[i + 1]].
+        - mentions : np.ndarray
+            A (num_entities + 1,) int64 array in which the mentions of entity i are the mentions mentions[i] to
+            mentions[i + 1] (exclusive).
+        - keys : list
+            A list of (document_index, entity) tuples describing the entity of each segment of mentions.
+        - targets : np.ndarray, optional
+            A (num_entities, 1) float32 array containing the targets (only when targets are given).
+    """
+    if level not in ('document', 'sentence'):
+        raise ValueError('Unknown level: %s' % level)
+
+    # Find the rows (start and end offsets) of every document
+    rows = []
+    document_rows = []
+    for sequence in sequences:
+        document_rows.append(len(rows))
+        if level == 'document':
+            rows.append((sequence['ids'], 0, len(sequence['ids'])))
+        else:
+            offsets = sequence['sentences']
+            rows += [(sequence['ids'], start, end) for start, end in zip(offsets[:-1], offsets[1:])]
+    row_len = max([end - start for _, start, end in rows] + [1])
+    ids = np.zeros((max(len(rows), 1), row_len, 3), dtype=np.int32)
+    for row_index, (row_ids, start, end) in enumerate(rows):
+        ids[row_index, :end - start] = row_ids[start:end]
+
+    # Index the hidden states in the contexts of the mentions of every entity
+    keys = []
+    indices = []
+    span_lengths = []
+    mention_counts = []
+    target_values = []
+    for document_index, sequence in enumerate(sequences):
+        sentences = sequence['sentences']
+        for entity, positions in sequence['positions'].items():
+            if len(positions) == 0:
+                continue
+            for position in positions:
+                if level == 'document':
+                    row_index, row_start, row_end = document_rows[document_index], 0, len(sequence['ids'])
+                else:
+                    sentence_index = np.searchsorted(sentences, position, side='right') - 1
+                    row_index = document_rows[document_index] + sentence_index
+                    row_start, row_end = sentences[sentence_index], sentences[sentence_index + 1]
+                start = max(row_start, position - pre_window_size) - row_start
+                end = min(row_end, position + post_window_size + 1) - row_start
+                indices.append(np.arange(row_index * row_len + start, row_index * row_len + end, dtype=np.int64))
+                span_lengths.append(end - start)
+            keys.append((document_index, entity))
+            mention_counts.append(len(positions))
+            if targets is not None:
+                target_values.append(targets[document_index][entity])
+
+    spans = np.zeros(len(span_lengths) + 1, dtype=np.int64)
+    np.cumsum(span_lengths, out=spans[1:])
+    mentions = np.zeros(len(mention_counts) + 1, dtype=np.int64)
+    np.cumsum(mention_counts, out=mentions[1:])
+    packed = {
+        'ids': ids,
+        'indices': np.concatenate(indices) if len(indices) > 0 else np.zeros(0, dtype=np.int64),
+        'spans': spans,
+        'mentions': mentions,
+        'keys': keys
+    }
+    if targets is not None:
+        packed['targets'] = np.asarray(target_values, dtype=np.float32).reshape(-1, 1)
+    return packed
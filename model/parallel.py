@@ -0,0 +1,262 @@
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+import chainer
+import numpy as np
+from chainer import training
+
+from model.extensions import get_trainable_params
+
+
+def get_example_size(example):
+    """Get the cost of an example as the number of windows (window encoder) or tokens (sentence and document encoders).
+
+    Parameters
+    ----------
+    example : dict
+        A preprocessed document.
+
+    Returns
+    -------
+    int
+        The size of the example.
+    """
+    if 'document' in example:
+        return sum(len(windows) for windows in example['document'].values())
+    return len(example['sequence']['ids'])
+
+
+def split_minibatch(batch, count):
+    """Split a minibatch into shards of roughly equal cost.
+
+    The largest examples are assigned first, each to the shard with the lowest total cost so far.
+
+    Parameters
+    ----------
+    batch : list
+        The minibatch of preprocessed documents.
+    count : int
+        Number of shards.
+
+    Returns
+    -------
+    list
+        List of at most count non-empty shards (lists of examples).
+    """
+    shards = [[] for _ in range(count)]
+    costs = [0] * count
+    for example in sorted(batch, key=get_example_size, reverse=True):
+        index = int(np.argmin(costs))
+        shards[index].append(example)
+        costs[index] += get_example_size(example)
+    return [shard for shard in shards if len(shard) > 0]
+
+
+def allocate_shared(arrays):
+    """Allocate a block of shared memory holding a copy of every array.
+
+    Parameters
+    ----------
+    arrays : dict
+        A mapping from names to arrays.
+
+    Returns
+    -------
+    dict
+        A mapping from the names to arrays of the same shape, data type and contents in the shared memory.
+    """
+    buffer = RawArray('b', max(1, sum(array.nbytes for array in arrays.values())))
+    views, offset = {}, 0
+    for name, array in sorted(arrays.items()):
+        views[name] = np.frombuffer(buffer, dtype=array.dtype, count=array.size, offset=offset).reshape(array.shape)
+        views[name][...] = array
+        offset += array.nbytes
+    return views
+
+
+def run_worker(connection, loss_func, optimizer, params, grads, hogwild):
+    """Compute the gradients of the shards received from the connection until None is received.
+
+    Parameters
+    ----------
+    connection : multiprocessing.connection.Connection
+        The connection to the updater, from which shards are received and to which the losses are sent.
+    loss_func : callable
+        Function computing the loss of a shard.
+    optimizer : chainer.Optimizer
+        The optimizer (a copy forked from the training process).
+    params : dict
+        A mapping from names to the trainable parameters of the model of the worker (stored in the shared memory).
+    grads : dict
+        A mapping from the names of the parameters to the shared gradient buffers of the worker.
+    hogwild : bool
+        Whether the worker updates the shared parameters itself (without locking) instead of storing the gradients.
+    """
+    while True:
+        shard = connection.recv()
+        if shard is None:
+            return
+        optimizer.target.cleargrads()
+        loss = loss_func(shard)
+        loss.backward()
+        if hogwild:
+            optimizer.update()
+        else:
+            for name, param in params.items():
+                if param.grad is None:
+                    grads[name].fill(0)
+                else:
+                    grads[name][...] = param.grad
+        connection.send(float(loss.array))
+
+
+class CPUParallelUpdater(training.StandardUpdater):
+    """Updater which splits every minibatch over worker processes running on multiple CPU cores.
+
+    The trainable parameters of the model are moved to shared memory, after which the workers are forked from the
+    training process (so they share the parameters, while the frozen word embeddings are shared copy-on-write). Every
+    iteration, the minibatch is split into shards of roughly equal size (see the split_minibatch function) and every
+    worker computes the loss and gradients of its shard. In the synchronous mode, the gradients are written to shared
+    buffers and averaged (weighted by the number of entities of the shards, as the loss is the mean over the entities)
+    before the optimizer update. In the
+    Hogwild mode, every worker updates the shared parameters itself using its own copy of the optimizer, without
+    locking and without waiting for the other workers to finish their previous shard.
+
+    The model has to be run once before the parameters are moved to shared memory, because the input sizes of some
+    links are only known after the first forward pass. This is done on the first minibatch.
+    """
+
+    def __init__(self, iterator, optimizer, converter=None, loss_func=None, n_workers=2, hogwild=False):
+        """Initialize the updater.
+
+        Parameters
+        ----------
+        iterator : chainer.dataset.Iterator
+            The iterator over the training minibatches.
+        optimizer : chainer.Optimizer
+            The optimizer (set up with the model).
+        converter : callable, optional
+            Function converting a minibatch to the input of the loss function.
+        loss_func : callable, optional
+            Function computing the loss of a minibatch (default: None, the model).
+        n_workers : int, optional
+            Number of worker processes (default: 2).
+        hogwild : bool, optional
+            Whether the workers update the parameters asynchronously (default: False).
+        """
+        kwargs = {} if converter is None else {'converter': converter}
+        super(CPUParallelUpdater, self).__init__(iterator, optimizer, loss_func=loss_func, device=-1, **kwargs)
+        self.n_workers = n_workers
+        self.hogwild = hogwild
+        self.params = None
+        self.shared = None
+        self.grads = None
+        self.connections = []
+        self.pending = []
+        self.processes = []
+
+    def setup_workers(self, batch):
+        """Initialize the parameters with a forward pass, move them to shared memory and fork the workers."""
+        optimizer = self.get_optimizer('main')
+        loss_func = self.loss_func or optimizer.target
+        with chainer.no_backprop_mode():
+            loss_func(batch)
+
+        self.params = get_trainable_params(optimizer.target)
+        self.shared = allocate_shared({name: param.array for name, param in self.params.items()})
+        for name, param in self.params.items():
+            param.array = self.shared[name]
+
+        # The workers have to share the parameters (and the loss function is not picklable), so they are forked
+        context = multiprocessing.get_context('fork')
+        self.grads = []
+        for _ in range(self.n_workers):
+            grads = {} if self.hogwild else allocate_shared({name: np.zeros_like(param.array)
+                                                             for name, param in self.params.items()})
+            parent_connection, child_connection = context.Pipe()
+            process = context.Process(target=run_worker, args=(child_connection, loss_func, optimizer, self.params,
+                                                               grads, self.hogwild), daemon=True)
+            process.start()
+            child_connection.close()
+            self.grads.append(grads)
+            self.connections.append(parent_connection)
+            self.processes.append(process)
+
+    def collect(self):
+        """Wait for the workers to which a shard was sent and collect the losses.
+
+        Returns
+        -------
+        list
+            List of (worker, number of entities of the shard, loss) tuples.
+        """
+        results = []
+        for worker, entity_count in self.pending:
+            try:
+                results.append((worker, entity_count, self.connections[worker].recv()))
+            except EOFError:
+                raise RuntimeError('Worker process %d stopped unexpectedly' % worker)
+        self.pending = []
+        return results
+
+    def update_core(self):
+        batch = self.converter(self.get_iterator('main').next(), self.device)
+        optimizer = self.get_optimizer('main')
+
+        # Documents without entities do not contribute to the loss (and a shard without entities cannot be scored), so
+        # they are left out, and minibatches without any entities are skipped
+        batch = [example for example in batch if len(example['targets']) > 0]
+        if len(batch) == 0:
+            return
+        if self.connections == []:
+            self.setup_workers(batch)
+
+        # In the Hogwild mode, the shards of the previous iteration are collected when the next shards are sent
+        results = self.collect() if self.hogwild else []
+        for worker, shard in enumerate(split_minibatch(batch, self.n_workers)):
+            self.connections[worker].send(shard)
+            self.pending.append((worker, sum(len(example['targets']) for example in shard)))
+        if not self.hogwild:
+            results = self.collect()
+
+            # Average the gradients of the workers
+            total = float(sum(entity_count for _, entity_count, _ in results))
+            for name, param in self.params.items():
+                grad = np.zeros_like(param.array)
+                for worker, entity_count, _ in results:
+                    grad += self.grads[worker][name] * (entity_count / total)
+                param.grad = grad
+            optimizer.update()
+
+            # Optimizers which replace the parameter arrays (instead of updating them in place) are copied back
+            for name, param in self.params.items():
+                if param.array is not self.shared[name]:
+                    self.shared[name][...] = param.array
+                    param.array = self.shared[name]
+        else:
+            optimizer.t += 1
+
+        if len(results) > 0:
+            total = float(sum(entity_count for _, entity_count, _ in results))
+            chainer.report({'loss': sum(loss * entity_count / total for _, entity_count, loss in results)},
+                           optimizer.target)
+
+    def finalize(self):
+        """Stop the worker processes (including the workers which stopped unexpectedly)."""
+        if self.hogwild:
+            try:
+                self.collect()
+            except RuntimeError:
+                pass
+        self.pending = []
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=60)
+            if process.is_alive():
+                process.terminate()
+        self.connections, self.processes = [], []
+        super(CPUParallelUpdater, self).finalize()
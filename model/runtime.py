@@ -0,0 +1,352 @@
+import struct
+import zipfile
+
+import numpy as np
+
+from model.packing import pack_documents, pack_sequences
+from preprocess.annotations import pack_vocab, unpack_vocab
+
+RUNTIME_VERSION = 2
+
+PRECISIONS = ['float32', 'float16', 'int8']
+
+# The weight matrices which are quantized together (the word embeddings are quantized separately)
+WEIGHT_MATRICES = ['embed_postag', 'embed_entity', 'lstm_upward_W', 'lstm_lateral_W', 'affine_W']
+
+
+def quantize(array, precision):
+    """Store the rows of a matrix with a lower precision.
+
+    Parameters
+    ----------
+    array : np.ndarray
+        The matrix.
+    precision : str
+        Either 'float32', 'float16' or 'int8'. In the int8 case, every row is scaled by its maximum absolute value
+        divided by 127.
+
+    Returns
+    -------
+    np.ndarray
+        The quantized matrix.
+    np.ndarray
+        The (rows,) float32 scales (None unless the precision is int8).
+    """
+    if precision not in PRECISIONS:
+        raise ValueError('Unknown precision: %s' % precision)
+    if precision != 'int8':
+        return np.asarray(array, dtype=precision), None
+
+    quantized = np.empty(array.shape, dtype=np.int8)
+    scales = np.empty(array.shape[0], dtype=np.float32)
+    for start in range(0, array.shape[0], 100000):
+        # Quantize in chunks, so a memory-mapped matrix is not loaded into memory at once
+        rows = np.asarray(array[start:start + 100000], dtype=np.float32)
+        row_scales = np.abs(rows).max(axis=1) / 127.
+        row_scales[row_scales == 0] = 1.
+        quantized[start:start + len(rows)] = np.rint(rows / row_scales[:, None])
+        scales[start:start + len(rows)] = row_scales
+    return quantized, scales
+
+
+def dequantize(array, scales=None):
+    """Restore (rows of) a matrix stored by the quantize method as float32 values."""
+    array = np.asarray(array, dtype=np.float32)
+    return array if scales is None else array * np.asarray(scales, dtype=np.float32)[:, None]
+
+
+def quantize_arrays(arrays, embeddings='float32', weights='float32'):
+    """Quantize the word embeddings and the weight matrices of an exported model.
+
+    Parameters
+    ----------
+    arrays : dict
+        The arrays of an exported model with float32 parameters (see the export_model method).
+    embeddings : str, optional
+        Precision of the word embeddings (default: 'float32', see the quantize method).
+    weights : str, optional
+        Precision of the POS-tag and entity embeddings and the weight matrices of the LSTM and the affine layer
+        (default: 'float32'). The biases are kept as float32 values.
+
+    Returns
+    -------
+    dict
+        The arrays of the quantized model (int8 matrices are stored with a <name>_scale array).
+    """
+    arrays = dict(arrays)
+    for name, precision in [('embed_word', embeddings)] + [(name, weights) for name in WEIGHT_MATRICES]:
+        if name + '_scale' in arrays:
+            raise ValueError('The %s matrix is quantized already' % name)
+        arrays[name], scales = quantize(arrays[name], precision)
+        if scales is not None:
+            arrays[name + '_scale'] = scales
+    return arrays
+
+
+def export_model(model, path, vocab_words=None, embeddings='float32', weights='float32'):
+    """Export the parameters and configuration of a trained SECNN model for the NumPy runtime.
+
+    Parameters
+    ----------
+    model : SECNN
+        The trained model (all parameters must be initialized).
+    path : str
+        Path to the exported model (an uncompressed .npz file, so the arrays can be memory-mapped).
+    vocab_words : list, optional
+        The word vocabulary of the model, stored such that documents can be tokenized without the GloVe file
+        (default: None).
+    embeddings : str, optional
+        Precision of the word embeddings (default: 'float32', see the quantize_arrays method).
+    weights : str, optional
+        Precision of the other weight matrices (default: 'float32', see the quantize_arrays method).
+    """
+    arrays = {
+        'version': np.array(RUNTIME_VERSION),
+        'encoder': np.array(model.encoder),
+        'batched': np.array(model.batched),
+        'pre_window_size': np.array(model.pre_window_size),
+        'post_window_size': np.array(model.post_window_size),
+        'embed_word': model.embed_word.W.array,
+        'embed_postag': model.embed_postag.W.array,
+        'embed_entity': model.embed_entity.W.array,
+        'lstm_upward_W': model.rnn.upward.W.array,
+        'lstm_upward_b': model.rnn.upward.b.array,
+        'lstm_lateral_W': model.rnn.lateral.W.array,
+        'affine_W': model.affine.W.array,
+        'affine_b': model.affine.b.array,
+    }
+    arrays = quantize_arrays(arrays, embeddings=embeddings, weights=weights)
+    if vocab_words is not None:
+        arrays['vocab_bytes'], arrays['vocab_offsets'] = pack_vocab(vocab_words)
+    with open(path, 'wb') as output_handle:
+        np.savez(output_handle, **arrays)
+
+
+def load_arrays(path, mmap_mode='r'):
+    """Load the arrays of an .npz file, memory-mapping the arrays which are stored without compression.
+
+    Parameters
+    ----------
+    path : str
+        Path to the .npz file.
+    mmap_mode : str, optional
+        Memory-map mode (default: 'r', use None for reading all arrays into memory).
+
+    Returns
+    -------
+    dict
+        A mapping from names to arrays.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as file_handle:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')] if info.filename.endswith('.npy') else info.filename
+            if mmap_mode is not None and info.compress_type == zipfile.ZIP_STORED:
+                # Skip the local file header to find the start of the .npy data
+                file_handle.seek(info.header_offset + 26)
+                name_length, extra_length = struct.unpack('<HH', file_handle.read(4))
+                file_handle.seek(info.header_offset + 30 + name_length + extra_length)
+                version = np.lib.format.read_magic(file_handle)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file_handle)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file_handle)
+                if not dtype.hasobject and int(np.prod(shape)) > 0:
+                    arrays[name] = np.memmap(path, dtype=dtype, mode=mmap_mode, offset=file_handle.tell(),
+                                             shape=shape, order='F' if fortran_order else 'C')
+                    continue
+            with archive.open(info) as member_handle:
+                arrays[name] = np.lib.format.read_array(member_handle)
+    return arrays
+
+
+def sigmoid(x):
+    """Compute the logistic sigmoid function."""
+    return .5 * np.tanh(.5 * x) + .5
+
+
+class NumpySECNN:
+    """Inference-only implementation of the SECNN model using NumPy.
+
+    The model computes the same scores as the predict method of the SECNN class for all encoders, without importing
+    Chainer and without building a computational graph. All windows or rows of a minibatch are run through the LSTM at
+    once: the input projections of all tokens are computed in a single matrix product (using the projections of the
+    POS-tag and entity embeddings, which are precomputed), leaving one matrix product per time step for the recurrent
+    connections. The word embeddings are memory-mapped, so loading a model takes a fraction of a second.
+
+    Quantized word embeddings (see the quantize_arrays method) stay quantized in memory and only the looked up rows
+    are dequantized. The other weight matrices are small and are dequantized when the model is loaded.
+    """
+
+    def __init__(self, arrays):
+        """Initialize the model.
+
+        Parameters
+        ----------
+        arrays : dict
+            The arrays of an exported model (see the export_model and load_arrays methods).
+        """
+        if int(arrays['version']) > RUNTIME_VERSION:
+            raise ValueError('Unsupported version of the exported model: %d' % int(arrays['version']))
+        self.arrays = arrays
+        self.encoder = str(arrays['encoder'])
+        self.batched = bool(arrays['batched'])
+        self.pre_window_size = int(arrays['pre_window_size'])
+        self.post_window_size = int(arrays['post_window_size'])
+        self.embed_word = arrays['embed_word']
+        self.embed_word_scale = arrays.get('embed_word_scale')
+        weights = {name: dequantize(arrays[name], arrays.get(name + '_scale')) for name in WEIGHT_MATRICES}
+
+        # Reorder the interleaved gates of the Chainer LSTM (a, i, f, o for every unit) into four contiguous blocks
+        upward_W = self.reorder_gates(weights['lstm_upward_W'])
+        upward_b = self.reorder_gates(np.asarray(arrays['lstm_upward_b'], dtype=np.float32))
+        self.lateral_W = np.ascontiguousarray(self.reorder_gates(weights['lstm_lateral_W']).T)
+        self.units = self.lateral_W.shape[0]
+
+        # Split the input projection over the word, POS-tag and entity embeddings
+        word_dim, postag_dim = self.embed_word.shape[1], weights['embed_postag'].shape[1]
+        self.upward_word = np.ascontiguousarray(upward_W[:, :word_dim].T)
+        self.project_postag = weights['embed_postag'].dot(upward_W[:, word_dim:word_dim + postag_dim].T) + upward_b
+        self.project_entity = weights['embed_entity'].dot(upward_W[:, word_dim + postag_dim:].T)
+
+        self.affine_W = weights['affine_W'].T
+        self.affine_b = np.asarray(arrays['affine_b'], dtype=np.float32)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load an exported model (see the export_model method).
+
+        Parameters
+        ----------
+        path : str
+            Path to the exported model.
+        mmap_mode : str, optional
+            Memory-map mode of the arrays (default: 'r', use None for reading the arrays into memory).
+
+        Returns
+        -------
+        NumpySECNN
+            The model.
+        """
+        return cls(load_arrays(path, mmap_mode=mmap_mode))
+
+    @staticmethod
+    def reorder_gates(x):
+        """Reorder the rows of an LSTM weight matrix or bias from interleaved gates into blocks of gates."""
+        return x.reshape((-1, 4) + x.shape[1:]).swapaxes(0, 1).reshape(x.shape)
+
+    @property
+    def input_key(self):
+        """The output of the Preprocessor used as model input ('document' or 'sequence')."""
+        return 'document' if self.encoder == 'window' else 'sequence'
+
+    def get_vocab_words(self):
+        """Get the word vocabulary stored with the model (None when it was not exported)."""
+        if 'vocab_bytes' not in self.arrays:
+            return None
+        return unpack_vocab(np.asarray(self.arrays['vocab_bytes']), np.asarray(self.arrays['vocab_offsets']))
+
+    def project_inputs(self, ids):
+        """Compute the input projections of the LSTM (including the bias) for a (n, 3) array of token identifiers."""
+        x_word = dequantize(self.embed_word[ids[:, 0]],
+                            None if self.embed_word_scale is None else self.embed_word_scale[ids[:, 0]])
+        return x_word.dot(self.upward_word) + self.project_postag[ids[:, 1]] + self.project_entity[ids[:, 2]]
+
+    def lstm(self, gates, c=None):
+        """Apply the LSTM gates (in blocks) to the cell state.
+
+        Returns
+        -------
+        np.ndarray
+            The hidden state.
+        np.ndarray
+            The cell state.
+        """
+        units = self.units
+        a = np.tanh(gates[:, :units])
+        i = sigmoid(gates[:, units:2 * units])
+        f = sigmoid(gates[:, 2 * units:3 * units])
+        o = sigmoid(gates[:, 3 * units:])
+        c = a * i if c is None else a * i + f * c
+        return o * np.tanh(c), c
+
+    def run_lstm(self, ids):
+        """Run a batch of sequences through the LSTM (starting from an empty state).
+
+        Parameters
+        ----------
+        ids : np.ndarray
+            A (batch_size, length, 3) array of token identifiers.
+
+        Returns
+        -------
+        np.ndarray
+            A (batch_size, length, units) array of hidden states.
+        """
+        batch_size, length, _ = ids.shape
+        inputs = self.project_inputs(ids.reshape(-1, 3)).reshape(batch_size, length, -1)
+        h_steps = np.empty((batch_size, length, self.units), dtype=np.float32)
+        h, c = None, None
+        for step in range(length):
+            gates = inputs[:, step] if h is None else inputs[:, step] + h.dot(self.lateral_W)
+            h, c = self.lstm(gates, c)
+            h_steps[:, step] = h
+        return h_steps
+
+    def score_windows(self, windows, offsets):
+        """Score entities given the windows of all entities in a minibatch (see the SECNN.score_windows method).
+
+        Without the batched mode, the SECNN model runs every token of a window through the LSTM as a separate sequence
+        of length one, which is reproduced here.
+
+        Returns
+        -------
+        np.ndarray
+            A (num_entities, 1) array containing the entity scores.
+        """
+        num_windows, window_len, _ = windows.shape
+        if self.batched:
+            h_windows = self.run_lstm(windows).mean(axis=1)
+        else:
+            h_windows = self.lstm(self.project_inputs(windows.reshape(-1, 3)))[0]
+            h_windows = h_windows.reshape(num_windows, window_len, -1).mean(axis=1)
+
+        counts = np.diff(offsets)
+        y_entities = np.add.reduceat(h_windows, offsets[:-1], axis=0) / counts[:, None]
+        return y_entities.dot(self.affine_W) + self.affine_b
+
+    def score_sequences(self, ids, indices, spans, mentions):
+        """Score entities given the stacked sequences of a minibatch (see the SECNN.score_sequences method).
+
+        Returns
+        -------
+        np.ndarray
+            A (num_entities, 1) array containing the entity scores.
+        """
+        h_tokens = self.run_lstm(ids).reshape(-1, self.units)
+        y_mentions = np.add.reduceat(h_tokens[indices], spans[:-1], axis=0) / np.diff(spans)[:, None]
+        y_entities = np.add.reduceat(y_mentions, mentions[:-1], axis=0) / np.diff(mentions)[:, None]
+        return y_entities.dot(self.affine_W) + self.affine_b
+
+    def predict(self, minibatch):
+        """Score the entities of a minibatch of tokenized documents (see the SECNN.predict method).
+
+        Returns
+        -------
+        list
+            List of mappings from entities to scores (floats), one for each document.
+        """
+        if self.encoder == 'window':
+            packed = pack_documents(minibatch)
+            scores = self.score_windows(packed['windows'], packed['offsets']) if len(packed['keys']) > 0 else None
+        else:
+            packed = pack_sequences(minibatch, level=self.encoder, pre_window_size=self.pre_window_size,
+                                    post_window_size=self.post_window_size)
+            scores = None
+            if len(packed['keys']) > 0:
+                scores = self.score_sequences(packed['ids'], packed['indices'], packed['spans'], packed['mentions'])
+
+        y_batched = [{} for _ in range(len(minibatch))]
+        for index, (document_index, entity) in enumerate(packed['keys']):
+            y_batched[document_index][entity] = float(scores[index, 0])
+        return y_batched
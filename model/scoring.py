@@ -0,0 +1,74 @@
+import json
+
+from preprocess import get_entity_mentions
+
+
+def score_batch(model, preprocessor, batch):
+    """Score the entities of a batch of documents.
+
+    Parameters
+    ----------
+    model : SECNN or NumpySECNN
+        The trained model.
+    preprocessor : Preprocessor
+        The preprocessor.
+    batch : list
+        A list of (doc_id, data) tuples.
+
+    Returns
+    -------
+    list
+        A list of {doc_id, entity, mention, score} records.
+    """
+    preprocessed = [preprocessor(data) for _, data in batch]
+    scores = model.predict([item[model.input_key] for item in preprocessed])
+    records = []
+    for (doc_id, _), item, document_scores in zip(batch, preprocessed, scores):
+        mentions = get_entity_mentions(item['entities'])
+        for entity, score in document_scores.items():
+            records.append({'doc_id': doc_id, 'entity': entity, 'mention': mentions.get(entity), 'score': score})
+    return records
+
+
+def score_documents(model, preprocessor, documents, output_handle, batch_size=32, annotations=None):
+    """Score the entities of a stream of documents in batches and write one JSON record per entity and line.
+
+    Used by the predict and predict_numpy scripts, so this module does not import Chainer.
+
+    Parameters
+    ----------
+    model : SECNN or NumpySECNN
+        The trained model.
+    preprocessor : Preprocessor
+        The preprocessor.
+    documents : iterable
+        The (doc_id, data) tuples of the documents (see the iter_documents method).
+    output_handle : file
+        The file to which the records are written.
+    batch_size : int, optional
+        Number of documents scored at once (default: 32).
+    annotations : AnnotationStore, optional
+        When given, the tokens of the documents are read from the annotation store (default: None).
+
+    Returns
+    -------
+    int
+        The number of scored documents.
+    """
+    documents_count = 0
+    batch = []
+    for doc_id, data in documents:
+        if annotations is not None:
+            data['nlp_table'] = annotations.get_table(str(doc_id))
+        batch.append((doc_id, data))
+        if len(batch) == batch_size:
+            for record in score_batch(model, preprocessor, batch):
+                output_handle.write(json.dumps(record) + '\n')
+            documents_count += len(batch)
+            batch = []
+    if len(batch) > 0:
+        for record in score_batch(model, preprocessor, batch):
+            output_handle.write(json.dumps(record) + '\n')
+        documents_count += len(batch)
+    output_handle.flush()
+    return documents_count
@@ -1,18 +1,108 @@
+import chainer
 import chainer.functions as F
 import chainer.links as L
 import numpy as np
 from chainer import Chain, report
 
+from model.packing import pack_documents, pack_sequences
+
+
+class SegmentMean(chainer.Function):
+    """Average consecutive rows over the segments described by offsets (see the segment_mean function)."""
+
+    def __init__(self, offsets):
+        self.offsets = np.asarray(offsets)
+        self.counts = np.diff(self.offsets)
+
+    def forward(self, inputs):
+        x, = inputs
+        sums = np.add.reduceat(x, self.offsets[:-1], axis=0)
+        return (sums / self.counts[:, None]).astype(x.dtype),
+
+    def backward(self, inputs, grad_outputs):
+        gy, = grad_outputs
+        return np.repeat(gy / self.counts[:, None].astype(gy.dtype), self.counts, axis=0),
+
+
+def segment_mean(x, offsets):
+    """Average consecutive rows of x over the segments described by offsets.
+
+    The rows are reduced in place with np.add.reduceat, so no (k, n) averaging matrix is built.
+
+    Parameters
+    ----------
+    x : chainer.Variable
+        A (n, m) variable.
+    offsets : np.ndarray
+        A (k + 1,) array in which segment i consists of the (at least one) rows x[offsets[i]:offsets[i + 1]].
+
+    Returns
+    -------
+    chainer.Variable
+        A (k, m) variable containing the mean of each segment.
+    """
+    return SegmentMean(offsets)(x)
+
+
+def create_model(W_words, postags_count, entities_count, batched=False, encoder='window'):
+    """Create a SECNN model using the configuration of the train script.
+
+    Parameters
+    ----------
+    W_words : np.ndarray
+        The (pre-trained) word embeddings (see the load_glove_file method).
+    postags_count : int
+        Number of POS-tags in the POS-tag vocabulary.
+    entities_count : int
+        Number of entities in the entity vocabulary.
+    batched : bool, optional
+        Whether the model runs in batched mode (default: False).
+    encoder : str, optional
+        Either 'window', 'sentence' or 'document' (default: 'window', see the SECNN class).
+
+    Returns
+    -------
+    SECNN
+        The model.
+    """
+    # The word embeddings are frozen, so the (memory-mapped) matrix is used as is instead of being copied into the
+    # link: processes loading the same GloVe cache then share the matrix through the page cache
+    model = SECNN(
+        config_word={'in_size': 1, 'out_size': W_words.shape[1]},
+        config_postag={'in_size': postags_count, 'out_size': 32},
+        config_entity={'in_size': entities_count, 'out_size': 32},
+        config_rnn={'in_size': None, 'out_size': 64},
+        config_affine={'in_size': None, 'out_size': 1},
+        batched=batched,
+        encoder=encoder,
+    )
+    model.embed_word.W.array = np.asarray(W_words, dtype=np.float32)
+    return model
+
 
 class SECNN(Chain):
+    """Salient entity classifier.
 
-    def __init__(self, config_word=None, config_postag=None, config_entity=None, config_rnn=None, config_affine=None):
+    In the 'window' encoder mode (the default), the model input is the mapping from entities to windows produced by the
+    Preprocessor ('document' output) and every window is encoded separately. In the 'sentence' and 'document' encoder
+    modes, the model input is the 'sequence' output of the Preprocessor: every sentence or document is encoded once by
+    the LSTM and the hidden states around the mentions of an entity are averaged (see the pack_sequences function).
+    """
+
+    def __init__(self, config_word=None, config_postag=None, config_entity=None, config_rnn=None, config_affine=None,
+                 batched=False, encoder='window', pre_window_size=15, post_window_size=15):
         config_word = config_word if config_word is not None else {}
         config_postag = config_postag if config_postag is not None else {}
         config_entity = config_entity if config_entity is not None else {}
         config_rnn = config_rnn if config_rnn is not None else {}
         config_affine = config_affine if config_affine is not None else {}
         super(SECNN, self).__init__()
+        if encoder not in ('window', 'sentence', 'document'):
+            raise ValueError('Unknown encoder: %s' % encoder)
+        self.batched = batched
+        self.encoder = encoder
+        self.pre_window_size = pre_window_size
+        self.post_window_size = post_window_size
         with self.init_scope():
             self.embed_word = L.EmbedID(**config_word)
             self.embed_postag = L.EmbedID(**config_postag)
@@ -20,7 +110,55 @@ class SECNN(Chain):
             self.rnn = L.LSTM(**config_rnn)
             self.affine = L.Linear(**config_affine)
 
+    @property
+    def mode(self):
+        """The encoder, followed by '-batched' for the batched mode of the window encoder (stored in snapshots)."""
+        return self.encoder + ('-batched' if self.batched and self.encoder == 'window' else '')
+
+    def serialize(self, serializer):
+        """Serialize the parameters and the mode of the model.
+
+        The same parameters give different scores in the different modes (the windowed mode runs every token from an
+        empty LSTM state), so deserializing a snapshot created in another mode raises a ValueError. Snapshots created
+        before the mode was stored are loaded without checking the mode.
+        """
+        super(SECNN, self).serialize(serializer)
+        if not isinstance(serializer, chainer.serializer.Deserializer):
+            serializer('mode', np.array(self.mode))
+            return
+        try:
+            mode = serializer('mode', None)
+        except KeyError:
+            return
+        if mode is not None and str(mode) != self.mode:
+            raise ValueError('The snapshot was created by a model in %s mode, but the model is in %s mode (see the '
+                             'encoder and batched arguments)' % (mode, self.mode))
+
+    @property
+    def input_key(self):
+        """The output of the Preprocessor used as model input ('document' or 'sequence')."""
+        return 'document' if self.encoder == 'window' else 'sequence'
+
+    def pack_sequences(self, sequences, targets=None):
+        """Pack document sequences for the score_sequences method (see the pack_sequences function)."""
+        return pack_sequences(sequences, targets, level=self.encoder, pre_window_size=self.pre_window_size,
+                              post_window_size=self.post_window_size)
+
     def __call__(self, minibatch, *args, **kwargs):
+        if self.encoder != 'window':
+            packed = self.pack_sequences(minibatch)
+            if len(packed['keys']) == 0:
+                return [{} for _ in minibatch]
+            y_entities = self.score_sequences(packed['ids'], packed['indices'], packed['spans'], packed['mentions'])
+            return self.split_scores(y_entities, packed['keys'], len(minibatch))
+
+        if self.batched:
+            packed = pack_documents(minibatch)
+            if len(packed['keys']) == 0:
+                return [{} for _ in minibatch]
+            return self.split_scores(self.score_windows(packed['windows'], packed['offsets']), packed['keys'],
+                                     len(minibatch))
+
         y_batched = []
         for document in minibatch:
             y = {}
@@ -44,6 +182,112 @@ class SECNN(Chain):
             y_batched.append(y)
         return y_batched
 
+    def split_scores(self, y_entities, keys, documents_count):
+        """Split the scores of the entities of a minibatch into one mapping from entities to scores per document."""
+        y_batched = [{} for _ in range(documents_count)]
+        if len(keys) > 0:
+            y_split = F.split_axis(y_entities, np.arange(1, len(keys)), axis=0, force_tuple=True)
+            for (document_index, entity), y_entity in zip(keys, y_split):
+                y_batched[document_index][entity] = y_entity
+        return y_batched
+
+    def predict(self, minibatch):
+        """Score the entities of a minibatch of tokenized documents in test mode without building the graph.
+
+        Parameters
+        ----------
+        minibatch : list
+            List of tokenized documents (mappings from entities to a list of windows, or document sequences in the
+            'sentence' and 'document' encoder modes, see the input_key property).
+
+        Returns
+        -------
+        list
+            List of mappings from entities to scores (floats), one for each document. Entities without windows are
+            left out.
+        """
+        if self.encoder == 'window':
+            minibatch = [{entity: windows for entity, windows in document.items() if len(windows) > 0}
+                         for document in minibatch]
+        with chainer.using_config('train', False), chainer.no_backprop_mode():
+            y_batched = self(minibatch)
+        return [{entity: float(y[entity].data[0, 0]) for entity in y} for y in y_batched]
+
+    def score_windows(self, windows, offsets):
+        """Score entities given the windows of all entities in a minibatch (batched mode).
+
+        The embeddings of all windows are looked up at once and the windows are run through the LSTM as one batch of
+        sequences. The hidden states of each window are averaged over time and the windows of each entity are averaged
+        using the offsets, after which the affine layer produces one score per entity.
+
+        Parameters
+        ----------
+        windows : np.ndarray
+            A (num_windows, window_len, 3) int32 array (see the pack_documents function).
+        offsets : np.ndarray
+            A (num_entities + 1,) array in which the windows of entity i are windows[offsets[i]:offsets[i + 1]].
+
+        Returns
+        -------
+        chainer.Variable
+            A (num_entities, 1) variable containing the entity scores.
+        """
+        num_windows, window_len, _ = windows.shape
+        ids = windows.reshape(-1, 3)
+        x_word = self.embed_word(ids[:, 0])
+        x_postag = self.embed_postag(ids[:, 1])
+        x_entity = self.embed_entity(ids[:, 2])
+        x_seq = F.concat([x_word, x_postag, x_entity], axis=-1)
+        x_seq = F.reshape(x_seq, (num_windows, window_len, -1))
+
+        self.rnn.reset_state()
+        h_steps = [self.rnn(x_seq[:, step]) for step in range(window_len)]
+        self.rnn.reset_state()
+        h_windows = F.mean(F.stack(h_steps, axis=1), axis=1)
+
+        y_entities = segment_mean(h_windows, offsets)
+        return self.affine(y_entities)
+
+    def score_sequences(self, ids, indices, spans, mentions):
+        """Score entities given the stacked sequences of a minibatch (sentence and document encoder modes).
+
+        The embeddings of all tokens are looked up at once and the rows (sentences or documents) are run through the
+        LSTM as one batch of sequences, such that every token is encoded once. The hidden states in the context of every
+        mention are gathered and averaged, the mention representations are averaged into entity representations, after
+        which the affine layer produces one score per entity.
+
+        Parameters
+        ----------
+        ids : np.ndarray
+            A (num_rows, max_row_len, 3) int32 array (see the pack_sequences function).
+        indices : np.ndarray
+            A (num_context_tokens,) array of indices into the flattened hidden states.
+        spans : np.ndarray
+            A (num_mentions + 1,) array of offsets of the contexts of the mentions in indices.
+        mentions : np.ndarray
+            A (num_entities + 1,) array of offsets of the mentions of the entities.
+
+        Returns
+        -------
+        chainer.Variable
+            A (num_entities, 1) variable containing the entity scores.
+        """
+        num_rows, row_len, _ = ids.shape
+        flat_ids = ids.reshape(-1, 3)
+        x_word = self.embed_word(flat_ids[:, 0])
+        x_postag = self.embed_postag(flat_ids[:, 1])
+        x_entity = self.embed_entity(flat_ids[:, 2])
+        x_seq = F.concat([x_word, x_postag, x_entity], axis=-1)
+        x_seq = F.reshape(x_seq, (num_rows, row_len, -1))
+
+        self.rnn.reset_state()
+        h_steps = [self.rnn(x_seq[:, step]) for step in range(row_len)]
+        self.rnn.reset_state()
+        h_tokens = F.reshape(F.stack(h_steps, axis=1), (num_rows * row_len, -1))
+
+        y_mentions = segment_mean(h_tokens[indices], spans)
+        return self.affine(segment_mean(y_mentions, mentions))
+
 
 class SECNNLossWrapper(Chain):
 
@@ -52,8 +296,27 @@ class SECNNLossWrapper(Chain):
         self.model = model
 
     def __call__(self, minibatch, *args, **kwargs):
-        docs = [item['document'] for item in minibatch]
         targets = [item['targets'] for item in minibatch]
+
+        if getattr(self.model, 'encoder', 'window') != 'window':
+            packed = self.model.pack_sequences([item['sequence'] for item in minibatch], targets)
+            y_out = self.model.score_sequences(packed['ids'], packed['indices'], packed['spans'], packed['mentions'])
+            loss = F.mean_squared_error(y_out, packed['targets'])
+            report({
+                'loss': loss
+            }, self)
+            return loss
+
+        docs = [item['document'] for item in minibatch]
+        if getattr(self.model, 'batched', False):
+            packed = pack_documents(docs, targets)
+            y_out = self.model.score_windows(packed['windows'], packed['offsets'])
+            loss = F.mean_squared_error(y_out, packed['targets'])
+            report({
+                'loss': loss
+            }, self)
+            return loss
+
         entity_scores = self.model.__call__(docs, *args, **kwargs)
 
         losses = []
@@ -68,6 +331,6 @@ class SECNNLossWrapper(Chain):
 
         report({
             'loss': loss
-        })
+        }, self)
 
         return loss
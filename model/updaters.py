@@ -0,0 +1,66 @@
+import time
+
+import chainer
+from chainer import training
+
+
+class InstrumentedUpdater(training.StandardUpdater):
+    """Standard updater which additionally reports the throughput and the time spent in each stage of an iteration.
+
+    Every iteration, the following values are reported (such that they are averaged by the LogReport extension):
+
+    - time/load : seconds spent waiting for the minibatch (reading and preprocessing when done on the fly)
+    - time/forward, time/backward, time/update : seconds spent in the forward pass, the backward pass and the
+      optimizer update
+    - time/<stage> : seconds spent in each stage of the JSONFileLoader and Preprocessor (summed over the minibatch,
+      only available when they are instrumented)
+    - docs, windows, entities : size of the minibatch
+    - docs/sec, windows/sec : throughput of the iteration
+    """
+
+    def update_core(self):
+        start_time = time.perf_counter()
+        batch = self.get_iterator('main').next()
+        in_arrays = self.converter(batch, self.device)
+        load_time = time.perf_counter()
+
+        optimizer = self.get_optimizer('main')
+        loss_func = self.loss_func or optimizer.target
+        if isinstance(in_arrays, tuple):
+            loss = loss_func(*in_arrays)
+        elif isinstance(in_arrays, dict):
+            loss = loss_func(**in_arrays)
+        else:
+            loss = loss_func(in_arrays)
+        forward_time = time.perf_counter()
+
+        optimizer.target.cleargrads()
+        loss.backward()
+        del loss
+        backward_time = time.perf_counter()
+
+        optimizer.update()
+        update_time = time.perf_counter()
+
+        observation = {
+            'time/load': load_time - start_time,
+            'time/forward': forward_time - load_time,
+            'time/backward': backward_time - forward_time,
+            'time/update': update_time - backward_time
+        }
+        windows_count, entities_count = 0, 0
+        for example in batch:
+            for windows in example['document'].values():
+                windows_count += len(windows)
+                entities_count += 1
+            for stage, seconds in example.get('timings', {}).items():
+                observation['time/' + stage] = observation.get('time/' + stage, 0.) + seconds
+        elapsed = max(update_time - start_time, 1e-9)
+        observation.update({
+            'docs': len(batch),
+            'windows': windows_count,
+            'entities': entities_count,
+            'docs/sec': len(batch) / elapsed,
+            'windows/sec': windows_count / elapsed
+        })
+        chainer.report(observation)
@@ -0,0 +1,75 @@
+import argparse
+import sys
+import time
+
+from model.extensions import load_snapshot
+from model.scoring import score_documents
+from model.secnn import create_model
+from preprocess import Preprocessor
+from preprocess.annotations import AnnotationStore
+from preprocess.corpus import iter_documents
+from preprocess.tokens import Tokenizer
+from preprocess.vocab import *
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Score the salience of the entities in the given preprocessed documents using a trained SECNN '
+                    'model and write one JSON record per entity.')
+    parser.add_argument('input',
+                        help='Path to the input files (folder containing preprocessed JSON files or a sharded JSONL '
+                             'corpus) or - for reading preprocessed JSON documents (one per line) from stdin.')
+    parser.add_argument('glove_file',
+                        help='Path to the GloVe word embeddings file used for training.')
+    parser.add_argument('snapshot',
+                        help='Path to the snapshot created by the train script.')
+    parser.add_argument('--snapshot_path', default='updater/model:main/',
+                        help='Path of the model in the snapshot (use an empty string for a snapshot of the model '
+                             'only).')
+    parser.add_argument('--frozen_mismatch', default='raise', choices=['raise', 'warn'],
+                        help='Raise an error or warn when the word embeddings differ from those used for training a '
+                             'slim snapshot (the full embeddings can be used after training on pruned ones).')
+    parser.add_argument('--annotations', default='',
+                        help='Path to the compact annotation store created by the preprocess_nlp script (used instead '
+                             'of the nlp_data field of the documents).')
+    parser.add_argument('--output', default='-',
+                        help='Path to the output file (JSONL) or - for writing to stdout.')
+    parser.add_argument('--max_windows_per_entity', default=0, type=int,
+                        help='Maximum number of windows per entity, of which evenly spaced windows are kept (default: '
+                             '0, use all windows).')
+    parser.add_argument('--batch_size', default=32, type=int,
+                        help='Number of documents scored at once.')
+    parser.add_argument('--encoder', default='window', choices=['window', 'sentence', 'document'],
+                        help='Encode every entity window separately or every sentence or document once (must match '
+                             'the encoder used for training).')
+    parser.add_argument('--batched', action='store_true',
+                        help='Use the batched mode of the model (must match the mode used for training).')
+    args = parser.parse_args()
+
+    # Convert vocab lists to dictionaries
+    VOCAB_WORDS, W_words = load_glove_file(args.glove_file)
+    VOCAB_WORDS = {word: index for index, word in enumerate(VOCAB_WORDS)}
+    VOCAB_POSTAGS = {postag: index for index, postag in enumerate(VOCAB_POSTAGS)}
+    VOCAB_ENTITIES = {entity: index for index, entity in enumerate(VOCAB_ENTITIES)}
+
+    # Create the tokenizer and the preprocessor
+    tokenizer = Tokenizer(vocab_words=VOCAB_WORDS, vocab_postags=VOCAB_POSTAGS, vocab_entities=VOCAB_ENTITIES)
+    preprocessor = Preprocessor(tokenizer, max_windows_per_entity=args.max_windows_per_entity)
+
+    # Load the model
+    model = create_model(W_words, len(VOCAB_POSTAGS), len(VOCAB_ENTITIES), batched=args.batched,
+                         encoder=args.encoder)
+    load_snapshot(args.snapshot, model, path=args.snapshot_path, on_mismatch=args.frozen_mismatch)
+
+    # Stream the documents through the model
+    annotations = AnnotationStore(args.annotations) if args.annotations else None
+    output_handle = sys.stdout if args.output == '-' else open(args.output, 'w')
+    start_time = time.time()
+    documents_count = score_documents(model, preprocessor, iter_documents(args.input), output_handle,
+                                      batch_size=args.batch_size, annotations=annotations)
+    if output_handle is not sys.stdout:
+        output_handle.close()
+
+    elapsed = time.time() - start_time
+    print('Scored %d documents in %.2f seconds (%.2f docs/sec)' % (documents_count, elapsed,
+                                                                   documents_count / max(elapsed, 1e-9)),
+          file=sys.stderr)
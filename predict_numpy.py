@@ -0,0 +1,58 @@
+import argparse
+import sys
+import time
+
+from model.runtime import NumpySECNN
+from model.scoring import score_documents
+from preprocess import Preprocessor
+from preprocess.annotations import AnnotationStore
+from preprocess.corpus import iter_documents
+from preprocess.tokens import Tokenizer
+from preprocess.vocab import VOCAB_ENTITIES, VOCAB_POSTAGS
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Score the salience of the entities in the given preprocessed documents using a model exported '
+                    'by the export_model script, without Chainer, and write one JSON record per entity.')
+    parser.add_argument('input',
+                        help='Path to the input files (folder containing preprocessed JSON files or a sharded JSONL '
+                             'corpus) or - for reading preprocessed JSON documents (one per line) from stdin.')
+    parser.add_argument('model',
+                        help='Path to the exported model.')
+    parser.add_argument('--annotations', default='',
+                        help='Path to the compact annotation store created by the preprocess_nlp script (used instead '
+                             'of the nlp_data field of the documents).')
+    parser.add_argument('--output', default='-',
+                        help='Path to the output file (JSONL) or - for writing to stdout.')
+    parser.add_argument('--max_windows_per_entity', default=0, type=int,
+                        help='Maximum number of windows per entity, of which evenly spaced windows are kept (default: '
+                             '0, use all windows).')
+    parser.add_argument('--batch_size', default=32, type=int,
+                        help='Number of documents scored at once.')
+    args = parser.parse_args()
+
+    # Load the model and create the tokenizer from the vocabulary stored with the model
+    start_time = time.time()
+    model = NumpySECNN.load(args.model)
+    vocab_words = model.get_vocab_words()
+    if vocab_words is None:
+        parser.error('the exported model does not contain the word vocabulary')
+    tokenizer = Tokenizer(vocab_words={word: index for index, word in enumerate(vocab_words)},
+                          vocab_postags={postag: index for index, postag in enumerate(VOCAB_POSTAGS)},
+                          vocab_entities={entity: index for index, entity in enumerate(VOCAB_ENTITIES)})
+    preprocessor = Preprocessor(tokenizer, max_windows_per_entity=args.max_windows_per_entity)
+    print('Loaded the model in %.2f seconds' % (time.time() - start_time), file=sys.stderr)
+
+    # Stream the documents through the model
+    annotations = AnnotationStore(args.annotations) if args.annotations else None
+    output_handle = sys.stdout if args.output == '-' else open(args.output, 'w')
+    start_time = time.time()
+    documents_count = score_documents(model, preprocessor, iter_documents(args.input), output_handle,
+                                      batch_size=args.batch_size, annotations=annotations)
+    if output_handle is not sys.stdout:
+        output_handle.close()
+
+    elapsed = time.time() - start_time
+    print('Scored %d documents in %.2f seconds (%.2f docs/sec)' % (documents_count, elapsed,
+                                                                   documents_count / max(elapsed, 1e-9)),
+          file=sys.stderr)
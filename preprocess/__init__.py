@@ -1,24 +1,70 @@
 import json
 import re
+import time
+from functools import lru_cache
 from urllib.parse import urlencode
 
+import numpy as np
 import requests
 import unidecode
 
+from preprocess.nlp_cache import get_cache_key
+from preprocess.sampling import evenly_spaced_sample
+from preprocess.table import TokenTable, get_window_ids, pad_rows
+from preprocess.timing import StageTimer
+
+
+# Annotators requested from the Stanford CoreNLP server (the lean profile produces everything read by the
+# corenlp_to_tokens method: the tokens, sentences, POS-tags and NER-tags)
+ANNOTATOR_PROFILES = {
+    'lean': 'tokenize,ssplit,pos,lemma,ner',
+    'full': 'tokenize,ssplit,pos,ner,coref'
+}
+
 
 class StanfordCoreNLPClient:
     """A client for the Stanford CoreNLP server."""
 
-    def __init__(self, corenlp_base_url):
+    def __init__(self, corenlp_base_url, timeout=None, retries=0, backoff=1., pool_size=10, annotators='lean',
+                 cache=None):
         """Initialize the Stanford CoreNLP client.
 
+        The client can be shared by multiple threads, in which case the connections to the server are pooled.
+
         Parameters
         ----------
         corenlp_base_url : str
             The URL to the Stanford CoreNLP server.
+        timeout : float, optional
+            Number of seconds after which a request times out (default: None, no timeout).
+        retries : int, optional
+            Number of times a request is retried after a timeout, a connection error or a 5xx response (default: 0).
+        backoff : float, optional
+            Number of seconds to wait before the first retry, the waiting time doubles for every next retry
+            (default: 1).
+        pool_size : int, optional
+            Maximum number of pooled connections to the server (default: 10).
+        annotators : str, optional
+            The name of an annotator profile (see ANNOTATOR_PROFILES) or a comma-separated list of annotators (default:
+            'lean').
+        cache : AnnotationCache, optional
+            Cache in which the outputs are stored by the hash of the text and the annotators, such that repeated texts
+            are not sent to the server again (default: None).
         """
         self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         self.corenlp_base_url = corenlp_base_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.annotators = ANNOTATOR_PROFILES.get(annotators, annotators)
+        self.cache = cache
+
+    def is_cached(self, text):
+        """Check whether the output for a text is in the cache."""
+        return self.cache is not None and get_cache_key(text, self.annotators) in self.cache
 
     def __call__(self, text):
         """Query the Stanford CoreNLP server with text.
@@ -32,17 +78,39 @@ class StanfordCoreNLPClient:
         -------
         dict
             The JSON output of the Stanford CoreNLP server.
+
+        Raises
+        ------
+        requests.RequestException
+            When the request still fails after all retries.
         """
+        cache_key = get_cache_key(text, self.annotators) if self.cache is not None else None
+        if cache_key is not None:
+            data = self.cache.get(cache_key)
+            if data is not None:
+                return data
+
         query = {
             "properties": {
-                "annotators": "tokenize,ssplit,pos,ner,coref",
+                "annotators": self.annotators,
                 "timeout": 20000,
             },
             "pipelineLanguage": "en"
         }
         url = '%s/?%s' % (self.corenlp_base_url, urlencode(query))
-        response = self.session.post(url, text)
-        return json.loads(response.text)
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(url, text.encode('utf-8'), timeout=self.timeout)
+                response.raise_for_status()
+                data = json.loads(response.text)
+                if cache_key is not None:
+                    self.cache.put(cache_key, data)
+                return data
+            except (requests.Timeout, requests.ConnectionError, requests.HTTPError) as error:
+                is_server_error = not isinstance(error, requests.HTTPError) or error.response.status_code >= 500
+                if not is_server_error or attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
 
 
 def corenlp_to_tokens(corenlp_data):
@@ -115,61 +183,44 @@ def tokens_to_text(tokens):
     return ' '.join([token['word'] for token in tokens])
 
 
-def remove_empty_tokens(tokens):
-    """Remove tokens with an empty word field.
+def get_entity_mentions(entities):
+    """Get the text of the first mention of each entity label.
 
     Parameters
     ----------
-    tokens : list
-        Tokens found by the corenlp_to_tokens method.
+    entities : list
+        Entities of a document in which the first token of each entity has a 'label' attribute (for example the
+        entities returned by the Preprocessor).
 
     Returns
     -------
-    list
-        List of tokens where empty tokens are removed.
+    dict
+        A mapping from entity labels to the text of their first mention.
     """
-    return [token for token in tokens if len(token['word']) > 0]
+    mentions = {}
+    for entity in entities:
+        if entity[0]['label'] not in mentions:
+            mentions[entity[0]['label']] = entity[0].get('entity', tokens_to_text(entity))
+    return mentions
 
 
-def replace_entities(tokens, entities):
-    """Replace entities by entity markers
+def remove_empty_tokens(tokens):
+    """Remove tokens with an empty word field.
 
     Parameters
     ----------
     tokens : list
         Tokens found by the corenlp_to_tokens method.
 
-    entities : list
-        Entities (or filtered entities) obtained from the get_entities method in which the first token of each entity
-        has a 'label' attribute (for example obtained by the cluster_entities method).
-
     Returns
     -------
     list
-        List of tokens in which the head token of an entity is replaced by an entity marker ("@entity...") and the
-        remaining entity tokens are emptied. The entity marker head token also gets an additional field "entity" which
-        is the text of entity mention.
-    dict
-        The entities enriched with a label attribute.
+        List of tokens where empty tokens are removed.
     """
-    entities = entities  # type: list
-    tokens = list(tokens)
-    for entity_index, entity in enumerate(entities):
-        label = entity[0]['label']
-        start_index = entity[0]['index']
-        end_index = entity[-1]['index']
-        sentence = entity[0]['sentence']
-        for token_index, token in enumerate(tokens):
-            if start_index <= token['index'] <= end_index and token['sentence'] == sentence:
-                if token['index'] == start_index:
-                    tokens[token_index]['entity'] = tokens_to_text(entity)
-                tokens[token_index]['word'] = label if token['index'] == start_index else ''
-        for token_index, token in enumerate(entities[entity_index]):
-            entities[entity_index][token_index]['label'] = label
-
-    return tokens, entities
+    return [token for token in tokens if len(token['word']) > 0]
 
 
+@lru_cache(maxsize=2 ** 16)
 def normalize_entity(entity_text):
     """Normalize the string representation of entities such that it can be used for string comparisons.
 
@@ -207,67 +258,17 @@ def align_entities(entity_labels, entities):
         to one of the labels specified in the entity_labels list whenever the normalized entity string representation
         matches the normalized label.
     """
+    # Map each normalized label to the last label having that normalized form
+    labels_by_key = {normalize_entity(entity_label): entity_label for entity_label in entity_labels}
     entities = entities  # type: list
     for index, nlp_entity in enumerate(entities):
-        text = tokens_to_text(nlp_entity)
-        for entity_label in entity_labels:
-            if normalize_entity(text) == normalize_entity(entity_label):
-                for subindex, token in enumerate(nlp_entity):
-                    entities[index][subindex]['aligned_with'] = entity_label
+        entity_label = labels_by_key.get(normalize_entity(tokens_to_text(nlp_entity)))
+        if entity_label is not None:
+            for subindex, token in enumerate(nlp_entity):
+                entities[index][subindex]['aligned_with'] = entity_label
     return entities
 
 
-def get_entity_windows(entity, tokens, pre_window_size=15, post_window_size=15, pad_token='<PAD>',
-                       replace_by_target=True):
-    """Get a list of windows in which each window is a list of tokens centered around the token of the specified entity.
-
-    Parameters
-    ----------
-    entity : dict
-        An entity (one of the entities obtained by the get_entities method).
-    tokens : list
-        Tokens (obtained by the corenlp_to_tokens method.
-    pre_window_size : int, optional
-        Number of tokens before the entity token (default: 15).
-    post_window_size : int, optional
-        Number of tokens after the entity token (default: 15).
-    pad_token : str, optional
-        The PAD token (used for filling up empty space, default: '<PAD>').
-    replace_by_target : bool, optional
-        When true, then the word attribute of tokens equal to the word attribute of the specified entity is replaced by
-        '@target' (default: True).
-
-    Returns
-    -------
-    list
-        A list of windows (in which a window is a list of tokens containing the entity token).
-    """
-    entity_label = entity[0]['label']
-    windows = []
-    pad_token = {
-        'word': pad_token,
-        'pos': pad_token
-    }
-    for token_index, token in enumerate(tokens):
-        if token['word'] == entity_label:
-            pre_window = tokens[token_index - pre_window_size:token_index]
-            post_window = tokens[token_index + 1:token_index + 1 + post_window_size]
-            pre_window = max(0, pre_window_size - len(pre_window)) * [pad_token] + pre_window
-            post_window = post_window + max(0, post_window_size - len(post_window)) * [pad_token]
-            window = pre_window + [token] + post_window
-            for window_token in window:
-                if type(window_token) != dict:
-                    raise ValueError(window_token)
-            window = [{key: value for key, value in token.items()} for token in window]
-            if replace_by_target:
-                for window_index, window_token in enumerate(window):
-                    window_token = window_token  # type: dict
-                    if window_token['word'] == entity_label:
-                        window[window_index]['word'] = '@target'
-            windows.append(window)
-    return windows
-
-
 def cluster_entities(entities):
     """Cluster similar entities together such that they have the same 'label' attribute.
 
@@ -282,14 +283,11 @@ def cluster_entities(entities):
         List of entities having a 'label' attribute in which entities which equivalent normalized word representations
         get the same label.
     """
-    current_index = 1
+    # Entities get the label of the first entity having the same normalized word representation
+    labels_by_key = {}
     for index, entity in enumerate(entities):
-        entity[0]['label'] = '@entity%d' % current_index
-        current_index += 1
-    for index1, entity1 in enumerate(entities):
-        for index2, entity2 in enumerate(entities[index1 + 1:]):
-            if normalize_entity(tokens_to_text(entity2)) == normalize_entity(tokens_to_text(entity1)):
-                entity2[0]['label'] = entity1[0]['label']
+        key = normalize_entity(tokens_to_text(entity))
+        entity[0]['label'] = labels_by_key.setdefault(key, '@entity%d' % (index + 1))
     return entities
 
 
@@ -297,8 +295,64 @@ class Preprocessor:
     """The preprocess class that applies the preprocess pipeline.
     """
 
-    def __init__(self, tokenizer):
+    def __init__(self, tokenizer, pre_window_size=15, post_window_size=15, pad_token='<PAD>', instrument=False,
+                 max_windows_per_entity=0):
+        """Initialize the preprocessor.
+
+        Parameters
+        ----------
+        tokenizer : Tokenizer
+            The tokenizer used for converting the entity windows to identifiers.
+        pre_window_size : int, optional
+            Number of tokens before the entity token in each window (default: 15).
+        post_window_size : int, optional
+            Number of tokens after the entity token in each window (default: 15).
+        pad_token : str, optional
+            The PAD token (used for filling up empty space, default: '<PAD>').
+        instrument : bool, optional
+            When True, the time spent in each stage of the pipeline is added to the output (default: False).
+        max_windows_per_entity : int, optional
+            Maximum number of mentions (windows) per entity, of which evenly spaced mentions are kept for entities with
+            more mentions (default: 0, keep all mentions). For training, use the WindowSampler instead.
+        """
         self.tokenizer = tokenizer
+        self.pre_window_size = pre_window_size
+        self.post_window_size = post_window_size
+        self.pad_token = pad_token
+        self.instrument = instrument
+        self.max_windows_per_entity = max_windows_per_entity
+
+    def get_entity_windows(self, table, token_ids, positions):
+        """Cut the windows of all entities out of the identifiers of the tokens of a document.
+
+        Parameters
+        ----------
+        table : TokenTable
+            The token table in which the entities were replaced (see TokenTable.replace_entities).
+        token_ids : np.ndarray
+            The (tokens, 3) array of token identifiers (see Tokenizer.tokenize_columns).
+        positions : dict
+            The mapping from entity labels to the positions of their entity markers returned by
+            TokenTable.replace_entities (capped in place when max_windows_per_entity is given).
+
+        Returns
+        -------
+        dict
+            A mapping from entities to (windows, window length, 3) int32 arrays of entity windows.
+        """
+        pad_ids = self.tokenizer.tokenize_cached(self.pad_token, self.pad_token)
+        target_ids = self.tokenizer.tokenize_cached('@target', None)
+        window_size = self.pre_window_size + 1 + self.post_window_size
+        padded_ids = pad_rows(token_ids, self.pre_window_size, self.post_window_size, pad_ids)
+        padded_codes = pad_rows(table.label_codes, self.pre_window_size, self.post_window_size, -1)
+        document = {}
+        for label_code, label in enumerate(table.labels):
+            if 0 < self.max_windows_per_entity < len(positions[label]):
+                positions[label] = positions[label][evenly_spaced_sample(len(positions[label]),
+                                                                         self.max_windows_per_entity)]
+            document[label] = get_window_ids(padded_ids, padded_codes, positions[label], label_code, window_size,
+                                             target_ids=target_ids)
+        return document
 
     def __call__(self, data):
         """Apply the preprocessing pipeline on data found in the input JSON files.
@@ -306,7 +360,8 @@ class Preprocessor:
         Parameters
         ----------
         data : dict
-            Contents of a JSON input file.
+            Contents of a JSON input file. The tokens are read from the nlp_table field (a TokenTable, for example
+            obtained from the AnnotationStore) when available and from the nlp_data field otherwise.
 
         Returns
         -------
@@ -315,36 +370,49 @@ class Preprocessor:
             - entities : list
                 A list of entities.
             - document : dict
-                A mapping (dict) from entities to entity windows.
+                A mapping (dict) from entities to (windows, window length, 3) int32 arrays of entity windows.
             - targets : dict, optional
                 When available, targets is a mapping (dict) from entities to booleans where True means that the entity
                 is salient and False means that the entity is not salient.
+            - sequence : dict
+                The whole document for the sentence and document encoders of the model, containing the (tokens, 3)
+                int32 array of token identifiers ('ids'), the (sentences + 1,) int64 array of sentence offsets
+                ('sentences') and a mapping from entities to the positions of their entity markers ('positions').
+            - timings : dict, optional
+                When instrumented, a mapping from the stages of the pipeline to the time spent in them (in seconds).
         """
+        timer = StageTimer(enabled=self.instrument)
 
         # Preprocess the data
-        tokens = corenlp_to_tokens(data['nlp_data'])
-        entities = get_entities(tokens)
-        if 'salient_entities' in data.keys():
-            if 'nonsalient_entities' not in data.keys():
-                data['nonsalient_entities'] = []
-            entities = align_entities(data['salient_entities'] + data['nonsalient_entities'], entities)
-            for index, entity in enumerate(entities):
-                entity[0]['is_salient'] = entity[0]['aligned_with'] in data['salient_entities'] if 'aligned_with' in \
-                                                                                                   entity[0] else False
+        with timer.stage('corenlp_to_tokens'):
+            table = data['nlp_table'] if 'nlp_table' in data else TokenTable.from_corenlp(data['nlp_data'])
+        with timer.stage('get_entities'):
+            spans = table.get_entity_spans()
+            entities = [table.get_tokens(start, end) for start, end in spans]
+        with timer.stage('align_entities'):
+            if 'salient_entities' in data.keys():
+                if 'nonsalient_entities' not in data.keys():
+                    data['nonsalient_entities'] = []
+                entities = align_entities(data['salient_entities'] + data['nonsalient_entities'], entities)
+                for index, entity in enumerate(entities):
+                    entity[0]['is_salient'] = entity[0]['aligned_with'] in data['salient_entities'] if \
+                        'aligned_with' in entity[0] else False
 
         # Only use aligned entities
-        entities = [entity for entity in entities if len(entity) > 0 and ('aligned_with' in entity[0].keys() or (
-                'salient_entities' not in data.keys() and 'nonsalient_entities' not in data.keys()))]
-        entities = cluster_entities(entities)
-        tokens, entities = replace_entities(tokens, entities)
-
-        # Fetch all entity windows
-        entity_windows = {entity[0]['label']: [] for entity in entities}
-        for entity in entities:
-            entity_windows[entity[0]['label']] = get_entity_windows(entity, tokens, replace_by_target=True)
-
-        # Convert tokens to vectors
-        document = self.tokenizer.tokenize_document(entity_windows)
+        with timer.stage('cluster_entities'):
+            aligned = [index for index, entity in enumerate(entities) if len(entity) > 0 and (
+                    'aligned_with' in entity[0].keys() or (
+                    'salient_entities' not in data.keys() and 'nonsalient_entities' not in data.keys()))]
+            entities = cluster_entities([entities[index] for index in aligned])
+            spans = [spans[index] for index in aligned]
+        with timer.stage('replace_entities'):
+            positions = table.replace_entities(spans, entities)
+
+        # Convert tokens to identifiers and cut out all entity windows
+        with timer.stage('tokenize_document'):
+            token_ids = self.tokenizer.tokenize_columns(table.words, table.postags)
+        with timer.stage('get_entity_windows'):
+            document = self.get_entity_windows(table, token_ids, positions)
 
         # Figure out the targets
         targets = {}
@@ -352,15 +420,18 @@ class Preprocessor:
             if 'is_salient' in entity[0].keys():
                 targets[entity[0]['label']] = 1. if entity[0]['is_salient'] else 0.
 
-        if len(targets) > 0:
-            return {
-                'entities': entities,
-                'document': document,
-                'targets': targets
-            }
-        else:
-            return {
-                'entities': entities,
-                'document': document,
-                'targets': {}
+        sentence_offsets = np.zeros(table.sentences.max() + 1 if len(table) > 0 else 1, dtype=np.int64)
+        np.cumsum(np.bincount(table.sentences)[1:], out=sentence_offsets[1:])
+        output = {
+            'entities': entities,
+            'document': document,
+            'targets': targets,
+            'sequence': {
+                'ids': token_ids,
+                'sentences': sentence_offsets,
+                'positions': positions
             }
+        }
+        if self.instrument:
+            output['timings'] = timer.timings
+        return output
@@ -0,0 +1,296 @@
+import json
+import os
+
+import numpy as np
+
+from preprocess.table import TokenTable
+
+ANNOTATIONS_VERSION = 1
+
+INDEX_FILE = 'annotations.json'
+
+
+def encode_strings(strings):
+    """Dictionary-encode a list of strings.
+
+    Parameters
+    ----------
+    strings : list
+        The strings to encode.
+
+    Returns
+    -------
+    np.ndarray
+        The int32 identifier of every string.
+    list
+        The vocabulary (the distinct strings in order of first occurrence).
+    """
+    vocab = {}
+    ids = np.array([vocab.setdefault(string, len(vocab)) for string in strings], dtype=np.int32)
+    return ids, list(vocab)
+
+
+def pack_vocab(vocab):
+    """Store a vocabulary as a byte array and offsets (such that no fixed-width string array is needed).
+
+    Parameters
+    ----------
+    vocab : list
+        The strings of the vocabulary.
+
+    Returns
+    -------
+    np.ndarray
+        The UTF-8 encoded strings (uint8).
+    np.ndarray
+        The (len(vocab) + 1,) int64 offsets of the strings in the byte array.
+    """
+    encoded = [string.encode('utf-8') for string in vocab]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(string) for string in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def unpack_vocab(vocab_bytes, vocab_offsets):
+    """Restore a vocabulary stored by the pack_vocab method.
+
+    Returns
+    -------
+    list
+        The strings of the vocabulary.
+    """
+    data = vocab_bytes.tobytes()
+    return [data[start:end].decode('utf-8') for start, end in zip(vocab_offsets[:-1], vocab_offsets[1:])]
+
+
+class AnnotationWriter:
+    """Writes the annotations of documents to a compact annotation store.
+
+    Of the output of the Stanford CoreNLP pipeline, only the columns used by the preprocessing are stored: the original
+    text, POS-tag and NER-tag of every token and the number of tokens of every sentence. Each shard is a compressed
+    .npz file in which the words and tags are dictionary-encoded. The index is updated after every shard, so the
+    documents of the written shards are available after a crash.
+    """
+
+    def __init__(self, path, shard_size=10000, append=False):
+        """Initialize the annotation writer.
+
+        Parameters
+        ----------
+        path : str
+            Folder of the annotation store.
+        shard_size : int, optional
+            Number of documents per shard (default: 10000).
+        append : bool, optional
+            When True, the shards are added to an existing store, in which the annotations of documents written later
+            replace earlier annotations of the same documents (default: False).
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.shard_size = shard_size
+        self.shards = []
+        index_path = os.path.join(path, INDEX_FILE)
+        if append and os.path.exists(index_path):
+            with open(index_path, 'r') as index_handle:
+                self.shards = json.load(index_handle)['shards']
+        self.reset_shard()
+
+    def reset_shard(self):
+        self.doc_ids = []
+        self.words = []
+        self.postags = []
+        self.ners = []
+        self.sentence_lengths = []
+        self.token_counts = []
+        self.sentence_counts = []
+
+    def write(self, doc_id, nlp_data):
+        """Add the annotations of a document to the store.
+
+        Parameters
+        ----------
+        doc_id : str
+            The identifier of the document (the file name for a folder of JSON files, see the iter_documents method).
+        nlp_data : dict
+            The output of the Stanford CoreNLP client.
+
+        Returns
+        -------
+        list
+            The identifiers of the documents which were written to disk (see the flush method).
+        """
+        tokens_count = 0
+        for sentence in nlp_data['sentences']:
+            for token in sentence['tokens']:
+                self.words.append(token['originalText'])
+                self.postags.append(token['pos'])
+                self.ners.append(token['ner'])
+            self.sentence_lengths.append(len(sentence['tokens']))
+            tokens_count += len(sentence['tokens'])
+        self.doc_ids.append(str(doc_id))
+        self.token_counts.append(tokens_count)
+        self.sentence_counts.append(len(nlp_data['sentences']))
+        if len(self.doc_ids) >= self.shard_size:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """Write the documents added since the last flush to a new shard and update the index.
+
+        Returns
+        -------
+        list
+            The identifiers of the documents in the new shard.
+        """
+        if len(self.doc_ids) == 0:
+            return []
+        word_ids, word_vocab = encode_strings(self.words)
+        postag_ids, postag_vocab = encode_strings(self.postags)
+        ner_ids, ner_vocab = encode_strings(self.ners)
+        word_bytes, word_offsets = pack_vocab(word_vocab)
+        token_offsets = np.zeros(len(self.token_counts) + 1, dtype=np.int64)
+        np.cumsum(self.token_counts, out=token_offsets[1:])
+        sentence_offsets = np.zeros(len(self.sentence_counts) + 1, dtype=np.int64)
+        np.cumsum(self.sentence_counts, out=sentence_offsets[1:])
+
+        name = 'annotations-%05d.npz' % len(self.shards)
+        temporary_path = os.path.join(self.path, name + '.tmp')
+        with open(temporary_path, 'wb') as shard_handle:
+            np.savez_compressed(shard_handle,
+                                doc_ids=np.array(self.doc_ids, dtype=np.str_),
+                                token_offsets=token_offsets,
+                                sentence_offsets=sentence_offsets,
+                                sentence_lengths=np.array(self.sentence_lengths, dtype=np.int32),
+                                word_ids=word_ids,
+                                word_bytes=word_bytes,
+                                word_offsets=word_offsets,
+                                postag_ids=postag_ids.astype(np.uint16),
+                                postag_vocab=np.array(postag_vocab, dtype=np.str_),
+                                ner_ids=ner_ids.astype(np.uint16),
+                                ner_vocab=np.array(ner_vocab, dtype=np.str_))
+        os.replace(temporary_path, os.path.join(self.path, name))
+        self.shards.append({'name': name, 'documents': len(self.doc_ids)})
+        self.write_index()
+        doc_ids = self.doc_ids
+        self.reset_shard()
+        return doc_ids
+
+    def write_index(self):
+        temporary_path = os.path.join(self.path, INDEX_FILE + '.tmp')
+        with open(temporary_path, 'w') as index_handle:
+            json.dump({'version': ANNOTATIONS_VERSION, 'shards': self.shards}, index_handle, indent=2)
+        os.replace(temporary_path, os.path.join(self.path, INDEX_FILE))
+
+    def close(self):
+        """Write the last shard and the index.
+
+        Returns
+        -------
+        list
+            The identifiers of the documents in the last shard.
+        """
+        doc_ids = self.flush()
+        self.write_index()
+        return doc_ids
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AnnotationStore:
+    """Reads the annotations of documents from a compact annotation store (see the AnnotationWriter class).
+
+    Shards are loaded (and their vocabularies decoded) when a document in them is requested for the first time.
+    """
+
+    def __init__(self, path):
+        """Initialize the annotation store.
+
+        Parameters
+        ----------
+        path : str
+            Folder of the annotation store.
+        """
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE), 'r') as index_handle:
+            self.index = json.load(index_handle)
+        if self.index.get('version') != ANNOTATIONS_VERSION:
+            raise ValueError('Unsupported version of the annotation store %s: %s' % (path, self.index.get('version')))
+        self.shards = [None] * len(self.index['shards'])
+        self.locations = {}
+        for shard_index, shard in enumerate(self.index['shards']):
+            with np.load(os.path.join(path, shard['name'])) as shard_data:
+                for local_index, doc_id in enumerate(shard_data['doc_ids']):
+                    self.locations[str(doc_id)] = (shard_index, local_index)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.locations
+
+    def load_shard(self, shard_index):
+        """Load the arrays of a shard and decode its vocabularies.
+
+        Parameters
+        ----------
+        shard_index : int
+            Index of the shard.
+
+        Returns
+        -------
+        dict
+            A mapping from array names to arrays and from 'words', 'postags' and 'ners' to the decoded vocabularies.
+        """
+        if self.shards[shard_index] is None:
+            shard_path = os.path.join(self.path, self.index['shards'][shard_index]['name'])
+            with np.load(shard_path) as shard_data:
+                shard = {name: shard_data[name] for name in shard_data.files}
+            shard['words'] = unpack_vocab(shard['word_bytes'], shard['word_offsets'])
+            shard['postags'] = [str(postag) for postag in shard['postag_vocab']]
+            shard['ners'] = [str(ner) for ner in shard['ner_vocab']]
+            self.shards[shard_index] = shard
+        return self.shards[shard_index]
+
+    def get_shard_path(self, doc_id):
+        """Get the path of the shard in which the annotations of a document are stored.
+
+        Parameters
+        ----------
+        doc_id : str
+            The identifier of the document.
+
+        Returns
+        -------
+        str
+            The path of the shard, or None when the document is not in the store.
+        """
+        if doc_id not in self.locations:
+            return None
+        return os.path.join(self.path, self.index['shards'][self.locations[doc_id][0]]['name'])
+
+    def get_table(self, doc_id):
+        """Get the tokens of a document.
+
+        Parameters
+        ----------
+        doc_id : str
+            The identifier of the document.
+
+        Returns
+        -------
+        TokenTable
+            The token table of the document (which can be passed to the Preprocessor in the nlp_table field).
+        """
+        shard_index, local_index = self.locations[doc_id]
+        shard = self.load_shard(shard_index)
+        token_start, token_end = shard['token_offsets'][local_index:local_index + 2]
+        sentence_start, sentence_end = shard['sentence_offsets'][local_index:local_index + 2]
+        words, postags, ners = shard['words'], shard['postags'], shard['ners']
+        return TokenTable.from_compact([words[index] for index in shard['word_ids'][token_start:token_end]],
+                                       [postags[index] for index in shard['postag_ids'][token_start:token_end]],
+                                       [ners[index] for index in shard['ner_ids'][token_start:token_end]],
+                                       shard['sentence_lengths'][sentence_start:sentence_end])
@@ -0,0 +1,337 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+from chainer.dataset import DatasetMixin
+
+from preprocess.manifest import Manifest, hash_bytes
+
+CACHE_VERSION = 4
+
+SHARD_ARRAYS = ['windows', 'window_offsets', 'entity_offsets', 'labels', 'targets']
+
+
+def get_cache_key(preprocessor):
+    """Compute the key of the tensor cache for the given preprocessor.
+
+    Parameters
+    ----------
+    preprocessor : Preprocessor
+        The preprocessor used for building the cache.
+
+    Returns
+    -------
+    str
+        A hexadecimal digest of the vocabularies of the tokenizer and the window sizes of the preprocessor.
+    """
+    digest = hashlib.sha1()
+    digest.update(('version=%d;pre=%d;post=%d;' % (CACHE_VERSION, preprocessor.pre_window_size,
+                                                  preprocessor.post_window_size)).encode('utf-8'))
+    tokenizer = preprocessor.tokenizer
+    for vocab in [tokenizer.vocab_words, tokenizer.vocab_postags, tokenizer.vocab_entities]:
+        items = sorted(vocab.items(), key=lambda item: item[1])
+        digest.update('\n'.join('%s\t%d' % item for item in items).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class TensorShardWriter:
+    """Collects preprocessed documents and writes them as a shard of int32/float32 arrays."""
+
+    def __init__(self, window_size):
+        """Initialize the shard writer.
+
+        Parameters
+        ----------
+        window_size : int
+            Number of tokens in a window.
+        """
+        self.window_size = window_size
+        self.windows = []
+        self.window_counts = []
+        self.entity_counts = []
+        self.labels = []
+        self.targets = []
+
+    def __len__(self):
+        return len(self.entity_counts)
+
+    def add(self, example):
+        """Add a preprocessed document to the shard.
+
+        Parameters
+        ----------
+        example : dict
+            Output of the Preprocessor.
+        """
+        document = example['document']
+        targets = example.get('targets', {})
+        for label in document:
+            windows = np.asarray(document[label], dtype=np.int32).reshape(-1, self.window_size, 3)
+            self.windows.append(windows)
+            self.window_counts.append(len(windows))
+            self.labels.append(label)
+            self.targets.append(targets.get(label, np.nan))
+        self.entity_counts.append(len(document))
+
+    def write(self, path):
+        """Write the shard to a directory (one .npy file per array).
+
+        Parameters
+        ----------
+        path : str
+            Directory of the shard.
+        """
+        os.makedirs(path)
+        window_offsets = np.zeros(len(self.window_counts) + 1, dtype=np.int64)
+        np.cumsum(self.window_counts, out=window_offsets[1:])
+        entity_offsets = np.zeros(len(self.entity_counts) + 1, dtype=np.int64)
+        np.cumsum(self.entity_counts, out=entity_offsets[1:])
+        arrays = {
+            'windows': np.concatenate(self.windows, axis=0) if len(self.windows) > 0 else np.zeros(
+                (0, self.window_size, 3), dtype=np.int32),
+            'window_offsets': window_offsets,
+            'entity_offsets': entity_offsets,
+            'labels': np.array(self.labels, dtype=np.str_),
+            'targets': np.array(self.targets, dtype=np.float32)
+        }
+        for name in SHARD_ARRAYS:
+            np.save(os.path.join(path, '%s.npy' % name), arrays[name])
+
+
+def get_shard_name(files, hashes):
+    """Name a shard after the paths and content hashes of its files.
+
+    Parameters
+    ----------
+    files : list
+        Paths of the files in the shard.
+    hashes : dict
+        A mapping from paths to content hashes.
+
+    Returns
+    -------
+    str
+        The name of the shard.
+    """
+    digest = hashlib.sha1(''.join('%s\t%s\n' % (file, hashes[file]) for file in files).encode('utf-8'))
+    return 'shard-%s' % digest.hexdigest()[:20]
+
+
+def build_cache(files, file_loader, cache_dir, shard_size=1000, progressbar=None):
+    """Preprocess the given files and store the results in the tensor cache.
+
+    The cache is stored in a subdirectory of cache_dir which is named after the cache key (see get_cache_key), such
+    that changing the vocabularies or the window sizes results in a new cache. The cache is updated incrementally: a
+    manifest in the cache records the content hash of every file, shards whose files are all unchanged are reused,
+    shards containing changed or removed files are rebuilt in place and new files are added in new shards. Since the
+    shards are named after the content hashes of their files, the shards written before a crash are reused as well.
+    When the file loader reads the tokens from an annotation store, the hash of a file also covers the annotation shard
+    of the document, such that annotating the documents again rebuilds their shards. The index of the cache records
+    the shard and position of every document, such that the CachedDataset returns the documents in the order of the
+    given files (whatever shards they were added to).
+
+    Parameters
+    ----------
+    files : iterable
+        Paths of the (preprocessed) JSON files.
+    file_loader : JSONFileLoader
+        The file loader (including the preprocessor) used for loading the files.
+    cache_dir : str
+        Directory in which caches are stored.
+    shard_size : int, optional
+        Number of documents per new shard (default: 1000).
+    progressbar : tqdm, optional
+        Progress bar which is updated for every file (default: None).
+
+    Returns
+    -------
+    str
+        Path to the cache which can be used by the CachedDataset.
+    """
+    preprocessor = file_loader.preprocessor
+    path = os.path.join(cache_dir, get_cache_key(preprocessor))
+    os.makedirs(path, exist_ok=True)
+    window_size = preprocessor.pre_window_size + 1 + preprocessor.post_window_size
+    files = list(files)
+
+    # Hash the files (only reading the files whose size or modification time changed)
+    hashes = {}
+    annotations = getattr(file_loader, 'annotations', None)
+    annotation_hashes = {None: 'missing'}
+    with Manifest(os.path.join(path, 'manifest.jsonl')) as manifest:
+        for file in files:
+            content_hash = manifest.known_hash(file, file)
+            if content_hash is None:
+                content_hash = manifest.file_hash(file, file)
+                manifest.record(file, content_hash, 'hashed', path=file)
+            if annotations is not None:
+                # The tokens are read from the annotation store, so the hash also covers the shard of the document
+                shard_path = annotations.get_shard_path(os.path.basename(file))
+                if shard_path not in annotation_hashes:
+                    shard_hash = manifest.known_hash(shard_path, shard_path)
+                    if shard_hash is None:
+                        shard_hash = manifest.file_hash(shard_path, shard_path)
+                        manifest.record(shard_path, shard_hash, 'hashed', path=shard_path)
+                    annotation_hashes[shard_path] = shard_hash
+                content_hash = hash_bytes(('%s;%s' % (content_hash, annotation_hashes[shard_path])).encode('utf-8'))
+            hashes[file] = content_hash
+
+    # Keep the files of the existing shards together and put the new files in new shards
+    shards = []
+    remaining = dict.fromkeys(files)
+    index_path = os.path.join(path, 'index.json')
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as index_handle:
+            for shard in json.load(index_handle)['shards']:
+                shard_files = [file for file in shard['files'] if file in remaining]
+                for file in shard_files:
+                    del remaining[file]
+                if len(shard_files) > 0:
+                    shards.append(shard_files)
+    remaining = list(remaining)
+    shards += [remaining[start:start + shard_size] for start in range(0, len(remaining), shard_size)]
+
+    index = {
+        'version': CACHE_VERSION,
+        'window_size': window_size,
+        'shards': []
+    }
+    for shard_files in shards:
+        name = get_shard_name(shard_files, hashes)
+        shard_path = os.path.join(path, name)
+        if not os.path.exists(shard_path):
+            writer = TensorShardWriter(window_size)
+            for file in shard_files:
+                writer.add(file_loader.load_file(file))
+                if progressbar is not None:
+                    progressbar.update()
+            temporary_path = shard_path + '.tmp'
+            if os.path.exists(temporary_path):
+                shutil.rmtree(temporary_path)
+            writer.write(temporary_path)
+            os.rename(temporary_path, shard_path)
+        elif progressbar is not None:
+            progressbar.update(len(shard_files))
+        index['shards'].append({'name': name, 'files': shard_files, 'hashes': [hashes[file] for file in shard_files]})
+    locations = {file: [shard_index, local_index] for shard_index, shard in enumerate(index['shards'])
+                 for local_index, file in enumerate(shard['files'])}
+    index['documents'] = [locations[file] for file in files]
+
+    temporary_index_path = index_path + '.tmp'
+    with open(temporary_index_path, 'w') as index_handle:
+        json.dump(index, index_handle)
+    os.replace(temporary_index_path, index_path)
+
+    # Remove the shards which are no longer used
+    names = set(shard['name'] for shard in index['shards'])
+    for entry in os.scandir(path):
+        if entry.is_dir() and entry.name.startswith('shard-') and entry.name not in names:
+            shutil.rmtree(entry.path)
+    if progressbar is not None:
+        progressbar.close()
+    return path
+
+
+class CachedDataset(DatasetMixin):
+    """Dataset reading preprocessed documents from the tensor cache (see build_cache).
+
+    The shards are memory-mapped, such that the windows of an entity are views on the cached arrays and no copies are
+    made when reading an example. The documents are numbered in the order of the files given to build_cache.
+    """
+
+    def __init__(self, path):
+        """Initialize the dataset.
+
+        Parameters
+        ----------
+        path : str
+            Path to the cache (as returned by build_cache).
+        """
+        self.path = path
+        with open(os.path.join(path, 'index.json'), 'r') as index_handle:
+            self.index = json.load(index_handle)
+        self.shards = [None] * len(self.index['shards'])
+        self.documents = np.asarray(self.index['documents'], dtype=np.int64).reshape(-1, 2)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def load_shard(self, shard_index):
+        """Memory-map the arrays of a shard.
+
+        Parameters
+        ----------
+        shard_index : int
+            Index of the shard.
+
+        Returns
+        -------
+        dict
+            A mapping from array names to (memory-mapped) arrays.
+        """
+        if self.shards[shard_index] is None:
+            shard_path = os.path.join(self.path, self.index['shards'][shard_index]['name'])
+            self.shards[shard_index] = {name: np.load(os.path.join(shard_path, '%s.npy' % name), mmap_mode='r')
+                                        for name in SHARD_ARRAYS}
+        return self.shards[shard_index]
+
+    def window_counts(self, max_windows_per_entity=0):
+        """Count the windows of every document without reading the windows themselves.
+
+        Parameters
+        ----------
+        max_windows_per_entity : int, optional
+            Maximum number of windows counted per entity (default: 0, no maximum).
+
+        Returns
+        -------
+        numpy.ndarray
+            The total number of windows (of all entities) of each document.
+        """
+        counts = []
+        for shard_index in range(len(self.shards)):
+            shard = self.load_shard(shard_index)
+            window_offsets = shard['window_offsets']
+            if max_windows_per_entity > 0:
+                window_offsets = np.zeros(len(window_offsets), dtype=np.int64)
+                np.cumsum(np.minimum(np.diff(shard['window_offsets']), max_windows_per_entity), out=window_offsets[1:])
+            counts.append(np.diff(window_offsets[shard['entity_offsets']]))
+        if len(counts) == 0:
+            return np.zeros(0, dtype=np.int64)
+        shard_offsets = np.cumsum([0] + [len(shard_counts) for shard_counts in counts])
+        return np.concatenate(counts)[shard_offsets[self.documents[:, 0]] + self.documents[:, 1]]
+
+    def get_example(self, i):
+        """Get a preprocessed document.
+
+        Parameters
+        ----------
+        i : int
+            Index of the document.
+
+        Returns
+        -------
+        dict
+            A dictionary containing the 'document' and 'targets' keys (see the Preprocessor class).
+        """
+        shard_index, local_index = self.documents[i]
+        shard = self.load_shard(shard_index)
+        window_offsets = shard['window_offsets']
+        entity_start, entity_end = shard['entity_offsets'][local_index:local_index + 2]
+
+        document = {}
+        targets = {}
+        for entity_index in range(entity_start, entity_end):
+            label = str(shard['labels'][entity_index])
+            document[label] = shard['windows'][window_offsets[entity_index]:window_offsets[entity_index + 1]]
+            target = shard['targets'][entity_index]
+            if not np.isnan(target):
+                targets[label] = float(target)
+
+        return {
+            'document': document,
+            'targets': targets
+        }
@@ -0,0 +1,218 @@
+import gzip
+import json
+import os
+import sys
+
+
+def is_sharded(path):
+    """Check whether the given path is a sharded JSONL corpus (see the JSONLShardWriter class).
+
+    Parameters
+    ----------
+    path : str
+        Path to the corpus.
+
+    Returns
+    -------
+    bool
+        True when the path is a folder containing an index.json file.
+    """
+    return os.path.isfile(os.path.join(path, 'index.json'))
+
+
+def load_index(path):
+    """Load the index of a sharded JSONL corpus.
+
+    Parameters
+    ----------
+    path : str
+        Path to the corpus.
+
+    Returns
+    -------
+    dict
+        The index containing the list of shards (each having a 'name' and a 'documents' count).
+    """
+    with open(os.path.join(path, 'index.json'), 'r') as index_handle:
+        return json.load(index_handle)
+
+
+def open_shard(path, mode='r'):
+    """Open a (optionally gzip-compressed) JSONL shard in text mode.
+
+    Parameters
+    ----------
+    path : str
+        Path to the shard (compressed when the name ends with '.gz').
+    mode : str, optional
+        Either 'r' or 'w' (default: 'r').
+
+    Returns
+    -------
+    file
+        The file handle.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def parse_document(content, errors='raise'):
+    """Parse a JSON document.
+
+    Parameters
+    ----------
+    content : str or bytes
+        The JSON representation of the document.
+    errors : str, optional
+        Either 'raise' (raise the error) or 'return' (return the error instead of the document) when the document
+        cannot be parsed (default: 'raise').
+
+    Returns
+    -------
+    dict or ValueError
+        The document, or the error when it cannot be parsed and errors is 'return'.
+    """
+    try:
+        return json.loads(content)
+    except ValueError as error:
+        if errors == 'raise':
+            raise
+        return error
+
+
+def iter_shard(path, errors='raise'):
+    """Iterate over the documents of a JSONL shard.
+
+    Parameters
+    ----------
+    path : str
+        Path to the shard.
+    errors : str, optional
+        Either 'raise' or 'return' (see the parse_document method, default: 'raise').
+
+    Returns
+    -------
+    iterator
+        An iterator over (doc_id, data) tuples in which doc_id is the 'id' field of the document, defaulting to
+        '<shard name>:<line number>'.
+    """
+    name = os.path.basename(path)
+    with open_shard(path) as shard_handle:
+        for line_number, line in enumerate(shard_handle):
+            if len(line.strip()) > 0:
+                data = parse_document(line, errors=errors)
+                default_id = '%s:%d' % (name, line_number)
+                yield (data.get('id', default_id) if isinstance(data, dict) else default_id), data
+
+
+def iter_documents(path, errors='raise'):
+    """Iterate over the documents of a corpus.
+
+    Parameters
+    ----------
+    path : str
+        Path to a sharded JSONL corpus, to a folder containing one JSON file per document, or '-' for reading one JSON
+        document per line from stdin.
+    errors : str, optional
+        Either 'raise' or 'return' (see the parse_document method, default: 'raise'). With 'return', documents which
+        cannot be parsed are yielded as (doc_id, error) tuples.
+
+    Returns
+    -------
+    iterator
+        An iterator over (doc_id, data) tuples in which doc_id is the file name (for JSON files), the 'id' field (for
+        JSONL shards, see the iter_shard method) or the 'id' field or line number (for stdin).
+    """
+    if path == '-':
+        for line_number, line in enumerate(sys.stdin):
+            if len(line.strip()) > 0:
+                data = parse_document(line, errors=errors)
+                yield (data.get('id', line_number) if isinstance(data, dict) else line_number), data
+    elif is_sharded(path):
+        for shard in load_index(path)['shards']:
+            yield from iter_shard(os.path.join(path, shard['name']), errors=errors)
+    else:
+        for entry in os.scandir(path):
+            if entry.is_file():
+                with open(entry.path, 'rb') as input_handle:
+                    yield entry.name, parse_document(input_handle.read(), errors=errors)
+
+
+def read_documents(path, count):
+    """Read the first documents of a corpus.
+
+    Parameters
+    ----------
+    path : str
+        Path to the corpus (see the iter_documents method).
+    count : int
+        Number of documents to read.
+
+    Returns
+    -------
+    list
+        The first (doc_id, data) tuples of the corpus.
+    """
+    documents = []
+    for document in iter_documents(path):
+        if len(documents) == count:
+            break
+        documents.append(document)
+    return documents
+
+
+class JSONLShardWriter:
+    """Writes documents to a sharded JSONL corpus (one JSON document per line, a fixed number of lines per shard)."""
+
+    def __init__(self, path, shard_size=10000, compress=False):
+        """Initialize the shard writer.
+
+        Parameters
+        ----------
+        path : str
+            Folder in which the shards and the index are written.
+        shard_size : int, optional
+            Number of documents per shard (default: 10000).
+        compress : bool, optional
+            Whether the shards are gzip-compressed (default: False).
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.shard_size = shard_size
+        self.compress = compress
+        self.shards = []
+        self.shard_handle = None
+
+    def write(self, data):
+        """Append a document to the corpus.
+
+        Parameters
+        ----------
+        data : dict
+            The document.
+        """
+        if self.shard_handle is None or self.shards[-1]['documents'] == self.shard_size:
+            self.close_shard()
+            name = 'shard-%05d.jsonl%s' % (len(self.shards), '.gz' if self.compress else '')
+            self.shard_handle = open_shard(os.path.join(self.path, name), 'w')
+            self.shards.append({'name': name, 'documents': 0})
+        self.shard_handle.write(json.dumps(data) + '\n')
+        self.shards[-1]['documents'] += 1
+
+    def close_shard(self):
+        if self.shard_handle is not None:
+            self.shard_handle.close()
+            self.shard_handle = None
+
+    def close(self):
+        """Close the last shard and write the index."""
+        self.close_shard()
+        with open(os.path.join(self.path, 'index.json'), 'w') as index_handle:
+            json.dump({'shards': self.shards}, index_handle, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,18 +1,29 @@
 import json
+import os
+
+from preprocess.timing import StageTimer
 
 
 class JSONFileLoader:
     """The file loader class used for a data iterator such that it loads JSON data when requested."""
 
-    def __init__(self, preprocessor=None):
+    def __init__(self, preprocessor=None, instrument=False, annotations=None):
         """Initialize the file loader.
 
         Parameters
         ----------
         preprocessor : method, optional
             Method which is applied to the data when loaded (default: None).
+        instrument : bool, optional
+            When True, the time spent reading ('io') and decoding ('json') the file is added to the 'timings' field of
+            the preprocessed data (default: False).
+        annotations : AnnotationStore, optional
+            When given, the tokens of the documents are read from the annotation store (by file name) instead of the
+            nlp_data field of the files (default: None).
         """
         self.preprocessor = preprocessor
+        self.instrument = instrument
+        self.annotations = annotations
 
     def load_file(self, path):
         """Loads (open, read and JSON decode) a file.
@@ -27,9 +38,19 @@ class JSONFileLoader:
         dict
             The preprocessed version of the data found in the file.
         """
-        with open(path, 'r') as input_handle:
-            data = json.load(input_handle)
+        timer = StageTimer(enabled=self.instrument)
+        with timer.stage('io'):
+            with open(path, 'r') as input_handle:
+                text = input_handle.read()
+        with timer.stage('json'):
+            data = json.loads(text)
+        if self.annotations is not None:
+            with timer.stage('annotations'):
+                data['nlp_table'] = self.annotations.get_table(os.path.basename(path))
         if self.preprocessor is None:
             return data
-        else:
-            return self.preprocessor(data)
+
+        output = self.preprocessor(data)
+        if self.instrument:
+            output.setdefault('timings', {}).update(timer.timings)
+        return output
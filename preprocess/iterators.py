@@ -0,0 +1,443 @@
+import multiprocessing
+import os
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from chainer.dataset import Iterator
+from chainer.serializer import Deserializer
+
+from preprocess.corpus import iter_shard, load_index
+
+# Datasets available to the workers of the PrefetchIterator (set by the pool initializer)
+_worker_datasets = {}
+
+
+def _register_dataset(key, dataset):
+    _worker_datasets[key] = dataset
+
+
+def _fetch_example(arguments):
+    key, index = arguments
+    return _worker_datasets[key][index]
+
+
+class PrefetchIterator(Iterator):
+    """Dataset iterator that loads the examples in a pool of worker threads or processes.
+
+    The iterator visits the examples in the same way as the SerialIterator, but keeps a number of batches ahead in
+    flight, such that loading and preprocessing the next batches runs in parallel with the training step. In the
+    'process' mode, the workers are forked from the training process, so the dataset (including the preprocessor and
+    the vocabularies) is not pickled; only the indices and the loaded examples are sent between the processes.
+    """
+
+    def __init__(self, dataset, batch_size, repeat=True, shuffle=True, n_workers=None, n_prefetch=1, mode='thread'):
+        """Initialize the iterator.
+
+        Parameters
+        ----------
+        dataset : dataset
+            Dataset to iterate.
+        batch_size : int
+            Number of examples within each batch.
+        repeat : bool, optional
+            If True, it infinitely loops over the dataset, otherwise it stops at the end of the first epoch
+            (default: True).
+        shuffle : bool, optional
+            If True, the order of the examples is shuffled at the beginning of each epoch (default: True).
+        n_workers : int, optional
+            Number of worker threads or processes (default: None, the number of CPUs).
+        n_prefetch : int, optional
+            Number of batches loaded ahead of the current batch (default: 1).
+        mode : str, optional
+            Either 'thread' or 'process' (default: 'thread').
+        """
+        if mode not in ('thread', 'process'):
+            raise ValueError('Unknown mode: %s' % mode)
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self._repeat = repeat
+        self._shuffle = shuffle
+        self.n_workers = n_workers if n_workers is not None else os.cpu_count()
+        self.n_prefetch = n_prefetch
+        self.mode = mode
+        self._key = '%s-%d' % (os.getpid(), id(self))
+        self._pool = None
+        self.reset()
+
+    def __next__(self):
+        if self._pool is None:
+            # The processes are forked, so they inherit the dataset (which is not pickled) whatever the default start
+            # method of the platform
+            pool_class = multiprocessing.get_context('fork').Pool if self.mode == 'process' else ThreadPool
+            self._pool = pool_class(self.n_workers, initializer=_register_dataset, initargs=(self._key, self.dataset))
+
+        # Keep the current batch and n_prefetch batches ahead in flight
+        while len(self._pending) < self.n_prefetch + 1:
+            scheduled = self._schedule()
+            if scheduled is None:
+                break
+            indices, state = scheduled
+            result = self._pool.map_async(_fetch_example, [(self._key, index) for index in indices], chunksize=1)
+            self._pending.append((result, state))
+
+        if len(self._pending) == 0:
+            raise StopIteration
+
+        self._previous_epoch_detail = self.epoch_detail
+        result, state = self._pending.popleft()
+        batch = result.get()
+        self.current_position, self.epoch, self.is_new_epoch, self._order = state
+        return batch
+
+    next = __next__
+
+    def _schedule(self):
+        """Advance the scheduling state (which runs ahead of the delivered batches) by one batch.
+
+        Returns
+        -------
+        tuple
+            The indices of the next batch and the iterator state after delivering this batch, or None when the end of
+            the dataset is reached and the iterator does not repeat.
+        """
+        position, epoch, is_new_epoch, order = self._scheduled_state
+        if not self._repeat and epoch > 0:
+            return None
+
+        dataset_size = len(self.dataset)
+        end_position = position + self.batch_size
+        indices = list(order[position:end_position]) if order is not None else list(range(position, min(
+            end_position, dataset_size)))
+
+        if end_position >= dataset_size:
+            if self._repeat:
+                rest = end_position - dataset_size
+                if order is not None:
+                    order = np.random.permutation(dataset_size) if self._shuffle else order
+                    indices += list(order[:rest])
+                else:
+                    indices += list(range(rest))
+                position = rest
+            else:
+                position = 0
+            epoch += 1
+            is_new_epoch = True
+        else:
+            is_new_epoch = False
+            position = end_position
+
+        self._scheduled_state = (position, epoch, is_new_epoch, order)
+        return indices, self._scheduled_state
+
+    @property
+    def epoch_detail(self):
+        return self.epoch + self.current_position / len(self.dataset)
+
+    @property
+    def previous_epoch_detail(self):
+        if self._previous_epoch_detail < 0:
+            return None
+        return self._previous_epoch_detail
+
+    @property
+    def repeat(self):
+        return self._repeat
+
+    def reset(self):
+        """Reset the iterator to the beginning of the first epoch and drop the batches in flight."""
+        self.current_position = 0
+        self.epoch = 0
+        self.is_new_epoch = False
+        self._previous_epoch_detail = -1.
+        self._order = np.random.permutation(len(self.dataset)) if self._shuffle else None
+        self._scheduled_state = (self.current_position, self.epoch, self.is_new_epoch, self._order)
+        self._pending = deque()
+
+    def serialize(self, serializer):
+        self.current_position = serializer('current_position', self.current_position)
+        self.epoch = serializer('epoch', self.epoch)
+        self.is_new_epoch = serializer('is_new_epoch', self.is_new_epoch)
+        if self._order is not None:
+            serializer('order', self._order)
+        self._previous_epoch_detail = serializer('previous_epoch_detail', self._previous_epoch_detail)
+
+        # Continue scheduling from the (restored) delivered state
+        self._scheduled_state = (self.current_position, self.epoch, self.is_new_epoch, self._order)
+        self._pending = deque()
+
+    def finalize(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
+def get_window_counts(dataset, max_windows_per_entity=0):
+    """Count the windows of every document of a dataset.
+
+    Parameters
+    ----------
+    dataset : dataset
+        Dataset of preprocessed documents (see the Preprocessor class). When the dataset has a window_counts method
+        (such as the CachedDataset), it is used, otherwise every document is loaded once.
+    max_windows_per_entity : int, optional
+        Maximum number of windows counted per entity (default: 0, no maximum).
+
+    Returns
+    -------
+    numpy.ndarray
+        The total number of windows (of all entities) of each document.
+    """
+    if hasattr(dataset, 'window_counts'):
+        return np.asarray(dataset.window_counts(max_windows_per_entity=max_windows_per_entity))
+    cap = max_windows_per_entity if max_windows_per_entity > 0 else np.inf
+    return np.array([sum(min(len(windows), cap) for windows in dataset[index]['document'].values())
+                     for index in range(len(dataset))], dtype=np.int64)
+
+
+class BucketIterator(Iterator):
+    """Dataset iterator building batches under a budget of windows instead of a fixed number of documents.
+
+    At the beginning of every epoch, the (shuffled) documents are divided into buckets of bucket_size documents. The
+    documents of each bucket are sorted by their number of windows and cut into batches which contain as many documents
+    as fit in the window budget (a document exceeding the budget forms a batch on its own). Finally, the order of the
+    batches is shuffled. Every document is visited exactly once per epoch, while batches combine documents of similar
+    size and the number of windows per optimizer step is bounded.
+    """
+
+    def __init__(self, dataset, window_budget, sizes, repeat=True, shuffle=True, bucket_size=100):
+        """Initialize the iterator.
+
+        Parameters
+        ----------
+        dataset : dataset
+            Dataset to iterate.
+        window_budget : int
+            Maximum number of windows within each batch.
+        sizes : numpy.ndarray
+            The number of windows of each document (see the get_window_counts method).
+        repeat : bool, optional
+            If True, it infinitely loops over the dataset, otherwise it stops at the end of the first epoch
+            (default: True).
+        shuffle : bool, optional
+            If True, the documents and batches are shuffled at the beginning of each epoch (default: True).
+        bucket_size : int, optional
+            Number of documents which are sorted by size together (default: 100).
+        """
+        if len(sizes) != len(dataset):
+            raise ValueError('Expected %d sizes, got %d' % (len(dataset), len(sizes)))
+        self.dataset = dataset
+        self.window_budget = window_budget
+        self.sizes = np.asarray(sizes, dtype=np.int64)
+        self._repeat = repeat
+        self._shuffle = shuffle
+        self.bucket_size = bucket_size
+        self.reset()
+
+    def plan_epoch(self):
+        """Divide the documents of an epoch into batches.
+
+        Returns
+        -------
+        numpy.ndarray
+            The indices of the documents in the order in which they are visited.
+        numpy.ndarray
+            Boolean array marking the positions (in the order) at which a new batch starts.
+        """
+        dataset_size = len(self.dataset)
+        order = np.random.permutation(dataset_size) if self._shuffle else np.arange(dataset_size)
+        batches = []
+        for bucket_start in range(0, dataset_size, self.bucket_size):
+            bucket = order[bucket_start:bucket_start + self.bucket_size]
+            bucket = bucket[np.argsort(self.sizes[bucket], kind='mergesort')]
+            batch, windows_count = [], 0
+            for index in bucket:
+                if len(batch) > 0 and windows_count + self.sizes[index] > self.window_budget:
+                    batches.append(batch)
+                    batch, windows_count = [], 0
+                batch.append(index)
+                windows_count += self.sizes[index]
+            if len(batch) > 0:
+                batches.append(batch)
+        if self._shuffle:
+            batches = [batches[index] for index in np.random.permutation(len(batches))]
+
+        starts = np.zeros(dataset_size, dtype=np.bool_)
+        starts[np.cumsum([0] + [len(batch) for batch in batches[:-1]])[:len(batches)]] = True
+        order = np.array([index for batch in batches for index in batch], dtype=np.int64)
+        return order, starts
+
+    def __next__(self):
+        if not self._repeat and self.epoch > 0:
+            raise StopIteration
+
+        self._previous_epoch_detail = self.epoch_detail
+        dataset_size = len(self.dataset)
+        end_position = self.current_position + 1
+        while end_position < dataset_size and not self._starts[end_position]:
+            end_position += 1
+        batch = [self.dataset[index] for index in self._order[self.current_position:end_position]]
+
+        if end_position >= dataset_size:
+            self.current_position = 0
+            self.epoch += 1
+            self.is_new_epoch = True
+            self._order, self._starts = self.plan_epoch()
+        else:
+            self.current_position = end_position
+            self.is_new_epoch = False
+        return batch
+
+    next = __next__
+
+    @property
+    def epoch_detail(self):
+        return self.epoch + self.current_position / len(self.dataset)
+
+    @property
+    def previous_epoch_detail(self):
+        if self._previous_epoch_detail < 0:
+            return None
+        return self._previous_epoch_detail
+
+    @property
+    def repeat(self):
+        return self._repeat
+
+    def reset(self):
+        """Reset the iterator to the beginning of the first epoch."""
+        if len(self.dataset) == 0:
+            raise ValueError('The dataset does not contain any documents to iterate')
+        self.current_position = 0
+        self.epoch = 0
+        self.is_new_epoch = False
+        self._previous_epoch_detail = -1.
+        self._order, self._starts = self.plan_epoch()
+
+    def serialize(self, serializer):
+        self.current_position = serializer('current_position', self.current_position)
+        self.epoch = serializer('epoch', self.epoch)
+        self.is_new_epoch = serializer('is_new_epoch', self.is_new_epoch)
+        serializer('order', self._order)
+        serializer('starts', self._starts)
+        self._previous_epoch_detail = serializer('previous_epoch_detail', self._previous_epoch_detail)
+
+
+class ShuffleBufferIterator(Iterator):
+    """Dataset iterator streaming the documents of a sharded JSONL corpus through a bounded shuffle buffer.
+
+    Every epoch, the shards are read sequentially in a random order. The documents are put in a buffer of at most
+    buffer_size documents from which a random document is emitted whenever a new one is read, such that only the
+    buffer is held in memory. The iterator does not store its position within an epoch, so after resuming from a
+    snapshot the interrupted epoch starts over.
+    """
+
+    def __init__(self, path, batch_size, buffer_size=10000, transform=None, repeat=True, holdout=0):
+        """Initialize the iterator.
+
+        Parameters
+        ----------
+        path : str
+            Path to the sharded JSONL corpus.
+        batch_size : int
+            Number of examples within each batch.
+        buffer_size : int, optional
+            Maximum number of documents in the shuffle buffer (default: 10000).
+        transform : callable, optional
+            Function applied to each document (for example a Preprocessor, default: None).
+        repeat : bool, optional
+            If True, it infinitely loops over the corpus, otherwise it stops at the end of the first epoch
+            (default: True).
+        holdout : int, optional
+            Number of documents at the start of the corpus which are left out, for example because they are used as
+            test set (default: 0, see the read_documents method).
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.transform = transform
+        self._repeat = repeat
+        self.holdout = holdout
+        self.shards = load_index(path)['shards']
+        self.epoch_size = sum(shard['documents'] for shard in self.shards) - holdout
+        if self.epoch_size <= 0:
+            raise ValueError('The corpus %s does not contain any documents to iterate' % path)
+        self.reset()
+
+    def iter_epoch(self):
+        """Iterate over the documents of one epoch in shuffled order.
+
+        Returns
+        -------
+        iterator
+            An iterator over the documents (data) of the corpus except the held out documents.
+        """
+        shard_offsets = np.cumsum([0] + [shard['documents'] for shard in self.shards])
+        buffer = []
+        for shard_index in np.random.permutation(len(self.shards)):
+            shard_path = os.path.join(self.path, self.shards[shard_index]['name'])
+            skip = max(0, self.holdout - shard_offsets[shard_index])
+            for document_index, (_, data) in enumerate(iter_shard(shard_path)):
+                if document_index < skip:
+                    continue
+                if len(buffer) < self.buffer_size:
+                    buffer.append(data)
+                    continue
+                buffer_index = np.random.randint(len(buffer))
+                yield buffer[buffer_index]
+                buffer[buffer_index] = data
+        np.random.shuffle(buffer)
+        yield from buffer
+
+    def __next__(self):
+        if not self._repeat and self.epoch > 0:
+            raise StopIteration
+
+        self._previous_epoch_detail = self.epoch_detail
+        self.is_new_epoch = False
+        batch = []
+        while len(batch) < self.batch_size:
+            data = next(self._documents)
+            batch.append(self.transform(data) if self.transform is not None else data)
+            self.current_position += 1
+            if self.current_position == self.epoch_size:
+                self.current_position = 0
+                self.epoch += 1
+                self.is_new_epoch = True
+                self._documents = self.iter_epoch()
+                if not self._repeat:
+                    break
+        return batch
+
+    next = __next__
+
+    @property
+    def epoch_detail(self):
+        return self.epoch + self.current_position / self.epoch_size
+
+    @property
+    def previous_epoch_detail(self):
+        if self._previous_epoch_detail < 0:
+            return None
+        return self._previous_epoch_detail
+
+    @property
+    def repeat(self):
+        return self._repeat
+
+    def reset(self):
+        """Reset the iterator to the beginning of the first epoch."""
+        self.current_position = 0
+        self.epoch = 0
+        self.is_new_epoch = False
+        self._previous_epoch_detail = -1.
+        self._documents = self.iter_epoch()
+
+    def serialize(self, serializer):
+        self.epoch = serializer('epoch', self.epoch)
+        self.is_new_epoch = serializer('is_new_epoch', self.is_new_epoch)
+        self._previous_epoch_detail = serializer('previous_epoch_detail', self._previous_epoch_detail)
+        if isinstance(serializer, Deserializer):
+            self.current_position = 0
+            self._documents = self.iter_epoch()
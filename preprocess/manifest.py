@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+
+
+def hash_bytes(data):
+    """Compute the content hash of a document.
+
+    Parameters
+    ----------
+    data : bytes
+        The contents of the document.
+
+    Returns
+    -------
+    str
+        The hexadecimal SHA-1 digest of the contents.
+    """
+    return hashlib.sha1(data).hexdigest()
+
+
+class Manifest:
+    """Append-only log of the content hash and the processing state of documents.
+
+    Every update is appended as a JSON line ({doc_id, hash, state, size, mtime_ns}) and flushed immediately, such that
+    after a crash the manifest contains every document which was completely processed. When loading the manifest, the
+    last entry of a document wins. The size and modification time of a file are stored next to its hash, so the hash of
+    an unchanged file is known without reading it.
+    """
+
+    def __init__(self, path):
+        """Load the manifest (when it exists) and open it for appending.
+
+        Parameters
+        ----------
+        path : str
+            Path to the manifest file.
+        """
+        self.path = path
+        self.entries = {}
+        needs_newline = False
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as manifest_handle:
+                for line in manifest_handle:
+                    needs_newline = not line.endswith('\n')
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line which was cut off by a crash
+                        continue
+                    self.entries[entry['doc_id']] = entry
+        self.manifest_handle = open(path, 'a', encoding='utf-8')
+        if needs_newline:
+            self.manifest_handle.write('\n')
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.entries
+
+    def get_state(self, doc_id, content_hash):
+        """Get the processing state of a document.
+
+        Parameters
+        ----------
+        doc_id : str
+            The identifier of the document.
+        content_hash : str
+            The current content hash of the document.
+
+        Returns
+        -------
+        str
+            The recorded state, or None when the document is unknown or changed since the state was recorded.
+        """
+        entry = self.entries.get(doc_id)
+        if entry is None or entry['hash'] != content_hash:
+            return None
+        return entry['state']
+
+    def known_hash(self, doc_id, path):
+        """Get the recorded content hash of a file when the file did not change since it was recorded.
+
+        Parameters
+        ----------
+        doc_id : str
+            The identifier of the document.
+        path : str
+            Path to the file.
+
+        Returns
+        -------
+        str
+            The recorded content hash, or None when the size or modification time of the file changed.
+        """
+        stat = os.stat(path)
+        entry = self.entries.get(doc_id)
+        if entry is not None and entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+            return entry['hash']
+        return None
+
+    def file_hash(self, doc_id, path):
+        """Get the content hash of a file, reading the file only when its size or modification time changed.
+
+        Parameters
+        ----------
+        doc_id : str
+            The identifier of the document.
+        path : str
+            Path to the file.
+
+        Returns
+        -------
+        str
+            The content hash of the file (see the hash_bytes method).
+        """
+        content_hash = self.known_hash(doc_id, path)
+        if content_hash is None:
+            with open(path, 'rb') as file_handle:
+                content_hash = hash_bytes(file_handle.read())
+        return content_hash
+
+    def record(self, doc_id, content_hash, state, path=None):
+        """Record the processing state of a document.
+
+        Parameters
+        ----------
+        doc_id : str
+            The identifier of the document.
+        content_hash : str
+            The content hash of the document.
+        state : str
+            The processing state (for example 'annotated').
+        path : str, optional
+            Path to the file of the document, whose size and modification time are recorded (default: None).
+        """
+        entry = {'doc_id': doc_id, 'hash': content_hash, 'state': state}
+        if path is not None:
+            stat = os.stat(path)
+            entry['size'] = stat.st_size
+            entry['mtime_ns'] = stat.st_mtime_ns
+        self.manifest_handle.write(json.dumps(entry) + '\n')
+        self.manifest_handle.flush()
+        self.entries[doc_id] = entry
+
+    def close(self):
+        self.manifest_handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,156 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+
+def get_cache_key(text, annotators):
+    """Compute the cache key of the annotations of a text.
+
+    Parameters
+    ----------
+    text : str
+        The annotated text.
+    annotators : str
+        The comma-separated annotators (and any other settings that change the output of the server).
+
+    Returns
+    -------
+    str
+        The hexadecimal SHA-256 digest of the annotators and the text.
+    """
+    digest = hashlib.sha256(annotators.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(text.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class AnnotationCache:
+    """Size-bounded on-disk cache of Stanford CoreNLP outputs, addressed by the hash of the text and the annotators.
+
+    Every output is stored as a gzip-compressed JSON file named after its key (in a subdirectory per first two
+    characters of the key). Reading an entry updates its modification time, so when the total size of the entries
+    exceeds the maximum size, the least recently used entries (oldest modification time) are removed until the cache
+    is at 90% of its maximum size. The cache can be shared by multiple threads.
+    """
+
+    def __init__(self, path, max_bytes=2 ** 30):
+        """Open the cache (the directory is created when it does not exist).
+
+        Parameters
+        ----------
+        path : str
+            Path to the cache directory.
+        max_bytes : int, optional
+            Maximum total size of the cached entries in bytes (default: 1 GiB, use 0 for an unbounded cache).
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+        self.total_bytes = sum(size for _, _, size in self.iter_entries())
+
+    def iter_entries(self):
+        """Iterate over the entries of the cache.
+
+        Returns
+        -------
+        iterator
+            An iterator over (path, modification time, size) tuples.
+        """
+        for directory in os.scandir(self.path):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.name.endswith('.json.gz'):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_mtime_ns, stat.st_size
+
+    def get_path(self, key):
+        """Get the path of the entry of a key."""
+        return os.path.join(self.path, key[:2], key + '.json.gz')
+
+    def __contains__(self, key):
+        return os.path.exists(self.get_path(key))
+
+    def get(self, key):
+        """Get a cached output.
+
+        Parameters
+        ----------
+        key : str
+            The cache key (see the get_cache_key method).
+
+        Returns
+        -------
+        dict
+            The cached output, or None when the key is not cached.
+        """
+        path = self.get_path(key)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as entry_handle:
+                data = json.load(entry_handle)
+            os.utime(path, None)
+        except (OSError, ValueError):
+            # Missing (or evicted by another thread) or cut off by a crash
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Store an output in the cache, evicting the least recently used entries when the cache is full.
+
+        Parameters
+        ----------
+        key : str
+            The cache key (see the get_cache_key method).
+        data : dict
+            The output of the Stanford CoreNLP server.
+        """
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with gzip.open(temporary_path, 'wt', encoding='utf-8') as entry_handle:
+            json.dump(data, entry_handle)
+        size = os.path.getsize(temporary_path)
+        previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(temporary_path, path)
+
+        with self.lock:
+            self.total_bytes += size - previous_size
+            if 0 < self.max_bytes < self.total_bytes:
+                self.evict(int(.9 * self.max_bytes))
+
+    def evict(self, target_bytes):
+        """Remove the least recently used entries until the total size does not exceed the target size."""
+        for path, _, size in sorted(self.iter_entries(), key=lambda entry: entry[1]):
+            if self.total_bytes <= target_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.total_bytes -= size
+
+    def stats(self):
+        """Get the statistics of the cache.
+
+        Returns
+        -------
+        dict
+            The number of hits and misses, the hit rate and the total size of the entries in bytes.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0.,
+                'bytes': self.total_bytes
+            }
@@ -0,0 +1,120 @@
+import os
+import random
+
+import numpy as np
+
+
+def reservoir_sample(count, size, rng):
+    """Draw a uniform sample of items from a stream of items using reservoir sampling.
+
+    Parameters
+    ----------
+    count : int
+        Number of items in the stream.
+    size : int
+        Number of sampled items.
+    rng : random.Random
+        The random number generator.
+
+    Returns
+    -------
+    np.ndarray
+        The sorted indices of the sampled items (all indices when count does not exceed size).
+    """
+    reservoir = list(range(min(count, size)))
+    for index in range(size, count):
+        slot = rng.randint(0, index)
+        if slot < size:
+            reservoir[slot] = index
+    return np.array(sorted(reservoir), dtype=np.int64)
+
+
+def evenly_spaced_sample(count, size):
+    """Select evenly spaced items (the centers of size equal parts of the items).
+
+    Parameters
+    ----------
+    count : int
+        Number of items.
+    size : int
+        Number of selected items.
+
+    Returns
+    -------
+    np.ndarray
+        The sorted indices of the selected items (all indices when count does not exceed size).
+    """
+    if count <= size:
+        return np.arange(count, dtype=np.int64)
+    return (2 * np.arange(size, dtype=np.int64) + 1) * count // (2 * size)
+
+
+def cap_windows(example, max_windows, rng=None):
+    """Limit the number of windows (and mentions) of every entity of a preprocessed document.
+
+    Parameters
+    ----------
+    example : dict
+        A preprocessed document (see the Preprocessor class).
+    max_windows : int
+        Maximum number of windows per entity.
+    rng : random.Random, optional
+        When given, the windows are drawn by reservoir sampling, otherwise evenly spaced windows are selected (default:
+        None).
+
+    Returns
+    -------
+    dict
+        A copy of the document in which the 'document' windows and the 'sequence' positions of the entities with more
+        than max_windows mentions are replaced by the same subset of at most max_windows mentions.
+    """
+    example = dict(example)
+    document = dict(example['document'])
+    sequence = dict(example['sequence']) if 'sequence' in example else None
+    positions = dict(sequence['positions']) if sequence is not None else {}
+    for entity, windows in document.items():
+        if len(windows) <= max_windows:
+            continue
+        if rng is None:
+            indices = evenly_spaced_sample(len(windows), max_windows)
+        else:
+            indices = reservoir_sample(len(windows), max_windows, rng)
+        document[entity] = windows[indices]
+        if entity in positions:
+            positions[entity] = positions[entity][indices]
+    example['document'] = document
+    if sequence is not None:
+        sequence['positions'] = positions
+        example['sequence'] = sequence
+    return example
+
+
+class WindowSampler:
+    """Transformation which draws a new sample of at most a given number of windows per entity on every call.
+
+    Used on the training set, every epoch sees a different subset of the windows of the frequently mentioned entities.
+    The random number generator is reseeded (from the seed and the process id) when the sampler is called in another
+    process than the one it was created in, so the loader processes forked from the training process (which all start
+    with a copy of the same state) draw different samples.
+    """
+
+    def __init__(self, max_windows, seed=None):
+        """Initialize the sampler.
+
+        Parameters
+        ----------
+        max_windows : int
+            Maximum number of windows per entity.
+        seed : int, optional
+            Seed of the random number generator (default: None).
+        """
+        self.max_windows = max_windows
+        self.seed = seed
+        self.pid = os.getpid()
+        self.rng = random.Random(seed)
+
+    def __call__(self, example):
+        if os.getpid() != self.pid:
+            self.pid = os.getpid()
+            self.rng = random.Random(None if self.seed is None else '%d-%d' % (self.seed, self.pid))
+        return cap_windows(example, self.max_windows, rng=self.rng)
@@ -0,0 +1,235 @@
+import numpy as np
+
+
+class TokenTable:
+    """Struct-of-arrays representation of the tokens of a document.
+
+    Instead of a list of token dicts, the table stores one column per token attribute (word, POS-tag, NER-tag,
+    sentence and index), such that the tokens can be converted to identifiers at once and windows can be cut out of the
+    identifier arrays by offset.
+    """
+
+    def __init__(self, words, postags, ners, sentences, indices):
+        """Initialize the token table.
+
+        Parameters
+        ----------
+        words : list
+            The words of the tokens.
+        postags : list
+            The POS-tags of the tokens.
+        ners : list
+            The NER-tags of the tokens.
+        sentences : np.ndarray
+            The (1-based) sentence numbers of the tokens.
+        indices : np.ndarray
+            The (1-based) indices of the tokens in their sentences.
+        """
+        self.words = list(words)
+        self.postags = list(postags)
+        self.ners = list(ners)
+        self.sentences = np.asarray(sentences, dtype=np.int32)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.label_codes = np.full(len(self.words), -1, dtype=np.int32)
+        self.labels = []
+        self.positions = {}
+
+    @classmethod
+    def from_corenlp(cls, corenlp_data):
+        """Create a token table from the output of the Stanford CoreNLP client.
+
+        Parameters
+        ----------
+        corenlp_data : dict
+            The output of the Stanford CoreNLP client.
+
+        Returns
+        -------
+        TokenTable
+            The token table containing all tokens of all sentences.
+        """
+        words, postags, ners, sentences, indices = [], [], [], [], []
+        for sentence_index, sentence in enumerate(corenlp_data['sentences']):
+            for token in sentence['tokens']:
+                words.append(token['originalText'])
+                postags.append(token['pos'])
+                ners.append(token['ner'])
+            sentences += [sentence_index + 1] * len(sentence['tokens'])
+            indices += range(1, len(sentence['tokens']) + 1)
+        return cls(words, postags, ners, sentences, indices)
+
+    @classmethod
+    def from_compact(cls, words, postags, ners, sentence_lengths):
+        """Create a token table from the columns of the compact annotation store (see preprocess.annotations).
+
+        Parameters
+        ----------
+        words : list
+            The words (original text) of the tokens of all sentences.
+        postags : list
+            The POS-tags of the tokens.
+        ners : list
+            The NER-tags of the tokens.
+        sentence_lengths : np.ndarray
+            The number of tokens of each sentence.
+
+        Returns
+        -------
+        TokenTable
+            The token table containing all tokens of all sentences.
+        """
+        sentence_lengths = np.asarray(sentence_lengths, dtype=np.int64)
+        sentence_starts = np.cumsum(sentence_lengths) - sentence_lengths
+        sentences = np.repeat(np.arange(1, len(sentence_lengths) + 1), sentence_lengths)
+        indices = np.arange(len(words)) - np.repeat(sentence_starts, sentence_lengths) + 1
+        return cls(words, postags, ners, sentences, indices)
+
+    def __len__(self):
+        return len(self.words)
+
+    def get_tokens(self, start, end):
+        """Get the tokens in the given range as token dicts (see the corenlp_to_tokens method).
+
+        Parameters
+        ----------
+        start : int
+            Position of the first token.
+        end : int
+            Position after the last token.
+
+        Returns
+        -------
+        list
+            A list containing tokens (dicts).
+        """
+        return [{
+            'word': self.words[position],
+            'ner': self.ners[position],
+            'pos': self.postags[position],
+            'sentence': int(self.sentences[position]),
+            'index': int(self.indices[position])
+        } for position in range(start, end)]
+
+    def get_entity_spans(self):
+        """Find the spans of all entities (consecutive tokens having the same NER-tag which is not 'O').
+
+        Returns
+        -------
+        list
+            A list of (start, end) tuples in which the tokens of an entity are found at the positions start to end
+            (exclusive), in the same order as the entities found by the get_entities method.
+        """
+        spans = []
+        start = None
+        for position, ner in enumerate(self.ners + ['O']):
+            if start is not None and ner != self.ners[start]:
+                spans.append((start, position))
+                start = None
+            if start is None and ner != 'O':
+                start = position
+        return spans
+
+    def replace_entities(self, spans, entities):
+        """Replace entities by entity markers and index the positions of the markers.
+
+        Parameters
+        ----------
+        spans : list
+            The (start, end) spans of the entities (see the get_entity_spans method).
+        entities : list
+            The entities corresponding to the spans, in which the first token of each entity has a 'label' attribute
+            (for example obtained by the cluster_entities method).
+
+        Returns
+        -------
+        dict
+            A mapping from entity labels to the sorted positions of their entity markers.
+
+        Notes
+        -----
+        The head token of an entity is replaced by an entity marker ("@entity...") and the remaining entity tokens are
+        emptied. The tokens of the entities are updated accordingly.
+        """
+        for (start, end), entity in zip(spans, entities):
+            label = entity[0]['label']
+            # Only the tokens in the sentence of the head token are replaced
+            same_sentence = int(np.sum(self.sentences[start:end] == self.sentences[start]))
+            count = max(0, min(int(self.indices[end - 1]) - int(self.indices[start]) + 1, same_sentence))
+            if count > 0:
+                entity[0]['entity'] = ' '.join(self.words[start:end])
+            for offset in range(count):
+                self.words[start + offset] = label if offset == 0 else ''
+                entity[offset]['word'] = self.words[start + offset]
+            for token in entity:
+                token['label'] = label
+
+        # Index the positions of all entity markers
+        self.labels = list(dict.fromkeys(entity[0]['label'] for entity in entities))
+        codes = {label: code for code, label in enumerate(self.labels)}
+        self.label_codes = np.full(len(self.words), -1, dtype=np.int32)
+        positions = {label: [] for label in self.labels}
+        for position, word in enumerate(self.words):
+            if word in codes:
+                self.label_codes[position] = codes[word]
+                positions[word].append(position)
+        self.positions = {label: np.array(positions[label], dtype=np.int64) for label in self.labels}
+        return self.positions
+
+
+def pad_rows(array, pre_size, post_size, value):
+    """Pad an array along the first axis.
+
+    Parameters
+    ----------
+    array : np.ndarray
+        The array to pad.
+    pre_size : int
+        Number of rows added before the array.
+    post_size : int
+        Number of rows added after the array.
+    value : object
+        The value (or row) used for the padding.
+
+    Returns
+    -------
+    np.ndarray
+        The padded array.
+    """
+    padding = np.empty((pre_size + post_size,) + array.shape[1:], dtype=array.dtype)
+    padding[...] = value
+    return np.concatenate([padding[:pre_size], array, padding[pre_size:]], axis=0)
+
+
+def get_window_ids(padded_ids, padded_codes, positions, label_code, window_size, target_ids=None):
+    """Cut the windows around the given positions out of the padded identifier array.
+
+    Parameters
+    ----------
+    padded_ids : np.ndarray
+        A (tokens + window_size - 1, 3) array of token identifiers padded by pad_rows, such that the window around
+        position p starts at row p.
+    padded_codes : np.ndarray
+        The label codes of the tokens (see TokenTable.replace_entities) padded in the same way with -1.
+    positions : np.ndarray
+        The positions of the entity markers.
+    label_code : int
+        The label code of the entity.
+    window_size : int
+        Number of tokens in a window.
+    target_ids : tuple, optional
+        The (word_id, postag_id, entity_id) tuple of the '@target' marker. When given, the word and entity
+        identifiers of the markers of the entity in the windows are replaced by those of the '@target' marker
+        (default: None).
+
+    Returns
+    -------
+    np.ndarray
+        A (windows, window_size, 3) int32 array.
+    """
+    window_indices = positions[:, np.newaxis] + np.arange(window_size)
+    windows = padded_ids[window_indices]
+    if target_ids is not None:
+        mask = padded_codes[window_indices] == label_code
+        windows[mask, 0] = target_ids[0]
+        windows[mask, 2] = target_ids[2]
+    return windows
@@ -0,0 +1,72 @@
+import time
+
+
+class NullContext:
+    """Context manager that does nothing (used when timing is disabled)."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class StageTimer:
+    """Accumulates the time spent in named stages.
+
+    Example:
+        >>> timer = StageTimer()
+        >>> with timer.stage('tokenize'):
+        >>>     tokens = tokenize(text)
+        >>> timer.timings
+        {'tokenize': 0.0012}
+    """
+
+    def __init__(self, enabled=True):
+        """Initialize the timer.
+
+        Parameters
+        ----------
+        enabled : bool, optional
+            When False, stages are not timed and the overhead of the stage method is negligible (default: True).
+        """
+        self.enabled = enabled
+        self.timings = {}
+
+    def stage(self, name):
+        """Time a stage.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage (the time of stages with the same name is summed).
+
+        Returns
+        -------
+        context manager
+            Context manager timing the code in its block.
+        """
+        if not self.enabled:
+            return NULL_CONTEXT
+        return StageContext(self, name)
+
+
+class StageContext:
+    """Context manager adding the time spent in its block to a stage of a StageTimer."""
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start_time
+        self.timer.timings[self.name] = self.timer.timings.get(self.name, 0.) + elapsed
+        return False
+
+
+NULL_CONTEXT = NullContext()
@@ -1,47 +1,67 @@
+from functools import lru_cache
+
 import numpy as np
 import unidecode
 
 
+def normalize_word(word):
+    """Normalize a word such that it can be looked up in the word vocabulary.
+
+    Parameters
+    ----------
+    word : str
+        The word to normalize.
+
+    Returns
+    -------
+    str
+        Lower-cased word in which special characters are replaced by their ASCII representation.
+    """
+    return unidecode.unidecode(word.lower())
+
+
 class Tokenizer:
     """Converts (word, postag) tuples to [word_id, postag_id, entity_id] tuples.
 
     Example:
-        >>> # Tokenize two sentences/windows: "hello world @entity" and "hello @entity":
-        >>> tokenizer = Tokenizer(vocab_words={'<PAD>': 0, '<UNK>': 1, 'hello': 2, 'world': 2},
+        >>> # Tokenize two windows: "hello world @entity" and "hello @entity <PAD>":
+        >>> tokenizer = Tokenizer(vocab_words={'<PAD>': 0, '<UNK>': 1, 'hello': 2, 'world': 3},
         >>>                       vocab_postags={'<PAD>': 0, '<UNK>': 1},
         >>>                       vocab_entities={'<PAD>': 0, '<UNK>': 1, '@entity': 2})
         >>>
         >>> tokenizer.tokenize_document({
         >>> '@entity': [
         >>>        [
-        >>>           {'word': 'hello', 'postag': 'NNP'},
-        >>>           {'word': 'world', 'postag': 'NN'},
-        >>>           {'word': '@entity', 'postag': 'NN'}
+        >>>           {'word': 'hello', 'pos': 'NNP'},
+        >>>           {'word': 'world', 'pos': 'NN'},
+        >>>           {'word': '@entity', 'pos': 'NN'}
         >>>        ],
         >>>        [
-        >>>           {'word': 'hello', 'postag': 'NNP'},
-        >>>           {'word': '@entity', 'postag': 'NN'}
+        >>>           {'word': 'hello', 'pos': 'NNP'},
+        >>>           {'word': '@entity', 'pos': 'NN'},
+        >>>           {'word': '<PAD>', 'pos': '<PAD>'}
         >>>        ]
         >>>    ]
         >>> })
 
     Output:
         >>> {
-        >>>    '@entity': [
-        >>>       np.matrix([
-        >>>          [2, 1, 0],
+        >>>    '@entity': np.array([
+        >>>       [
         >>>          [2, 1, 0],
+        >>>          [3, 1, 0],
         >>>          [1, 1, 0]
-        >>>       ]),
-        >>>       np.matrix([
+        >>>       ],
+        >>>       [
         >>>          [2, 1, 0],
-        >>>          [1, 1, 0]
-        >>>       ])
-        >>>    ]
+        >>>          [1, 1, 0],
+        >>>          [1, 0, 0]
+        >>>       ]
+        >>>    ], dtype=np.int32)
         >>> }
     """
 
-    def __init__(self, vocab_words=None, vocab_postags=None, vocab_entities=None):
+    def __init__(self, vocab_words=None, vocab_postags=None, vocab_entities=None, cache_size=2 ** 16):
         """Initialize the tokenizer.
 
         Parameters
@@ -52,13 +72,26 @@ class Tokenizer:
             A mapping from POS-tag to POS-tag identifiers (postag_id) used for the tokenization.
         vocab_entities : dict
             A mapping from entity words to entity identifiers (entity_id) used for the tokenization.
+        cache_size : int, optional
+            Maximum number of distinct (word, postag) tuples for which the identifiers are cached (default: 65536).
         """
         self.vocab_words = vocab_words if vocab_words is not None else {'<PAD>': 0, '<UNK>': 1}
         self.vocab_postags = vocab_postags if vocab_postags is not None else {'<PAD>': 0, '<UNK>': 1}
         self.vocab_entities = vocab_entities if vocab_entities is not None else {'<PAD>': 0, '<UNK>': 1}
+        self.cache_size = cache_size
+        self.tokenize_cached = lru_cache(maxsize=cache_size)(self.tokenize_uncached)
 
-    def tokenize(self, word, postag=None):
-        """Converts (word, postag) tuples to [word_id, postag_id, entity_id] tuples.
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['tokenize_cached']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.tokenize_cached = lru_cache(maxsize=self.cache_size)(self.tokenize_uncached)
+
+    def tokenize_uncached(self, word, postag=None):
+        """Converts (word, postag) tuples to (word_id, postag_id, entity_id) tuples without using the cache.
 
         Parameters
         ----------
@@ -70,14 +103,52 @@ class Tokenizer:
         Returns
         -------
         tuple
-            A [word_id, postag_id, entity_id] tuple.
+            A (word_id, postag_id, entity_id) tuple.
         """
-        word = unidecode.unidecode(word.lower()) if word not in self.vocab_entities.keys() else None
+        word = normalize_word(word) if word not in self.vocab_entities.keys() else None
         entity = word if word in self.vocab_entities.keys() else None
         word_id = self.vocab_words.get(word, self.vocab_words.get('<UNK>'))
         postag_id = self.vocab_postags.get(postag, self.vocab_postags.get('<UNK>'))
         entity_id = self.vocab_entities.get(entity, self.vocab_entities.get('<PAD>'))
-        return [word_id, postag_id, entity_id]
+        return word_id, postag_id, entity_id
+
+    def tokenize(self, word, postag=None):
+        """Converts (word, postag) tuples to [word_id, postag_id, entity_id] tuples.
+
+        The identifiers of recently seen (word, postag) tuples are cached, such that a word occurring in many windows is
+        only normalized and looked up once.
+
+        Parameters
+        ----------
+        word : str
+            The word to use.
+        postag : str, optional
+            The POS-tag to use (default: None).
+
+        Returns
+        -------
+        tuple
+            A [word_id, postag_id, entity_id] tuple.
+        """
+        return list(self.tokenize_cached(word, postag))
+
+    def tokenize_columns(self, words, postags):
+        """Tokenize columns of words and POS-tags (for example the columns of a TokenTable).
+
+        Parameters
+        ----------
+        words : list
+            The words to use.
+        postags : list
+            The POS-tags to use (one for each word).
+
+        Returns
+        -------
+        np.ndarray
+            A (len(words), 3) int32 matrix in which the rows are [word_id, postag_id, entity_id] tuples.
+        """
+        return np.array([self.tokenize_cached(word, postag) for word, postag in zip(words, postags)],
+                        dtype=np.int32).reshape(-1, 3)
 
     def tokenize_window(self, window):
         """Tokenize a window.
@@ -85,20 +156,21 @@ class Tokenizer:
         Parameters
         ----------
         window : list
-            The window which is a list of items in which each item contains at least a 'word' field and a 'postag'
+            The window which is a list of items in which each item contains at least a 'word' field and a 'pos'
             field.
 
         Returns
         -------
-        np.matrix
-            A matrix with columns word_id_window, postag_id_window, entity_id_window in which:
+        np.ndarray
+            An int32 matrix with columns word_id_window, postag_id_window, entity_id_window in which:
              - word_id_window is a list of word_id elements which are the identifiers of the given words.
              - postag_id_window is a list of postag_id elements which are identifiers of the given POS-tags.
              - entity_id_window is a list of entity_id elements which are identifiers of the given entities.
             Furthermore, the rows of the matrix correspond to the different items in the given window.
         """
 
-        return [self.tokenize(item['word'], item['pos']) for item in window]
+        return np.array([self.tokenize_cached(item['word'], item['pos']) for item in window],
+                        dtype=np.int32).reshape(-1, 3)
 
     def tokenize_document(self, document):
         """Tokenize a document.
@@ -106,15 +178,23 @@ class Tokenizer:
         Parameters
         ----------
         document : dict
-            A mapping (dict) from entities to a list of windows in which the windows correspond to the given entities.
+            A mapping (dict) from entities to a list of (equally sized) windows in which the windows correspond to the
+            given entities.
 
         Returns
         -------
         dict
-            A mapping (dict) from entities to a list consisting of windows in which each window is a matrix in which the
-            rows correspond to tokenized words (see the tokenize_window method for more details).
+            A mapping (dict) from entities to a contiguous int32 array of shape (windows, window length, 3) in which
+            each window is a matrix whose rows correspond to tokenized words (see the tokenize_window method for more
+            details).
         """
         representation = {}
         for entity in document:
-            representation[entity] = [self.tokenize_window(window) for window in document[entity]]
+            windows = document[entity]
+            if len(windows) == 0:
+                representation[entity] = np.zeros((0, 0, 3), dtype=np.int32)
+                continue
+            representation[entity] = np.array(
+                [[self.tokenize_cached(item['word'], item['pos']) for item in window] for window in windows],
+                dtype=np.int32).reshape(len(windows), -1, 3)
         return representation
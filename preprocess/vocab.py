@@ -1,7 +1,7 @@
 import csv
+import os
 
 import numpy as np
-import pandas as pd
 
 VOCAB_POSTAGS = ['<PAD>', '<UNK>', 'CC', 'CD', 'DT', 'EX', 'FW', 'IN', 'JJ', 'JJR', 'JJS', 'LS', 'MD', 'NN', 'NNS',
                  'NNP', 'NNPS', 'PDT', 'POS', 'PRP', 'PRP$', 'RB', 'RBR', 'RBS', 'RP', 'SYM', 'TO', 'UH', 'VB', 'VBD',
@@ -10,13 +10,128 @@ VOCAB_POSTAGS = ['<PAD>', '<UNK>', 'CC', 'CD', 'DT', 'EX', 'FW', 'IN', 'JJ', 'JJ
 VOCAB_ENTITIES = ['<PAD>'] + ['@target'] + ['@entity%d' % i for i in range(1, 128)]
 
 
-def load_glove_file(path):
+def get_glove_cache_paths(path):
+    """Get the paths of the binary cache of a GloVe file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the GloVe file.
+
+    Returns
+    -------
+    str
+        Path to the vocabulary file (one word per line).
+    str
+        Path to the float32 .npy weight matrix.
+    """
+    return path + '.vocab', path + '.npy'
+
+
+def get_marker_weights(words_count, words_dim):
+    """Initialize vectors for the <PAD> (zeros) and <UNK> (initialized using Xavier initializer) markers.
+
+    Parameters
+    ----------
+    words_count : int
+        Number of words in the GloVe file.
+    words_dim : int
+        Dimensionality of the word vectors.
+
+    Returns
+    -------
+    np.ndarray
+        A 2 x m matrix containing the <PAD> and <UNK> vectors.
+    """
+    xavier_bound = np.sqrt(6.) / np.sqrt(words_count + words_dim)
+    markers_matrix = [np.zeros((1, words_dim))]
+    markers_matrix += [np.random.uniform(-xavier_bound, xavier_bound, (1, words_dim))]
+    return np.vstack(markers_matrix)
+
+
+def read_glove_table(path, chunksize=None):
+    """Parse the GloVe text file into a data frame indexed by the words.
+
+    The words are read as strings without NA filtering, so words such as "null", "NaN" and "NA" are kept as they are.
+
+    Parameters
+    ----------
+    path : str
+        Path to the GloVe file.
+    chunksize : int, optional
+        When given, an iterator over data frames of this number of lines is returned (default: None).
+
+    Returns
+    -------
+    pd.DataFrame
+        The data frame (or an iterator over chunks of it) containing one row of weights per word.
+    """
+    # Pandas is only imported for parsing the text file (it is not needed for loading the cache)
+    import pandas as pd
+    return pd.read_table(path, sep=' ', index_col=0, header=None, quoting=csv.QUOTE_NONE, dtype={0: str},
+                         na_filter=False, chunksize=chunksize)
+
+
+def convert_glove_file(path, chunk_size=100000):
+    """Convert the GloVe file to a binary cache which is picked up by the load_glove_file method.
+
+    The cache consists of a vocabulary file and a float32 .npy matrix (see get_glove_cache_paths) in which the <PAD>
+    and <UNK> markers are already in place. The file is converted in chunks, such that the full text file never has to
+    be held in memory.
+
+    Parameters
+    ----------
+    path : str
+        Path to the GloVe file.
+    chunk_size : int, optional
+        Number of lines parsed at once (default: 100000).
+
+    Returns
+    -------
+    str
+        Path to the vocabulary file.
+    str
+        Path to the weight matrix.
+    """
+    vocab_path, weights_path = get_glove_cache_paths(path)
+    with open(path, 'rb') as input_handle:
+        words_count = sum(1 for line in input_handle if line.strip())
+
+    chunks = read_glove_table(path, chunksize=chunk_size)
+
+    weights = None
+    offset = 2
+    with open(vocab_path + '.tmp', 'w', encoding='utf-8') as vocab_handle:
+        vocab_handle.write('<PAD>\n<UNK>')
+        for chunk in chunks:
+            if weights is None:
+                words_dim = chunk.shape[1]
+                weights = np.lib.format.open_memmap(weights_path + '.tmp', mode='w+', dtype=np.float32,
+                                                    shape=(words_count + 2, words_dim))
+                weights[:2] = get_marker_weights(words_count, words_dim)
+            weights[offset:offset + len(chunk)] = chunk.values
+            offset += len(chunk)
+            vocab_handle.write(''.join('\n' + word for word in chunk.index.values))
+    weights.flush()
+    del weights
+
+    os.replace(weights_path + '.tmp', weights_path)
+    os.replace(vocab_path + '.tmp', vocab_path)
+    return vocab_path, weights_path
+
+
+def load_glove_file(path, mmap_mode='r'):
     """Load the GloVe file.
 
+    When a binary cache of the GloVe file exists (see convert_glove_file), the vocabulary and the memory-mapped weight
+    matrix are loaded from the cache instead of parsing the text file.
+
     Parameters
     ----------
     path : str
         Path to the GloVe file.
+    mmap_mode : str, optional
+        Mode used for memory-mapping the cached weight matrix (default: 'r', see np.load).
 
     Returns
     -------
@@ -27,7 +142,15 @@ def load_glove_file(path):
         containing the pre-trained weights found in the GloVe file.
     """
 
-    df_words = pd.read_table(path, sep=' ', index_col=0, header=None, quoting=csv.QUOTE_NONE)
+    vocab_path, weights_path = get_glove_cache_paths(path)
+    if os.path.exists(vocab_path) and os.path.exists(weights_path) and (
+            not os.path.exists(path) or os.path.getmtime(weights_path) >= os.path.getmtime(path)):
+        with open(vocab_path, 'r', encoding='utf-8') as vocab_handle:
+            vocab = vocab_handle.read().split('\n')
+        weights = np.load(weights_path, mmap_mode=mmap_mode)
+        return vocab, weights
+
+    df_words = read_glove_table(path)
 
     # Load the vocabulary and the weight matrix
     vocab = df_words.index.values.tolist()
@@ -35,13 +158,87 @@ def load_glove_file(path):
     words_count, words_dim = weights.shape
 
     # Initialize vectors for the <PAD> (zeros) and <UNK> (initialized using Xavier initializer) markers
-    xavier_bound = np.sqrt(6.) / np.sqrt(words_count + words_dim)
-    markers_matrix = [np.zeros((1, words_dim))]
-    markers_matrix += [np.random.uniform(-xavier_bound, xavier_bound, (1, words_dim))]
-    markers_matrix = np.vstack(markers_matrix)
+    markers_matrix = get_marker_weights(words_count, words_dim)
 
     # Augment the word vocabulary with the markers
     vocab = ['<PAD>', '<UNK>'] + vocab
     weights = np.vstack([markers_matrix, weights])
 
     return vocab, weights
+
+
+def get_source_index_path(path):
+    """Get the path of the mapping from the rows of a pruned embedding file to the rows of its source file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the pruned embedding file (see the prune_glove_file method).
+
+    Returns
+    -------
+    str
+        Path to the int64 .npy array containing the source row of every row of the pruned weight matrix.
+    """
+    return path + '.source.npy'
+
+
+def load_source_index(path):
+    """Load the mapping from the rows of a pruned embedding file to the rows of its source file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the embedding file.
+
+    Returns
+    -------
+    np.ndarray
+        The source row of every row of the pruned weight matrix, or None when the embedding file is not pruned.
+    """
+    source_index_path = get_source_index_path(path)
+    if not os.path.exists(source_index_path):
+        return None
+    return np.load(source_index_path)
+
+
+def prune_glove_file(path, words, output_path):
+    """Prune the GloVe vocabulary to the given words (for example the words found in the training corpus).
+
+    The pruned embeddings are written in the format of the binary cache (see convert_glove_file), such that they can be
+    loaded by the load_glove_file method using output_path. The rows of the pruned weight matrix (including the <PAD>
+    and <UNK> markers) are copied from the binary cache of the GloVe file, which is created first when it does not
+    exist. Hence, the word embeddings of a model trained on the pruned embeddings can be replaced by the full GloVe
+    embeddings at inference time, so that words which did not occur in the training corpus are not mapped to <UNK>.
+    The rows of the source matrix are stored as well (see get_source_index_path).
+
+    Parameters
+    ----------
+    path : str
+        Path to the GloVe file.
+    words : set
+        The (normalized, see preprocess.tokens.normalize_word) words which are kept.
+    output_path : str
+        Path to the pruned embedding file (no text file is written, only the binary cache).
+
+    Returns
+    -------
+    int
+        Number of words in the pruned vocabulary (including the markers).
+    """
+    vocab_path, weights_path = get_glove_cache_paths(path)
+    if not os.path.exists(vocab_path) or not os.path.exists(weights_path):
+        convert_glove_file(path)
+    vocab, weights = load_glove_file(path)
+
+    source_index = np.array([0, 1] + [index for index, word in enumerate(vocab) if index >= 2 and word in words],
+                            dtype=np.int64)
+    output_vocab_path, output_weights_path = get_glove_cache_paths(output_path)
+    np.save(get_source_index_path(output_path), source_index)
+    with open(output_weights_path + '.tmp', 'wb') as weights_handle:
+        np.save(weights_handle, np.asarray(weights[source_index], dtype=np.float32))
+    with open(output_vocab_path + '.tmp', 'w', encoding='utf-8') as vocab_handle:
+        vocab_handle.write('\n'.join(vocab[index] for index in source_index))
+    os.replace(output_weights_path + '.tmp', output_weights_path)
+    os.replace(output_vocab_path + '.tmp', output_vocab_path)
+    return len(source_index)
@@ -1,49 +1,266 @@
 import argparse
 import json
 import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from tqdm import tqdm
 
-from preprocess import StanfordCoreNLPClient
+from preprocess import ANNOTATOR_PROFILES, StanfordCoreNLPClient
+from preprocess.annotations import AnnotationWriter
+from preprocess.corpus import JSONLShardWriter, is_sharded, iter_documents, load_index, parse_document
+from preprocess.manifest import Manifest, hash_bytes
+from preprocess.nlp_cache import AnnotationCache
+
+
+def annotate_document(file_data, corenlp_client):
+    """Add the output of the Stanford CoreNLP pipeline to a document.
+
+    Parameters
+    ----------
+    file_data : dict
+        The document (contents of a JSON input file).
+    corenlp_client : StanfordCoreNLPClient
+        The client used for annotating the text field.
+
+    Returns
+    -------
+    int
+        Number of characters sent to the Stanford CoreNLP server (0 when the document was already annotated or its
+        annotations were cached).
+    """
+    # Check for the nlp_data field
+    characters = 0
+    if 'nlp_data' not in file_data:
+        # Apply the Stanford CoreNLP pipeline to the text field
+        file_text = file_data.get('text')
+        characters = 0 if corenlp_client.is_cached(file_text) else len(file_text)
+        nlp_data = corenlp_client(file_text)
+
+        # Set the field
+        file_data['nlp_data'] = nlp_data
+
+    return characters
+
+
+def iter_changed_documents(path, manifest, state):
+    """Iterate over the JSON files of a folder, skipping the files which did not change since they reached a state.
+
+    Parameters
+    ----------
+    path : str
+        Path to the folder containing the JSON files.
+    manifest : Manifest
+        The manifest in which the content hashes and states of the files are recorded.
+    state : str
+        The state of the files which are skipped when unchanged.
+
+    Returns
+    -------
+    iterator
+        An iterator over (doc_id, data, content_hash) tuples in which doc_id is the file name and data is None for the
+        skipped files, or the error for files which cannot be parsed. Files whose size and modification time did not
+        change are skipped without reading them. Temporary files left by an interrupted run are removed.
+    """
+    for entry in os.scandir(path):
+        if not entry.is_file():
+            continue
+        if entry.name.endswith('.tmp'):
+            # A document rewritten by an interrupted run (the document itself is unchanged)
+            os.remove(entry.path)
+            continue
+        content_hash = manifest.known_hash(entry.name, entry.path)
+        if content_hash is not None and manifest.get_state(entry.name, content_hash) == state:
+            yield entry.name, None, content_hash
+            continue
+
+        with open(entry.path, 'rb') as input_handle:
+            content = input_handle.read()
+        content_hash = hash_bytes(content)
+        if manifest.get_state(entry.name, content_hash) == state:
+            # The file was touched but its contents did not change
+            manifest.record(entry.name, content_hash, state, path=entry.path)
+            yield entry.name, None, content_hash
+        else:
+            yield entry.name, parse_document(content, errors='return'), content_hash
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Add the output of the Stanford CoreNLP pipeline and entity alignment information to the JSON '
                     'files found in the folder specified by the input argument.')
     parser.add_argument('input',
-                        help='Path to the input files (folder containing JSON files).')
+                        help='Path to the input files (folder containing JSON files or a sharded JSONL corpus).')
+    parser.add_argument('--output', default='',
+                        help='Folder in which the annotated documents are written as a sharded JSONL corpus (required '
+                             'for sharded input, by default the JSON files are updated in place).')
+    parser.add_argument('--annotations', default='',
+                        help='Folder in which only the tokens, POS-tags, NER-tags and sentence boundaries are stored '
+                             'in a compact annotation store (the documents themselves are not rewritten).')
+    parser.add_argument('--shard_size', default=10000, type=int,
+                        help='Number of documents per shard of the output corpus or the annotation store.')
+    parser.add_argument('--manifest', default='',
+                        help='Path to the manifest in which the content hash and state of every JSON file is recorded, '
+                             'such that unchanged files are skipped when the script is run again (default: '
+                             '<input>.manifest.jsonl when updating the files in place and manifest.jsonl in the '
+                             'annotation store).')
+    parser.add_argument('--compress', action='store_true',
+                        help='Compress the shards of the output corpus with gzip.')
     parser.add_argument('--corenlp_url',
                         help='URL of the Stanford CoreNLP server.')
+    parser.add_argument('--profile', default='lean', choices=sorted(ANNOTATOR_PROFILES),
+                        help='Annotators requested from the Stanford CoreNLP server: lean (%s, everything used by the '
+                             'preprocessing) or full (%s).' % (ANNOTATOR_PROFILES['lean'], ANNOTATOR_PROFILES['full']))
+    parser.add_argument('--cache_dir', default='',
+                        help='Directory of the cache in which the annotations are stored by the hash of the text and '
+                             'the annotators, such that repeated texts are not sent to the server again.')
+    parser.add_argument('--cache_size', default=1024, type=float,
+                        help='Maximum size of the annotation cache in MB (least recently used annotations are removed '
+                             'first, 0 for no maximum).')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='Number of requests sent to the Stanford CoreNLP server concurrently.')
+    parser.add_argument('--timeout', default=60., type=float,
+                        help='Number of seconds after which a request to the Stanford CoreNLP server times out.')
+    parser.add_argument('--retries', default=3, type=int,
+                        help='Number of retries for requests that time out or fail with a server error.')
+    parser.add_argument('--backoff', default=1., type=float,
+                        help='Number of seconds to wait before the first retry (doubles for every next retry).')
+    parser.add_argument('--report', default='annotation_report.json',
+                        help='Path to the JSON report in which the files that could not be annotated are stored.')
     parser.set_defaults(corenlp_url='http://localhost:9000')
     args = parser.parse_args()
 
+    if args.output and args.annotations:
+        parser.error('the --output and --annotations arguments cannot be combined')
+    if is_sharded(args.input) and not args.output and not args.annotations:
+        parser.error('the --output or --annotations argument is required for a sharded input corpus')
+
     # Setup the Stanford CoreNLP client
-    corenlp_client = StanfordCoreNLPClient(args.corenlp_url)
+    cache = AnnotationCache(args.cache_dir, max_bytes=int(args.cache_size * 2 ** 20)) if args.cache_dir else None
+    corenlp_client = StanfordCoreNLPClient(args.corenlp_url, timeout=args.timeout, retries=args.retries,
+                                           backoff=args.backoff, pool_size=args.workers, annotators=args.profile,
+                                           cache=cache)
+    writer = JSONLShardWriter(args.output, shard_size=args.shard_size, compress=args.compress) if args.output else None
+    annotation_writer = AnnotationWriter(args.annotations, shard_size=args.shard_size,
+                                         append=not is_sharded(args.input)) if args.annotations else None
 
-    # Process all the files
-    progressbar = tqdm(os.listdir(args.input))
-    for file in progressbar:
-        progressbar.set_description(file)
-        path = os.path.join(args.input, file)
+    # Setup the manifest (only for folders of JSON files which are updated in place or stored as annotations)
+    manifest = None
+    if not is_sharded(args.input) and writer is None:
+        if args.annotations:
+            manifest_state = 'stored'
+            manifest = Manifest(args.manifest or os.path.join(args.annotations, 'manifest.jsonl'))
+        else:
+            manifest_state = 'annotated'
+            manifest = Manifest(args.manifest or args.input.rstrip(os.sep) + '.manifest.jsonl')
 
-        # Try to read the file
-        file_data = None
-        with open(path, 'r') as file_handle:
-            file_data = json.load(file_handle)
+    # Process all the documents, keeping at most the given number of requests in flight
+    if is_sharded(args.input):
+        total = sum(shard['documents'] for shard in load_index(args.input)['shards'])
+    else:
+        total = len(os.listdir(args.input))
+    if manifest is not None:
+        documents = iter_changed_documents(args.input, manifest, manifest_state)
+    else:
+        documents = ((doc_id, file_data, None) for doc_id, file_data in iter_documents(args.input, errors='return'))
+    content_hashes = {}
+    progressbar = tqdm(total=total)
+    failures = {}
+    documents_count, characters_count, skipped_count = 0, 0, 0
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        pending = {}
+        while True:
+            for doc_id, file_data, content_hash in documents:
+                if file_data is None:
+                    skipped_count += 1
+                    progressbar.update()
+                    continue
+                if isinstance(file_data, ValueError):
+                    # The document could not be parsed
+                    failures[doc_id] = '%s: %s' % (type(file_data).__name__, file_data)
+                    if manifest is not None:
+                        manifest.record(doc_id, content_hash, 'failed')
+                    progressbar.update()
+                    continue
 
-        # Skip if the file could not be loaded
-        if file_data is None:
-            continue
+                # Files which are updated in place are only rewritten when they were not annotated yet
+                if writer is None and annotation_writer is None and 'nlp_data' in file_data:
+                    if manifest is not None:
+                        manifest.record(doc_id, content_hash, manifest_state, path=os.path.join(args.input, doc_id))
+                    skipped_count += 1
+                    progressbar.update()
+                    continue
+                content_hashes[doc_id] = content_hash
+                pending[executor.submit(annotate_document, file_data, corenlp_client)] = (doc_id, file_data)
+                if len(pending) >= args.workers:
+                    break
+            if len(pending) == 0:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                doc_id, file_data = pending.pop(future)
+                try:
+                    characters_count += future.result()
+                    documents_count += 1
 
-        # Check for the nlp_data field
-        if 'nlp_data' not in file_data:
-            # Apply the Stanford CoreNLP pipeline to the text field
-            file_text = file_data.get('text')
-            nlp_data = corenlp_client(file_text)
+                    # Store the data
+                    if annotation_writer is not None:
+                        # The documents are recorded in the manifest once their shard is written
+                        for stored_id in annotation_writer.write(doc_id, file_data['nlp_data']):
+                            stored_hash = content_hashes.pop(stored_id)
+                            if manifest is not None:
+                                manifest.record(stored_id, stored_hash, manifest_state,
+                                                path=os.path.join(args.input, stored_id))
+                    elif writer is not None:
+                        writer.write(file_data)
+                        content_hashes.pop(doc_id)
+                    else:
+                        path = os.path.join(args.input, doc_id)
+                        content = json.dumps(file_data).encode('utf-8')
+                        # Replace the document at once, so an interruption never leaves a truncated document
+                        with open(path + '.tmp', 'wb') as file_handle:
+                            file_handle.write(content)
+                        os.replace(path + '.tmp', path)
+                        manifest.record(doc_id, hash_bytes(content), manifest_state, path=path)
+                        content_hashes.pop(doc_id)
+                except Exception as error:
+                    failures[doc_id] = '%s: %s' % (type(error).__name__, error)
+                    failed_hash = content_hashes.pop(doc_id, None)
+                    if manifest is not None:
+                        manifest.record(doc_id, failed_hash, 'failed')
 
-            # Set the field
-            file_data['nlp_data'] = nlp_data
+                elapsed = max(time.time() - start_time, 1e-9)
+                progressbar.set_description(str(doc_id))
+                postfix = {
+                    'docs/sec': '%.2f' % (documents_count / elapsed),
+                    'chars/sec': '%.0f' % (characters_count / elapsed),
+                    'failed': len(failures),
+                    'skipped': skipped_count
+                }
+                if cache is not None:
+                    postfix['cache hits'] = '%.1f%%' % (100 * cache.stats()['hit_rate'])
+                progressbar.set_postfix(postfix)
+                progressbar.update()
+    progressbar.close()
+    if writer is not None:
+        writer.close()
+    if annotation_writer is not None:
+        for stored_id in annotation_writer.close():
+            stored_hash = content_hashes.pop(stored_id)
+            if manifest is not None:
+                manifest.record(stored_id, stored_hash, manifest_state, path=os.path.join(args.input, stored_id))
+    if manifest is not None:
+        manifest.close()
 
-        # Store the data
-        with open(path, 'w') as file_handle:
-            json.dump(file_data, file_handle)
+    # Store the documents that could not be annotated
+    report = {'annotated': documents_count, 'skipped': skipped_count, 'failed': failures}
+    if cache is not None:
+        report['cache'] = cache.stats()
+        print('Annotation cache: %(hits)d hits, %(misses)d misses (hit rate %(hit_rate).1f%%)' % dict(
+            report['cache'], hit_rate=100 * report['cache']['hit_rate']))
+    with open(args.report, 'w') as report_handle:
+        json.dump(report, report_handle, indent=2)
+    if len(failures) > 0:
+        print('%d documents could not be annotated, see %s' % (len(failures), args.report))
@@ -0,0 +1,277 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import numpy as np
+
+from model.extensions import load_snapshot
+from model.secnn import create_model
+from preprocess import Preprocessor, get_entity_mentions
+from preprocess.tokens import Tokenizer
+from preprocess.vocab import *
+
+
+class LatencyTracker:
+    """Keeps track of the most recent latencies and reports their percentiles."""
+
+    def __init__(self, size=10000):
+        """Initialize the latency tracker.
+
+        Parameters
+        ----------
+        size : int, optional
+            Number of most recent latencies used for the percentiles (default: 10000).
+        """
+        self.latencies = deque(maxlen=size)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, latency):
+        """Add a latency (in seconds)."""
+        with self.lock:
+            self.latencies.append(latency)
+            self.count += 1
+
+    def summary(self):
+        """Summarize the latencies.
+
+        Returns
+        -------
+        dict
+            The number of observed latencies and the 50th, 90th and 99th percentiles and maximum in milliseconds.
+        """
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000.
+            count = self.count
+        if len(latencies) == 0:
+            return {'count': count}
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        return {'count': count, 'p50_ms': p50, 'p90_ms': p90, 'p99_ms': p99, 'max_ms': float(latencies.max())}
+
+
+class MicroBatcher:
+    """Coalesces concurrent scoring requests into micro-batches.
+
+    Requests are queued and a single worker thread takes them from the queue. A batch is run as soon as it contains
+    max_batch_size requests or when max_wait seconds passed since its first request arrived.
+    """
+
+    def __init__(self, predict, max_batch_size=32, max_wait=.005):
+        """Initialize the micro-batcher and start its worker thread.
+
+        Parameters
+        ----------
+        predict : callable
+            Function mapping a list of items to a list of results (for example SECNN.predict).
+        max_batch_size : int, optional
+            Maximum number of items in a batch (default: 32).
+        max_wait : float, optional
+            Maximum number of seconds a batch waits for more items (default: 0.005).
+        """
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.batch_sizes = deque(maxlen=1000)
+        self.batches_count = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        """Submit an item and wait for its result.
+
+        Parameters
+        ----------
+        item : object
+            The item (for example a tokenized document).
+
+        Returns
+        -------
+        object
+            The result for the item.
+        """
+        future = Future()
+        self.queue.put((item, future))
+        return future.result()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self.batch_sizes.append(len(batch))
+            self.batches_count += 1
+            self.run_batch(batch)
+
+    def run_batch(self, batch):
+        """Score a batch of (item, future) tuples.
+
+        When scoring the batch fails, its items are scored one by one, such that a single failing item only fails its
+        own request.
+        """
+        try:
+            results = self.predict([item for item, _ in batch])
+        except Exception as error:
+            if len(batch) == 1:
+                batch[0][1].set_exception(error)
+            else:
+                for request in batch:
+                    self.run_batch([request])
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def summary(self):
+        """Summarize the state of the micro-batcher.
+
+        Returns
+        -------
+        dict
+            The current queue depth, the number of batches and the mean size of the recent batches.
+        """
+        batch_sizes = list(self.batch_sizes)
+        return {
+            'queue_depth': self.queue.qsize(),
+            'batches': self.batches_count,
+            'mean_batch_size': float(np.mean(batch_sizes)) if len(batch_sizes) > 0 else 0.
+        }
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def create_handler(preprocessor, batcher, latencies, input_key='document'):
+    """Create the request handler class of the scoring service.
+
+    Parameters
+    ----------
+    preprocessor : Preprocessor
+        The preprocessor applied to the posted documents.
+    batcher : MicroBatcher
+        The micro-batcher scoring the tokenized documents.
+    latencies : LatencyTracker
+        The tracker of the request latencies.
+    input_key : str, optional
+        The output of the preprocessor which is scored (see SECNN.input_key, default: 'document').
+
+    Returns
+    -------
+    type
+        A BaseHTTPRequestHandler subclass handling POST /score and GET /stats.
+    """
+
+    class ScoringHandler(BaseHTTPRequestHandler):
+
+        def send_json(self, status, data):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != '/stats':
+                self.send_json(404, {'error': 'Not found'})
+                return
+            stats = {'latency': latencies.summary()}
+            stats.update(batcher.summary())
+            self.send_json(200, stats)
+
+        def do_POST(self):
+            if self.path != '/score':
+                self.send_json(404, {'error': 'Not found'})
+                return
+            start_time = time.time()
+            try:
+                data = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+                preprocessed = preprocessor(data)
+            except Exception as error:
+                # Errors raised while reading or preprocessing the request are caused by an invalid document
+                self.send_json(400, {'error': '%s: %s' % (type(error).__name__, error)})
+                return
+
+            try:
+                scores = batcher.submit(preprocessed[input_key])
+            except Exception as error:
+                self.send_json(500, {'error': '%s: %s' % (type(error).__name__, error)})
+                return
+            mentions = get_entity_mentions(preprocessed['entities'])
+            self.send_json(200, {'entities': [{'entity': entity, 'mention': mentions.get(entity), 'score': score}
+                                              for entity, score in scores.items()]})
+            latencies.add(time.time() - start_time)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ScoringHandler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve a trained SECNN model over HTTP. Documents (JSON containing the nlp_data field) are posted '
+                    'to /score and the latency percentiles and queue depth are available at /stats.')
+    parser.add_argument('glove_file',
+                        help='Path to the GloVe word embeddings file used for training.')
+    parser.add_argument('snapshot',
+                        help='Path to the snapshot created by the train script.')
+    parser.add_argument('--snapshot_path', default='updater/model:main/',
+                        help='Path of the model in the snapshot (use an empty string for a snapshot of the model '
+                             'only).')
+    parser.add_argument('--frozen_mismatch', default='raise', choices=['raise', 'warn'],
+                        help='Raise an error or warn when the word embeddings differ from those used for training a '
+                             'slim snapshot (the full embeddings can be used after training on pruned ones).')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Host name the server listens on.')
+    parser.add_argument('--port', default=8080, type=int,
+                        help='Port the server listens on.')
+    parser.add_argument('--max_windows_per_entity', default=0, type=int,
+                        help='Maximum number of windows per entity, of which evenly spaced windows are kept (default: '
+                             '0, use all windows).')
+    parser.add_argument('--max_batch_size', default=32, type=int,
+                        help='Maximum number of documents scored at once.')
+    parser.add_argument('--max_wait_ms', default=5., type=float,
+                        help='Maximum number of milliseconds a request waits for other requests to batch with.')
+    parser.add_argument('--encoder', default='window', choices=['window', 'sentence', 'document'],
+                        help='Encode every entity window separately or every sentence or document once (must match '
+                             'the encoder used for training).')
+    parser.add_argument('--batched', action='store_true',
+                        help='Use the batched mode of the model (must match the mode used for training).')
+    args = parser.parse_args()
+
+    # Convert vocab lists to dictionaries
+    VOCAB_WORDS, W_words = load_glove_file(args.glove_file)
+    VOCAB_WORDS = {word: index for index, word in enumerate(VOCAB_WORDS)}
+    VOCAB_POSTAGS = {postag: index for index, postag in enumerate(VOCAB_POSTAGS)}
+    VOCAB_ENTITIES = {entity: index for index, entity in enumerate(VOCAB_ENTITIES)}
+
+    # Create the tokenizer and the preprocessor
+    tokenizer = Tokenizer(vocab_words=VOCAB_WORDS, vocab_postags=VOCAB_POSTAGS, vocab_entities=VOCAB_ENTITIES)
+    preprocessor = Preprocessor(tokenizer, max_windows_per_entity=args.max_windows_per_entity)
+
+    # Load the model
+    model = create_model(W_words, len(VOCAB_POSTAGS), len(VOCAB_ENTITIES), batched=args.batched,
+                         encoder=args.encoder)
+    load_snapshot(args.snapshot, model, path=args.snapshot_path, on_mismatch=args.frozen_mismatch)
+
+    # Start the server
+    batcher = MicroBatcher(model.predict, max_batch_size=args.max_batch_size, max_wait=args.max_wait_ms / 1000.)
+    handler = create_handler(preprocessor, batcher, LatencyTracker(), input_key=model.input_key)
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print('Serving on http://%s:%d' % (args.host, args.port))
+    server.serve_forever()
@@ -6,10 +6,19 @@ from chainer import training
 from chainer.datasets import TransformDataset, split_dataset
 from chainer.iterators import SerialIterator
 from chainer.training import extensions
+from tqdm import tqdm
 
-from model.secnn import SECNN, SECNNLossWrapper
+from model.extensions import AsyncSnapshot, BackgroundEvaluator, SlimSnapshot, load_snapshot
+from model.parallel import CPUParallelUpdater
+from model.secnn import SECNNLossWrapper, create_model
+from model.updaters import InstrumentedUpdater
 from preprocess import Preprocessor
+from preprocess.annotations import AnnotationStore
+from preprocess.cache import CachedDataset, build_cache
+from preprocess.corpus import is_sharded, read_documents
 from preprocess.files import JSONFileLoader
+from preprocess.iterators import BucketIterator, PrefetchIterator, ShuffleBufferIterator, get_window_counts
+from preprocess.sampling import WindowSampler, cap_windows
 from preprocess.tokens import Tokenizer
 from preprocess.vocab import *
 
@@ -18,7 +27,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Train the SECNN model on the given preprocessed input files.')
     parser.add_argument('input',
-                        help='Path to the input files (folder containing preprocessed JSON files).')
+                        help='Path to the input files (folder containing preprocessed JSON files or a sharded JSONL '
+                             'corpus).')
     parser.add_argument('glove_file',
                         help='Path to the GloVe word embeddings file.')
     parser.add_argument('--resume', '-r', default='',
@@ -27,14 +37,65 @@ if __name__ == '__main__':
                         help='Number of test documents used for validation.')
     parser.add_argument('--snapshot_iterations', default=100, type=int,
                         help='Number of iterations after which a snapshot is created.')
+    parser.add_argument('--slim_snapshots', action='store_true',
+                        help='Leave the frozen word embeddings out of the snapshots (only their checksums are stored).')
+    parser.add_argument('--async_snapshots', action='store_true',
+                        help='Compress and write the snapshots on a background thread while the training continues.')
+    parser.add_argument('--keep_snapshots', default=3, type=int,
+                        help='Number of snapshots kept when writing them asynchronously (0 keeps all snapshots).')
     parser.add_argument('--log_iterations', default=5, type=int,
                         help='Number of iterations after which log lines are written.')
     parser.add_argument('--validation_iterations', default=5, type=int,
                         help='Number of iterations after which the model is evaluated on the test set.')
+    parser.add_argument('--validation_batch_size', default=32, type=int,
+                        help='Number of test documents evaluated at once.')
+    parser.add_argument('--background_validation', action='store_true',
+                        help='Evaluate the model in a separate process on the latest weights, so the training does not '
+                             'wait for the validation.')
     parser.add_argument('--epochs', default=1, type=int,
                         help='Number of epochs used for the training.')
+    parser.add_argument('--annotations', default='',
+                        help='Path to the compact annotation store created by the preprocess_nlp script (used instead '
+                             'of the nlp_data field of the JSON files).')
+    parser.add_argument('--cache', default='',
+                        help='Directory of the preprocessed-tensor cache (built on first use when given).')
+    parser.add_argument('--loader', default='serial', choices=['serial', 'thread', 'process'],
+                        help='Load and preprocess the training documents serially or in a pool of threads or '
+                             'processes.')
+    parser.add_argument('--loader_workers', default=None, type=int,
+                        help='Number of loader threads or processes (default: number of CPUs).')
+    parser.add_argument('--prefetch', default=2, type=int,
+                        help='Number of batches loaded ahead by the loader threads or processes.')
+    parser.add_argument('--shuffle_buffer', default=10000, type=int,
+                        help='Number of documents in the shuffle buffer when training on a sharded JSONL corpus.')
+    parser.add_argument('--batch_size', default=1, type=int,
+                        help='Number of documents per minibatch (unless a window budget is given).')
+    parser.add_argument('--window_budget', default=0, type=int,
+                        help='Build minibatches of documents of similar size containing at most this number of windows '
+                             '(default: 0, one document per minibatch).')
+    parser.add_argument('--bucket_size', default=100, type=int,
+                        help='Number of documents sorted by size together when using a window budget.')
+    parser.add_argument('--max_windows_per_entity', default=0, type=int,
+                        help='Maximum number of windows per entity, sampled anew every epoch for the training '
+                             'documents and evenly spaced for the test documents (default: 0, use all windows).')
+    parser.add_argument('--encoder', default='window', choices=['window', 'sentence', 'document'],
+                        help='Encode every entity window separately or every sentence or document once.')
+    parser.add_argument('--batched', action='store_true',
+                        help='Stack all windows of a minibatch and run the model on them at once.')
+    parser.add_argument('--parallel_workers', default=0, type=int,
+                        help='Number of worker processes among which every minibatch is split (default: 0, train in '
+                             'the main process).')
+    parser.add_argument('--hogwild', action='store_true',
+                        help='Let the parallel workers update the shared parameters asynchronously instead of '
+                             'averaging their gradients.')
+    parser.add_argument('--instrument', action='store_true',
+                        help='Report the throughput (docs/sec, windows/sec) and the time spent loading, preprocessing, '
+                             'in the forward and backward passes and in the optimizer update.')
     args = parser.parse_args()
 
+    if args.parallel_workers > 0 and args.instrument:
+        parser.error('the --parallel_workers and --instrument arguments cannot be combined')
+
     # Convert vocab lists to dictionaries
     VOCAB_WORDS, W_words = load_glove_file(args.glove_file)
     VOCAB_WORDS = {word: index for index, word in enumerate(VOCAB_WORDS)}
@@ -43,48 +104,105 @@ if __name__ == '__main__':
 
     # Create the tokenizer and the preprocessor
     tokenizer = Tokenizer(vocab_words=VOCAB_WORDS, vocab_postags=VOCAB_POSTAGS, vocab_entities=VOCAB_ENTITIES)
-    preprocessor = Preprocessor(tokenizer)
+    preprocessor = Preprocessor(tokenizer, instrument=args.instrument)
+
+    annotations = AnnotationStore(args.annotations) if args.annotations else None
+    file_loader = JSONFileLoader(preprocessor, instrument=args.instrument, annotations=annotations)
+    sampler = WindowSampler(args.max_windows_per_entity) if args.max_windows_per_entity > 0 else None
+    if is_sharded(args.input):
+        # Stream the training documents from the shards and hold out the first documents as test set
+        if args.cache or args.loader != 'serial' or args.window_budget > 0 or args.annotations:
+            parser.error('the --cache, --loader, --window_budget and --annotations arguments are only supported for '
+                         'folders of JSON files')
+        test_set = [preprocessor(data) for _, data in read_documents(args.input, args.test_size)]
+        transform = preprocessor if sampler is None else lambda data: sampler(preprocessor(data))
+        train_iter = ShuffleBufferIterator(args.input, batch_size=args.batch_size, buffer_size=args.shuffle_buffer,
+                                           transform=transform, repeat=True, holdout=len(test_set))
+    else:
+        files = [os.path.join(args.input, file) for file in sorted(os.listdir(args.input))]
 
-    files = [os.path.join(args.input, file) for file in os.listdir(args.input)]
+        # Create file loaders and transformations
+        if args.cache:
+            if args.encoder != 'window':
+                parser.error('the --cache argument is only supported for the window encoder')
+            cache_path = build_cache(files, file_loader, args.cache,
+                                     progressbar=tqdm(total=len(files), desc='Updating cache'))
+            dataset = CachedDataset(cache_path)
+        else:
+            dataset = TransformDataset(files, file_loader.load_file)
 
-    # Create file loaders and transformations
-    file_loader = JSONFileLoader(preprocessor)
-    dataset = TransformDataset(files, file_loader.load_file)
+        # Split the dataset and initialize the dataset iterators
+        test_set, train_set = split_dataset(dataset, args.test_size)
+        if sampler is not None:
+            train_set = TransformDataset(train_set, sampler)
+        if args.window_budget > 0:
+            if args.loader != 'serial':
+                parser.error('the --window_budget argument is only supported with the serial loader')
+            if args.cache:
+                sizes = dataset.window_counts(max_windows_per_entity=args.max_windows_per_entity)[args.test_size:]
+            else:
+                sizes = get_window_counts(train_set, max_windows_per_entity=args.max_windows_per_entity)
+            train_iter = BucketIterator(train_set, args.window_budget, sizes, repeat=True, shuffle=True,
+                                        bucket_size=args.bucket_size)
+        elif args.loader == 'serial':
+            train_iter = SerialIterator(train_set, batch_size=args.batch_size, repeat=True, shuffle=True)
+        else:
+            train_iter = PrefetchIterator(train_set, batch_size=args.batch_size, repeat=True, shuffle=True,
+                                          n_workers=args.loader_workers, n_prefetch=args.prefetch, mode=args.loader)
 
-    # Split the dataset and initialize the dataset iterators
-    test_set, train_set = split_dataset(dataset, args.test_size)
-    train_iter = SerialIterator(train_set, batch_size=1, repeat=True, shuffle=True)
-    test_iter = SerialIterator(test_set[:args.test_size], batch_size=args.test_size, repeat=False, shuffle=False)
+    # Preprocess the test documents once and keep them in memory
+    test_set = list(test_set[:args.test_size])
+    if args.max_windows_per_entity > 0:
+        test_set = [cap_windows(example, args.max_windows_per_entity) for example in test_set]
+    test_iter = SerialIterator(test_set, batch_size=args.validation_batch_size, repeat=False, shuffle=False)
 
     # Initialize the model
-    model = SECNN(
-        config_word={'in_size': W_words.shape[0], 'out_size': W_words.shape[1], 'initialW': W_words},
-        config_postag={'in_size': len(VOCAB_POSTAGS), 'out_size': 32},
-        config_entity={'in_size': len(VOCAB_ENTITIES), 'out_size': 32},
-        config_rnn={'in_size': None, 'out_size': 64},
-        config_affine={'in_size': None, 'out_size': 1},
-    )
+    model = create_model(W_words, len(VOCAB_POSTAGS), len(VOCAB_ENTITIES), batched=args.batched,
+                         encoder=args.encoder)
     loss_model = SECNNLossWrapper(model)
-    model.embed_word.disable_update()
 
-    # Setup the optimizer
+    # Setup the optimizer (the update rules are created by the setup, so the word embeddings are frozen afterwards)
     optimizer = chainer.optimizers.SGD()
     optimizer.setup(model)
+    model.embed_word.disable_update()
 
     # Create the updater and trainer
-    updater = training.StandardUpdater(train_iter, optimizer=optimizer, converter=lambda *arguments: arguments[0],
-                                       loss_func=loss_model.__call__, device=-1)
+    if args.parallel_workers > 0:
+        updater = CPUParallelUpdater(train_iter, optimizer=optimizer, converter=lambda *arguments: arguments[0],
+                                     loss_func=loss_model.__call__, n_workers=args.parallel_workers,
+                                     hogwild=args.hogwild)
+    else:
+        updater_class = InstrumentedUpdater if args.instrument else training.StandardUpdater
+        updater = updater_class(train_iter, optimizer=optimizer, converter=lambda *arguments: arguments[0],
+                                loss_func=loss_model.__call__, device=-1)
     trainer = training.Trainer(updater, (args.epochs, 'epoch'), out='result')
-    trainer.extend(extensions.Evaluator(test_iter, loss_model, converter=lambda *arguments: arguments[0]),
-                   trigger=(args.validation_iterations, 'iteration'))
+
+    # The loss is reported by the loss wrapper, so register it for reporting the training loss as main/loss (and the
+    # validation loss as validation/main/loss instead of mixing it with the training loss)
+    trainer.reporter.add_observer('main', loss_model)
+    evaluator = extensions.Evaluator(test_iter, loss_model, converter=lambda *arguments: arguments[0])
+    if args.background_validation:
+        evaluator = BackgroundEvaluator(evaluator, model)
+    trainer.extend(evaluator, trigger=(args.validation_iterations, 'iteration'))
     trainer.extend(extensions.LogReport(trigger=(args.log_iterations, 'iteration')))
-    trainer.extend(extensions.PrintReport(['epoch', 'iteration', 'loss']))
+    report_entries = ['epoch', 'iteration', 'main/loss', 'validation/main/loss']
+    if args.instrument:
+        report_entries += ['docs/sec', 'windows/sec', 'time/load', 'time/forward', 'time/backward', 'time/update']
+    trainer.extend(extensions.PrintReport(report_entries))
     trainer.extend(extensions.ProgressBar())
-    trainer.extend(extensions.snapshot(), trigger=(args.snapshot_iterations, 'iteration'))
+    source_index = load_source_index(args.glove_file)
+    source_indices = {'embed_word/W': source_index} if source_index is not None else None
+    if args.async_snapshots:
+        snapshot = AsyncSnapshot(keep=args.keep_snapshots, slim=args.slim_snapshots, source_indices=source_indices)
+    elif args.slim_snapshots:
+        snapshot = SlimSnapshot(source_indices=source_indices)
+    else:
+        snapshot = extensions.snapshot()
+    trainer.extend(snapshot, trigger=(args.snapshot_iterations, 'iteration'))
 
     # Resume from a specified snapshot
     if args.resume:
-        chainer.serializers.load_npz(args.resume, trainer)
+        load_snapshot(args.resume, trainer)
 
     # Run the trainer
     trainer.run()